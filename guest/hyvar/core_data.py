@@ -1,5 +1,10 @@
 #!/usr/bin/python
 
+import re
+import bisect
+import heapq
+
+
 __author__ = "Michael Lienhardt and Jacopo Mauro"
 __copyright__ = "Copyright 2017, Michael Lienhardt and Jacopo Mauro"
 __license__ = "GPL3"
@@ -70,14 +75,57 @@ def spl_core_get_subslot(spl_core):
 ######################################################################
 
 
+# patterns are interned: the same atoms (e.g., virtual/pkgconfig) occur many times in the portage tree,
+# and all their occurrences share the same pattern object
+__pattern_atom_table = {}  # mapping from the atoms already translated to their pattern
+__pattern_table = {}       # mapping from the patterns to their canonical instance
+__pattern_nb_requests = 0  # number of calls to pattern_create_from_atom since the last call to pattern_pop_nb_requests
+
+
+def pattern_intern(pattern):
+	"""
+	returns the canonical instance of a pattern
+	:param pattern: the pattern to intern (e.g., a pattern received from another process)
+	:return: the canonical pattern equal to the parameter
+	"""
+	return __pattern_table.setdefault(pattern, pattern)
+
+
 def pattern_create_from_atom(atom):
 	"""
 	creates a pattern from a portage atom.
 	Note that we don't need to distinguish between `=` and `~` slot operation,
 	as they are only used to trigger compilation.
 	:param atom: the string of the atom
-	:return: the corresponding pattern
+	:return: the corresponding canonical pattern
+	"""
+	global __pattern_nb_requests
+	__pattern_nb_requests = __pattern_nb_requests + 1
+	res = __pattern_atom_table.get(atom)
+	if res is None:
+		res = pattern_intern(__pattern_create_from_atom(atom))
+		__pattern_atom_table[atom] = res
+	return res
+
+
+def pattern_pop_nb_requests():
+	"""
+	:return: the number of calls to pattern_create_from_atom since the last call to this function
+	"""
+	global __pattern_nb_requests
+	res = __pattern_nb_requests
+	__pattern_nb_requests = 0
+	return res
+
+
+def pattern_get_nb_distinct():
 	"""
+	:return: the number of distinct patterns created or interned in this process
+	"""
+	return len(__pattern_table)
+
+
+def __pattern_create_from_atom(atom):
 	# 1. version operator
 	vop = None
 	begin = 0
@@ -133,6 +181,23 @@ def pattern_get_package_group(pattern):
 	return pattern[1]
 
 
+def pattern_is_package_group_specific(pattern):
+	"""
+	:param pattern: the input pattern
+	:return: True if the pattern only matches spls of one spl group (i.e., its package group has no wildcard)
+	"""
+	pattern_package_group = pattern_get_package_group(pattern)
+	return (pattern_package_group[0] != "*") and (pattern_package_group[-1] != "*")
+
+
+def pattern_has_slot(pattern):
+	"""
+	:param pattern: the input pattern
+	:return: True if the pattern constrains the slot or the subslot of the spls it matches
+	"""
+	return bool(pattern[5] or pattern[6])
+
+
 def pattern_to_atom(pattern):
 	"""
 	translates a pattern into its corresponding portage atom
@@ -186,76 +251,80 @@ def pattern_from_save_format(save_format):
 # MATCHING FUNCTIONS
 ######################################################################
 
-def compare_extra_len(s):
-	c = s[0]
-	if c == '_': return (s[1] == 'p') and ((len(s) < 3) or (s[2] != 'r'))
-	elif c == "r": return False
-	else: return True
+# the regular expressions of portage versions and version suffixes, and the order of the suffixes (from portage)
+__version_regexp = re.compile(r"^(cvs\.)?(\d+)((\.\d+)*)([a-z]?)((_(pre|p|beta|alpha|rc)\d*)*)(-r(\d+))?$")
+__version_suffix_regexp = re.compile(r"^(alpha|beta|pre|rc|p)(\d*)$")
+__version_suffix_value = {"alpha": -4, "beta": -3, "pre": -2, "rc": -1, "p": 0}
+__version_key_table = {}  # mapping from the versions already parsed to their key
 
 
-def get_int_len(s, lens, start):
-	i = start
-	while (i < lens) and s[i].isdigit(): i = i + 1
-	return i
+def version_key(version):
+	"""
+	returns the key of a version, i.e., a tuple whose ordering is the one of portage's vercmp function.
+	The versions are parsed only once, their keys being stored in a table
+	:param version: the version (possibly with a revision)
+	:return: the key of the version
+	"""
+	res = __version_key_table.get(version)
+	if res is None:
+		res = __version_key_compute(version)
+		__version_key_table[version] = res
+	return res
+
+
+def __version_key_compute(version):
+	match = __version_regexp.match(version)
+	if match is None: return -1, version  # invalid versions are ordered before the valid ones
+	# 1. the components after the first one: the ones starting with 0 are compared as decimal fractions,
+	# and are always smaller than the other ones, which are compared as integers
+	if match.group(3):
+		components = tuple([
+			(0, component.rstrip("0")) if component[0] == "0" else (1, int(component))
+			for component in match.group(3)[1:].split(".")])
+	else: components = ()
+	# 2. the suffixes, terminated by an implicit _p-1 suffix
+	suffixes = []
+	for suffix in match.group(6).split("_")[1:]:
+		name, number = __version_suffix_regexp.match(suffix).groups()
+		suffixes.append((__version_suffix_value[name], int(number) if number else 0))
+	suffixes.append((__version_suffix_value["p"], -1))
+	return (
+		1 if match.group(1) else 0, int(match.group(2)), components,
+		ord(match.group(5)) if match.group(5) else 0, tuple(suffixes),
+		int(match.group(10)) if match.group(10) else 0)
 
 
 def compare_version(s1, s2):
 	"""
 	Returns a positive number if s1 > 2, 0 if the two versions are equal and a negative number if s2 > s1
-	This function assumes that the parameters are valid portage versions
 	:param s1: the first version
 	:param s2: the second version
 	:return: a positive number if s1 > 2, 0 if the two versions are equal and a negative number if s2 > s1
 	"""
-	i = 0
-	len1 = len(s1)
-	len2 = len(s2)
-	maximum = min(len1, len2)
-	dot = False
-	number_alternative_mode = False
-	while (i < maximum) and (s1[i] == s2[i]):
-		# computes if the number should be managed as integers or fractional part
-		if s1[i] == '.':
-			dot = True
-			number_alternative_mode = False
-		elif dot:
-			if s1[i] == '0': number_alternative_mode = True
-			dot = False
-		elif number_alternative_mode and (not s1[i].isdigit()):
-			number_alternative_mode = False
-		i = i + 1
-	if i == maximum:
-		if len1 == len2: return 0
-		if len1 < len2: return -1 if compare_extra_len(s2[i:]) else 1
-		return 1 if compare_extra_len(s1[i:]) else -1
-	else:
-		if s1[i].isdigit() and s2[i].isdigit():
-			# 1. check the factional part, that starts with a 0
-			if s1[i] == '0': return -1
-			elif s2[i] == '0': return 1
-			elif number_alternative_mode: return ord(s1[i]) - ord(s2[i])
-			else:  # 2. check the integer part
-				int_len_1 = get_int_len(s1, len1, i)
-				int_len_2 = get_int_len(s2, len2, i)
-				if int_len_1 < int_len_2: return -1
-				elif int_len_1 > int_len_2: return 1
-				else: return ord(s1[i]) - ord(s2[i])
-		else:
-			# captures "1*" > ".*", "1*" > "_*" and "1*" > "-*", in any context
-			if s1[i].isdigit(): return 1
-			elif s2[i].isdigit(): return -1
-			# captures ".*" > "_*" and ".*" > "-*", in any context
-			elif s1[i] == '.': return 1
-			elif s2[i] == '.': return -1
-			# captures "-*" > "_alpha* -- _rc*" and "_p-*" > "_pre*", in any context
-			elif s1[i] == '-':
-				cond = (s2[i] == "r") or (not ((s2[i] == "_") and s2[i+1] == 'p') and ((len2 < i+3) or (s2[i+2] != 'r')))
-				return 1 if cond else -1
-			elif s2[i] == '-':
-				cond = (s1[i] == "r") or (not ((s1[i] == "_") and s1[i+1] == 'p') and ((len1 < i+3) or (s1[i+2] != 'r')))
-				return -1 if cond else 1
-			# captures comparison between alpha characters
-			return ord(s1[i]) - ord(s2[i])
+	return cmp(version_key(s1), version_key(s2))
+
+
+def pattern_get_version_range(pattern, version_keys):
+	"""
+	computes the range of versions that match the version operator of a pattern,
+	for a list of versions sorted by their key
+	:param pattern: the input pattern
+	:param version_keys: the sorted list of the keys of the versions
+	:return: the pair of the bounds of the range of the matching versions (the upper bound being excluded),
+		or None if the versions matching the pattern do not form a range (with the "~" and "=*" operators)
+	"""
+	pattern_vop, pattern_version_full, pattern_has_star = pattern[0], pattern[2], pattern[4]
+	if (pattern_version_full is None) or (pattern_vop is None):
+		return 0, len(version_keys)
+	if (pattern_vop == "~") or ((pattern_vop == "=") and pattern_has_star):
+		return None
+	key = version_key(pattern_version_full)
+	if pattern_vop == ">=": return bisect.bisect_left(version_keys, key), len(version_keys)
+	elif pattern_vop == ">": return bisect.bisect_right(version_keys, key), len(version_keys)
+	elif pattern_vop == "=": return bisect.bisect_left(version_keys, key), bisect.bisect_right(version_keys, key)
+	elif pattern_vop == "<=": return 0, bisect.bisect_right(version_keys, key)
+	elif pattern_vop == "<": return 0, bisect.bisect_left(version_keys, key)
+	return 0, len(version_keys)
 
 
 def match_only_package_group(pattern, package_group):
@@ -264,14 +333,10 @@ def match_only_package_group(pattern, package_group):
 		return True
 	elif (pattern_package_group[0] != "*") and (pattern_package_group[-1] != "*"):
 		return pattern_package_group == package_group
-	elif pattern_package_group[0] != "*":
-		pattern_subgroup = pattern_package_group[2:]
-		els = package_group[1].split("/")
-		return pattern_subgroup == els[-1]
+	elif pattern_package_group[0] == "*":
+		return pattern_package_group[2:] == package_group.split("/", 1)[1]
 	else:
-		pattern_category = pattern_package_group[:-2]
-		els = package_group[1].split("/")
-		return pattern_category == els[-2]
+		return pattern_package_group[:-2] == package_group.split("/", 1)[0]
 
 
 def match_only_package_version(pattern, version_full, version):
@@ -279,23 +344,20 @@ def match_only_package_version(pattern, version_full, version):
 
 	if (pattern_version_full is None) or (pattern_vop is None):
 		return True
-	compare = compare_version(version_full, pattern_version_full)
+	if pattern_vop == "~":
+		return pattern_version == version
+	if (pattern_vop == "=") and pattern_has_star:
+		return version_full.startswith(pattern_version_full)
+	compare = cmp(version_key(version_full), version_key(pattern_version_full))
 	if pattern_vop == ">=":
 		if compare < 0:
 			return False
 	elif pattern_vop == ">":
 		if compare <= 0:
 			return False
-	elif pattern_vop == "~":
-		if pattern_version != version:
-			return False
 	elif pattern_vop == "=":
-		if pattern_has_star:
-			if not version_full.startswith(pattern_version_full):
-				return False
-		else:
-			if compare != 0:
-				return False
+		if compare != 0:
+			return False
 	elif pattern_vop == "<=":
 		if compare > 0:
 			return False
@@ -365,6 +427,62 @@ class dictSet(dict):
 		else: self[key].remove(val)
 
 
+class MultiSet(dict):
+	"""
+	This class is used to maintain incrementally the union of several sets (like the use flags required on a pattern
+	by all the spls containing it): it maps the elements of the union to the number of sets containing them
+	"""
+	def add(self, element): self[element] = self.get(element, 0) + 1
+
+	def add_all(self, elements):
+		for element in elements: self.add(element)
+
+	def remove(self, element):
+		count = self[element]
+		if count == 1: del self[element]
+		else: self[element] = count - 1
+
+	def remove_all(self, elements):
+		for element in elements: self.remove(element)
+
+
+class MappingWrapper(object):
+	"""
+	This class is the base of the containers whose entries are stored in another mapping
+	(a dictionary, or a mapping whose entries are loaded from a database on access), which they expose like a dictionary
+	"""
+	def __init__(self, entries=None):
+		self.entries = {} if entries is None else entries
+
+	def __getitem__(self, key): return self.entries[key]
+
+	def __setitem__(self, key, value): self.entries[key] = value
+
+	def __delitem__(self, key): del self.entries[key]
+
+	def __contains__(self, key): return key in self.entries
+
+	def __len__(self): return len(self.entries)
+
+	def __iter__(self): return iter(self.entries)
+
+	def get(self, key, default=None): return self.entries.get(key, default)
+
+	def pop(self, key, *default): return self.entries.pop(key, *default)
+
+	def iterkeys(self): return self.entries.iterkeys()
+
+	def itervalues(self): return self.entries.itervalues()
+
+	def iteritems(self): return self.entries.iteritems()
+
+	def keys(self): return self.entries.keys()
+
+	def values(self): return self.entries.values()
+
+	def items(self): return self.entries.items()
+
+
 
 ######################################################################
 # SET MANIPULATION STRUCTURE
@@ -426,24 +544,109 @@ class SetManipulation(object):
 	def init(self):
 		return self.positive.copy()
 
+	def get_changed_elements(self, old):
+		"""
+		:param old: the previous version of this set manipulation
+		:return: the elements whose manipulation changed between the previous version and this one,
+			or None if the "-*" manipulation changed (i.e., all elements are impacted)
+		"""
+		if self.remove_all != old.remove_all: return None
+		return (self.positive ^ old.positive) | (self.negative ^ old.negative)
+
+	def __eq__(self, o):
+		if isinstance(o, self.__class__):
+			return self.remove_all == o.remove_all and self.positive == o.positive and self.negative == o.negative
+		else: return False
+
+	def __ne__(self, o): return not self.__eq__(o)
+
+
+def pattern_position_index_create(patterns):
+	"""
+	indexes the positions of a list of patterns by their package group
+	:param patterns: the list of patterns
+	:return: the pair of the mapping from package groups to the positions of their patterns,
+		and of the positions of the patterns with a wildcard
+	"""
+	index, index_wildcard = {}, []
+	for position, pattern in enumerate(patterns):
+		if pattern_is_package_group_specific(pattern):
+			index.setdefault(pattern_get_package_group(pattern), []).append(position)
+		else: index_wildcard.append(position)
+	return index, index_wildcard
+
+
+def pattern_position_index_get(pattern_position_index, package_group):
+	"""
+	:param pattern_position_index: the index of the positions of a list of patterns
+	:param package_group: a package group (without wildcard)
+	:return: the positions of the patterns that can match the spls of this package group, in increasing order
+	"""
+	index, index_wildcard = pattern_position_index
+	positions = index.get(package_group, ())
+	if index_wildcard: positions = heapq.merge(positions, index_wildcard)
+	return positions
+
+
+def pattern_list_get_changed_patterns(list_old, list_new, get_pattern):
+	"""
+	computes the patterns whose meaning may differ between two ordered lists of pattern guarded elements.
+	As the elements are applied in order, an spl is impacted by the change iff it is matched
+	by one of the elements that are not in the common prefix and suffix of the two lists
+	:param list_old: the old list
+	:param list_new: the new list
+	:param get_pattern: the function returning the pattern of an element of the lists
+	:return: the set of the patterns of the elements that differ between the two lists
+	"""
+	start, end_old, end_new = 0, len(list_old), len(list_new)
+	while (start < end_old) and (start < end_new) and (list_old[start] == list_new[start]): start = start + 1
+	while (start < end_old) and (start < end_new) and (list_old[end_old - 1] == list_new[end_new - 1]):
+		end_old, end_new = end_old - 1, end_new - 1
+	res = {get_pattern(el) for el in list_old[start:end_old]}
+	res.update([get_pattern(el) for el in list_new[start:end_new]])
+	return res
+
 
 class SetManipulationPattern(object):
 	"""
 	this class is used for all the set manipulation files that are guarded by a specific pattern
 		- use flag manipulation for specific patterns (package.use, package.use.force, etc)
 		- keyword manipulation for specific patterns (package.keywords, package.accept_keywords)
+	The manipulations are indexed by the package group of their pattern, so applying them to an spl
+	only considers the ones of its group and the ones with a wildcard pattern, in their original order
 	"""
 	def __init__(self):
 		self.list = []
+		self.__index = None   # the index of the positions of the manipulations, built on demand
+
+	def __getstate__(self):
+		"""
+		The index is not stored, as it is computed from the list
+		"""
+		return {"list": self.list}
+
+	def __setstate__(self, state):
+		self.list = state["list"]
+		self.__index = None
 
 	def add(self, pattern, set_manipulation):
 		self.list.append( (pattern, set_manipulation) )
+		self.__index = None
 
 	def update(self, set_manipulation_pattern):
 		self.list.extend(set_manipulation_pattern.list)
+		self.__index = None
+
+	def get_group_manipulations(self, package_group):
+		"""
+		:param package_group: the package group of an spl
+		:return: the pairs of pattern and set manipulation that can apply to the spls of this package group, in order
+		"""
+		if self.__index is None: self.__index = pattern_position_index_create([el[0] for el in self.list])
+		return (self.list[position] for position in pattern_position_index_get(self.__index, package_group))
 
 	def apply(self, spl_core, s):
-		for pattern, set_manipulation in self.list:
+		for pattern, set_manipulation in self.get_group_manipulations(spl_core_get_spl_group_name(spl_core)):
 			if match_spl_full(pattern, spl_core):
 				set_manipulation.apply(s)
 
@@ -452,12 +655,39 @@ class SetManipulationPattern(object):
 		self.apply(spl_core, res)
 		return res
 
+	def get_changed_patterns(self, old):
+		"""
+		:param old: the previous version of this set manipulation
+		:return: the patterns of the manipulations that changed between the previous version and this one
+		"""
+		return pattern_list_get_changed_patterns(old.list, self.list, lambda el: el[0])
+
+	def __eq__(self, o):
+		if isinstance(o, self.__class__): return self.list == o.list
+		else: return False
+
+	def __ne__(self, o): return not self.__eq__(o)
+
 
 class PatternListManipulation(list):
 	"""
 	this class is used for simple list of patterns:
 		- package masking (package.mask, package.unmask)
+	Like in SetManipulationPattern, the patterns are indexed by package group
 	"""
+	__index = None   # the index of the positions of the patterns, built on demand
+
+	def __reduce__(self):
+		return PatternListManipulation, (), None, iter(self)  # the index is not stored
+
+	def append(self, element):
+		list.append(self, element)
+		self.__index = None
+
+	def extend(self, elements):
+		list.extend(self, elements)
+		self.__index = None
+
 	def add(self, string):
 		if string[0] == "-":
 			self.append( (False, pattern_create_from_atom(string[1:])) )
@@ -468,15 +698,30 @@ class PatternListManipulation(list):
 		for element in elements: self.add(element)
 		return self
 
-	update = list.extend
+	update = extend
+
+	def get_group_elements(self, package_group):
+		"""
+		:param package_group: the package group of an spl
+		:return: the pairs of addition flag and pattern that can match the spls of this package group, in order
+		"""
+		if self.__index is None: self.__index = pattern_position_index_create([el[1] for el in self])
+		return (self[position] for position in pattern_position_index_get(self.__index, package_group))
 
 	def contains(self, spl_core):
 		res = False
-		for add, pattern in self:
+		for add, pattern in self.get_group_elements(spl_core_get_spl_group_name(spl_core)):
 			if match_spl_full(pattern, spl_core):
 				res = add
 		return res
 
+	def get_changed_patterns(self, old):
+		"""
+		:param old: the previous version of this pattern list
+		:return: the patterns of the elements that changed between the previous version and this one
+		"""
+		return pattern_list_get_changed_patterns(old, self, lambda el: el[1])
+
 
 ######################################################################
 # CONFIGURATION CLASS
@@ -532,6 +777,7 @@ class UseSelectionConfig(object):
 			force.update(tmp)
 
 		mask = self.use_mask.init()
+		self.pattern_use_mask.apply(spl_core, mask)
 		if is_stable:
 			tmp = self.use_stable_mask.init()
 			self.pattern_use_stable_mask.apply(spl_core, tmp)
@@ -542,8 +788,6 @@ class UseSelectionConfig(object):
 		self.use.apply(selection)
 		self.pattern_use.apply(spl_core, selection)
 
-		force = self.use_force.init()
-		self.pattern_use_force.apply(spl_core, force)
 		force, mask = self.get_use_force_mask(spl_core, is_stable)
 		selection.update(force)
 		selection.difference_update(mask)
@@ -569,6 +813,31 @@ class UseSelectionConfig(object):
 			)
 		else: return False
 
+	def __ne__(self, o): return not self.__eq__(o)
+
+	def get_changes(self, old):
+		"""
+		:param old: the previous version of this configuration
+		:return: the pair of the use flags whose global manipulation changed (None if all use flags are impacted),
+			and of the patterns whose use flag manipulation changed
+		"""
+		use_flags = set()
+		for set_manipulation, old_set_manipulation in (
+				(self.use, old.use), (self.use_force, old.use_force), (self.use_mask, old.use_mask),
+				(self.use_stable_force, old.use_stable_force), (self.use_stable_mask, old.use_stable_mask)):
+			changed = set_manipulation.get_changed_elements(old_set_manipulation)
+			if changed is None:
+				use_flags = None
+				break
+			use_flags.update(changed)
+		patterns = set()
+		for set_manipulation_pattern, old_set_manipulation_pattern in (
+				(self.pattern_use, old.pattern_use), (self.pattern_use_force, old.pattern_use_force),
+				(self.pattern_use_mask, old.pattern_use_mask), (self.pattern_use_stable_force, old.pattern_use_stable_force),
+				(self.pattern_use_stable_mask, old.pattern_use_stable_mask)):
+			patterns.update(set_manipulation_pattern.get_changed_patterns(old_set_manipulation_pattern))
+		return use_flags, patterns
+
 
 class MSPLConfig(object):
 	"""
@@ -624,6 +893,22 @@ class MSPLConfig(object):
 		self.new_keywords_config = True
 		self.new_licenses_config = True
 		self.new_use_flag_config = True
+		self.changed_visibility_patterns = None   # the patterns whose masks or keywords changed (None for all)
+		self.changed_use_declaration_eapi4 = None # the implicit use flags that changed (None for all)
+		self.changed_use_declaration_eapi5 = None
+		self.changed_use_flags = None             # the use flags whose global manipulation changed (None for all)
+		self.changed_use_patterns = None          # the patterns whose use flag manipulation changed (None for all)
+
+	def __setstate__(self, state):
+		"""
+		The configurations saved by a previous version of the guest do not record what changed:
+		the missing fields are set to None, meaning that everything changed
+		"""
+		self.__dict__.update(state)
+		for field in (
+				"changed_visibility_patterns", "changed_use_declaration_eapi4", "changed_use_declaration_eapi5",
+				"changed_use_flags", "changed_use_patterns"):
+			if field not in state: setattr(self, field, None)
 
 	def update(self, config):
 		if config.arch:
@@ -717,6 +1002,8 @@ class MSPLConfig(object):
 		self.new_masks = (self.pattern_mask != old_config.pattern_mask) or (self.pattern_unmask != old_config.pattern_unmask)
 		self.new_use_declaration_eapi4 = (self.use_declaration_eapi4 != old_config.use_declaration_eapi4)
 		self.new_use_declaration_eapi5 = (self.use_declaration_eapi5 != old_config.use_declaration_eapi5)
+		self.changed_use_declaration_eapi4 = self.use_declaration_eapi4 ^ old_config.use_declaration_eapi4
+		self.changed_use_declaration_eapi5 = self.use_declaration_eapi5 ^ old_config.use_declaration_eapi5
 
 		self.new_keywords_config = (self.arch != old_config.arch)
 		if not self.new_keywords_config:
@@ -726,10 +1013,29 @@ class MSPLConfig(object):
 		if not self.new_keywords_config:
 			self.new_keywords_config = (self.pattern_accept_keywords != old_config.pattern_accept_keywords)
 
+		if (self.arch != old_config.arch) or (self.accept_keywords != old_config.accept_keywords):
+			self.changed_visibility_patterns = None
+		else:
+			self.changed_visibility_patterns = self.pattern_mask.get_changed_patterns(old_config.pattern_mask)
+			self.changed_visibility_patterns.update(self.pattern_unmask.get_changed_patterns(old_config.pattern_unmask))
+			self.changed_visibility_patterns.update(self.pattern_keywords.get_changed_patterns(old_config.pattern_keywords))
+			self.changed_visibility_patterns.update(
+				self.pattern_accept_keywords.get_changed_patterns(old_config.pattern_accept_keywords))
+
 		self.new_use_flag_config = (self.use_selection_config != old_config.use_selection_config)
 		if not self.new_use_flag_config:
 			self.new_use_flag_config = (self.use_selection_config_init != old_config.use_selection_config_init)
 
+		self.changed_use_flags, self.changed_use_patterns = self.use_selection_config.get_changes(
+			old_config.use_selection_config)
+		if (self.use_selection_config_init is not None) and (old_config.use_selection_config_init is not None):
+			use_flags, patterns = self.use_selection_config_init.get_changes(old_config.use_selection_config_init)
+			if use_flags is None: self.changed_use_flags = None
+			elif self.changed_use_flags is not None: self.changed_use_flags.update(use_flags)
+			self.changed_use_patterns.update(patterns)
+		elif self.use_selection_config_init is not old_config.use_selection_config_init:
+			self.changed_use_flags, self.changed_use_patterns = None, None
+
 
 ######################################################################
 # MAIN SYSTEM CLASS
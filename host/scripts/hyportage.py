@@ -8,7 +8,9 @@ import multiprocessing
 import click
 
 import hyportage_db
+import hyportage_pattern
 import hyportage_translation
+import utils_egencache
 import smt_encoding
 import reconfigure
 
@@ -71,8 +73,16 @@ def usage():
 	help='Simplify the dependencies together of just one by one (useful for getting explanations.')
 @click.option(
 	'--save-modality',
-	type=click.Choice(["json", "gzjson", "marshal", "pickle"]), default="pickle",
-	help='Saving modality. Currently, only pickle is supported, as "marshal does not support objects, and json is simply not efficient')
+	type=click.Choice(["json", "gzjson", "marshal", "pickle", "sqlite"]), default="pickle",
+	help='Saving modality. Currently, only pickle and sqlite are supported, as "marshal does not support objects, and json is simply not efficient. With sqlite, the hyportage database is loaded lazily and only its modified parts are saved')
+@click.option(
+	'--compression',
+	type=click.Choice(utils.data_file_compressions), default="none",
+	help='Compression of the pickle files saved by the tool (lzma is only available with the lzma module, or its python 2.7 backport). Files are loaded whatever their compression.')
+@click.option(
+	'--pattern-cache-budget',
+	type=click.INT, default=16,
+	help='Memory budget (in MB) of the cache of the spls matched by the patterns (the size of the cached tuples of spl names, with the strings of the names), which is saved with the hyportage database.')
 @click.option(
 	'--mode',
 	type=click.Choice(["update", "emerge"]), default="update",
@@ -109,6 +119,8 @@ def main(
 		force,
 		simplify_mode,
 		save_modality,
+		compression,
+		pattern_cache_budget,
 		mode,
 		explain_modality,
 		exploration,
@@ -134,15 +146,12 @@ def main(
 	else: available_cores = 1
 	logging.info("number of available cores: " + str(available_cores))
 
-	if available_cores > 1:
-		concurrent_map = multiprocessing.Pool(available_cores).map
-	else: concurrent_map = map
-
 	todo_update_hyportage = mode == "update"
 	todo_emerge = mode == "emerge"
 
-	# 1.3. simplify_mode
+	# 1.3. simplify_mode and pattern cache budget
 	hyportage_db.simplify_mode = simplify_mode
+	hyportage_pattern.set_matched_spls_cache_budget(pattern_cache_budget * 1024 * 1024)
 
 	# 1.4. Exploration mode:
 	exploration_use = "use" in exploration
@@ -163,6 +172,10 @@ def main(
 	else: reconfigure.run_hyvar = lambda json_data: reconfigure.run_local_hyvar(
 			json_data, explain_modality, ["hyvar-rec"], par)
 
+	# 1.6. Save modality: the sqlite modality only concerns the hyportage database, the other files are pickled
+	file_save_modality = "pickle" if save_modality == "sqlite" else save_modality
+	utils.data_file_compression = compression
+
 	##########################################################################
 	# 2. SET THE FILE PATHS
 	##########################################################################
@@ -176,6 +189,8 @@ def main(
 	path_egencache_packages = os.path.join(dir_portage, file_egencache_packages)
 
 	path_db_hyportage = os.path.join(dir_hyportage, hyportage_file)
+	path_egencache_manifest = os.path.join(dir_hyportage, "egencache_manifest.pickle")
+	path_parse_cache = os.path.join(dir_hyportage, "parse_cache.pickle")
 
 	file_install_script, file_use_flag_configuration, file_mask_configuration, file_keywords_configuration = generated_install_files
 	path_install_script = os.path.join(dir_install, file_install_script)
@@ -188,15 +203,26 @@ def main(
 	##########################################################################
 
 	# 3.1. load config
-	hyportage_db.load_config(path_configuration, save_modality)
+	hyportage_db.load_config(path_configuration, file_save_modality)
 
-	# 3.2. compute what to update
+	# 3.2. load the parse cache, before the creation of the worker processes so they share it
+	if todo_update_hyportage:
+		utils_egencache.load_parse_cache(path_parse_cache, file_save_modality)
+
+	if available_cores > 1:
+		concurrent_map = multiprocessing.Pool(available_cores).map
+	else: concurrent_map = map
+
+	# 3.3. compute what to update
 	spl_name_set = set()
 	loaded_spls = []
 	if todo_update_hyportage:
-		last_db_hyportage_update = os.path.getmtime(path_db_hyportage) if os.path.exists(path_db_hyportage) else 0.0
-		egencache_files_to_load, spl_name_set = hyportage_translation.compute_to_load(
-			last_db_hyportage_update, force, path_egencache_packages)
+		# the manifest is only valid with the hyportage database it has been saved with
+		if hyportage_db.is_hyportage_loadable(path_db_hyportage, save_modality):
+			hyportage_db.load_egencache_manifest(path_egencache_manifest, file_save_modality)
+		old_egencache_manifest = hyportage_db.egencache_manifest
+		egencache_files_to_load, spl_name_set, hyportage_db.egencache_manifest = hyportage_translation.compute_to_load(
+			old_egencache_manifest, force, path_egencache_packages)
 		loaded_spls = hyportage_translation.load_spl_to_load(concurrent_map, egencache_files_to_load)
 
 	##########################################################################
@@ -223,35 +249,44 @@ def main(
 		# update the revert dependencies
 		changed_ids_spl_set = set(spl_added_list)
 		pattern_added_updated = pattern_added | pattern_updated_containing | pattern_updated_content
-		changed_ids_spl_set.update(hyportage_translation.update_revert_dependencies(
-			hyportage_db.pattern_repository, pattern_added_updated, pattern_removed))
+		spl_updated_list, spl_modified_set = hyportage_translation.update_revert_dependencies(
+			hyportage_db.pattern_repository, pattern_added_updated, pattern_removed)
+		changed_ids_spl_set.update(spl_updated_list)
 
 		# reset the implicitly added use flags
-		changed_ids_spl_set.update(hyportage_translation.reset_implicit_features(
+		implicit_use_flag_changed = hyportage_db.mspl_config.new_use_declaration_eapi4 or hyportage_db.mspl_config.new_use_declaration_eapi5
+		spl_implicit_updated_list = hyportage_translation.reset_implicit_features(
 			hyportage_db.mspl,
-			hyportage_db.mspl_config.new_use_declaration_eapi4, hyportage_db.mspl_config.new_use_declaration_eapi5))
+			hyportage_db.mspl_config.new_use_declaration_eapi4, hyportage_db.mspl_config.new_use_declaration_eapi5,
+			hyportage_db.mspl_config.changed_use_declaration_eapi4, hyportage_db.mspl_config.changed_use_declaration_eapi5)
+		changed_ids_spl_set.update(spl_implicit_updated_list)
 
 		# update the id repository
-		hyportage_translation.update_id_repository(hyportage_db.id_repository, changed_ids_spl_set, spl_removed_list)
+		use_ids_added = hyportage_translation.update_id_repository(
+			hyportage_db.id_repository, changed_ids_spl_set, spl_removed_list)
 
 		# update the visibility information
 		hyportage_translation.update_visibility(
-			hyportage_db.mspl, spl_added_list,
-			hyportage_db.mspl_config.new_masks, hyportage_db.mspl_config.new_keywords_config, hyportage_db.mspl_config.new_licenses_config)
+			concurrent_map, hyportage_db.pattern_repository, hyportage_db.spl_groups, spl_added_list,
+			hyportage_db.mspl_config.new_masks, hyportage_db.mspl_config.new_keywords_config,
+			hyportage_db.mspl_config.new_licenses_config, hyportage_db.mspl_config.changed_visibility_patterns)
 
-		# check if the main config of the spl must be regenerated
-		# COMMENTED OUT: the USE variable is changed every time the tool is called,
-		#  so it is efficiency-damaging to store the use selection of every spl
-		#hyportage_translation.update_use_flag_selection(
-		#	hyportage_db.mspl, spl_added_list,
-		#	hyportage_db.mspl_config.new_keywords_config, hyportage_db.mspl_config.new_use_flag_config)
+		# reset the use flag selection of the spls impacted by the use flag configuration
+		# (the USE variable is changed every time the tool is called,
+		#  so the use flag selection is not stored and only recomputed when needed)
+		hyportage_translation.update_use_flag_selection(
+			hyportage_db.mspl, hyportage_db.pattern_repository, hyportage_db.mspl_config.new_use_flag_config,
+			hyportage_db.mspl_config.changed_use_flags, hyportage_db.mspl_config.changed_use_patterns)
 
 		# update the smt
-		implicit_use_flag_changed = hyportage_db.mspl_config.new_use_declaration_eapi4 or hyportage_db.mspl_config.new_use_declaration_eapi5
-		pattern_added_updated_content = pattern_added | pattern_updated_content
-		hyportage_translation.update_smt_constraints(
+		spl_smt_set, spl_group_smt_set = hyportage_translation.get_smt_dependents(
 			hyportage_db.pattern_repository, hyportage_db.mspl, hyportage_db.spl_groups,
-			pattern_added_updated_content, spl_added_list, implicit_use_flag_changed)
+			pattern_added | pattern_updated_content, spl_added_list, spl_removed_list, use_ids_added)
+		spl_smt_list, spl_group_smt_list = hyportage_translation.update_smt_constraints(
+			concurrent_map, hyportage_db.pattern_repository, hyportage_db.id_repository,
+			spl_smt_set, spl_group_smt_set, hyportage_db.simplify_mode)
+		spl_modified_set.update(changed_ids_spl_set)
+		spl_modified_set.update(spl_smt_list)
 
 		# save the hypotage database
 		has_changed_config = implicit_use_flag_changed or hyportage_db.mspl_config.new_masks or\
@@ -259,8 +294,19 @@ def main(
 			hyportage_db.mspl_config.new_use_flag_config
 		has_changed_hyportage = bool(spl_added_list) or bool(spl_removed_list) or has_changed_config
 
-		if has_changed_config: hyportage_db.save_configuration(path_configuration, save_modality)
-		if has_changed_hyportage: hyportage_db.save_hyportage(path_db_hyportage, save_modality)
+		if has_changed_config: hyportage_db.save_configuration(path_configuration, file_save_modality)
+		if has_changed_hyportage:
+			changes = hyportage_translation.get_changed_entries(
+				spl_added_list, spl_removed_list, spl_modified_set, spl_group_smt_list, pattern_updated_content)
+			hyportage_db.save_hyportage(path_db_hyportage, save_modality, changes)
+		if hyportage_db.egencache_manifest != old_egencache_manifest:
+			hyportage_db.save_egencache_manifest(path_egencache_manifest, file_save_modality)
+		# the parse cache records which entries were used by the egencache files loaded in this run,
+		# and removes the ones not used for a long time
+		if egencache_files_to_load:
+			nb_pruned = utils_egencache.prune_parse_cache()
+			if nb_pruned: logging.info("parse cache: " + str(nb_pruned) + " unused entries removed")
+			utils_egencache.save_parse_cache(path_parse_cache, file_save_modality)
 
 
 	##########################################################################
@@ -311,6 +357,11 @@ def main(
 			path_install_script, path_use_flag_configuration, path_mask_configuration, path_keywords_configuration,
 			hyportage_db.config.installed_packages, solution)
 
+	statistics = hyportage_pattern.get_matched_spls_cache_statistics()
+	logging.info(
+		"matched spls cache: " + str(statistics["hits"]) + " hits, " + str(statistics["misses"]) + " misses (hit rate "
+		+ str(round(statistics["hit_rate"], 3)) + "), " + str(statistics["evictions"]) + " evictions, "
+		+ str(statistics["entries"]) + " entries using " + str(statistics["size"]) + " bytes")
 	logging.info("Execution succesfully terminated")
 
 	# cleanup, because of Python GC bugs...
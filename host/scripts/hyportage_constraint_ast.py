@@ -14,6 +14,63 @@ __email__ = "michael.lienhardt@laposte.net & mauro.jacopo@gmail.com"
 __status__ = "Prototype"
 
 
+import core_data
+
+
+######################################################################
+# AST NODES
+######################################################################
+
+"""
+The nodes of the AST are immutable tuples, whose first element is the type of the node:
+ - ("rsimple", use, not): a use flag in a REQUIRED_USE constraint, with not being "!" or None
+ - ("rcondition", condition, els): a conditional REQUIRED_USE constraint
+ - ("rchoice", choice, els): a choice ("||", "^^" or "??") between REQUIRED_USE constraints
+ - ("rinner", els): a conjunction of REQUIRED_USE constraints
+ - ("dsimple", atom, not, selection): a dependency to a pattern, with not being "!", "!!" or None,
+   and selection being the tuple of the use flag selections of the dependency, or None
+ - ("dcondition", condition, els): a conditional dependency
+ - ("dchoice", choice, els): a choice ("||", "^^" or "??") between dependencies
+ - ("dinner", els): a conjunction of dependencies
+ - ("condition", use, not): the use flag condition of a conditional constraint, with not being "!" or None
+ - ("selection", use, prefix, default, suffix): a use flag selection, with prefix being "!", "-" or None,
+   default being "+", "-" or None, and suffix being "?", "=" or None
+where els is a tuple of nodes.
+Structurally equal nodes are interned, so identical sub-trees are shared between all the ASTs of a process
+"""
+
+__ast_intern_table = {}
+
+
+def ast_intern(node):
+	"""
+	returns the canonical instance of the node in parameter, with all its sub-nodes interned
+	:param node: the AST node to intern
+	:return: the interned node structurally equal to the parameter
+	"""
+	res = __ast_intern_table.get(node)
+	if res is not None: return res
+	node_type = node[0]
+	if (node_type == "rcondition") or (node_type == "rchoice") or (node_type == "dcondition") or (node_type == "dchoice"):
+		node = node[0], ast_intern(node[1]), tuple([ast_intern(el) for el in node[2]])
+	elif (node_type == "rinner") or (node_type == "dinner"):
+		node = node[0], tuple([ast_intern(el) for el in node[1]])
+	elif node_type == "dsimple":
+		selection = node[3] if node[3] is None else tuple([ast_intern(el) for el in node[3]])
+		node = node[0], core_data.pattern_intern(node[1]), node[2], selection
+	return __ast_intern_table.setdefault(node, node)
+
+
+def ast_intern_list(ast):
+	"""
+	interns all the nodes of an AST (a list of nodes), to share the identical sub-trees of ASTs
+	received from another process
+	:param ast: the list of nodes to intern
+	:return: the list of the interned nodes
+	"""
+	return [ast_intern(node) for node in ast]
+
+
 ######################################################################
 # AST CORE VISITOR
 ######################################################################
@@ -31,54 +88,54 @@ class ASTVisitor(object):
 		return reduce(self.__mapvisitRequiredEL, ctx, self.DefaultValue())
 
 	def visitRequiredEL(self, ctx):
-		if ctx['type'] == "rsimple":
+		if ctx[0] == "rsimple":
 			return self.visitRequiredSIMPLE(ctx)
-		elif ctx['type'] == "rcondition":
+		elif ctx[0] == "rcondition":
 			return self.visitRequiredCONDITION(ctx)
-		elif ctx['type'] == "rchoice":
+		elif ctx[0] == "rchoice":
 			return self.visitRequiredCHOICE(ctx)
-		elif ctx['type'] == "rinner":
+		elif ctx[0] == "rinner":
 			return self.visitRequiredINNER(ctx)
 
 	def visitRequiredSIMPLE(self, ctx): return self.DefaultValue()
 
 	def visitRequiredCONDITION(self, ctx):
-		return reduce(self.__mapvisitRequiredEL, ctx['els'], self.visitCondition(ctx['condition']))
+		return reduce(self.__mapvisitRequiredEL, ctx[2], self.visitCondition(ctx[1]))
 
 	def visitRequiredCHOICE(self, ctx):
-		return reduce(self.__mapvisitRequiredEL, ctx['els'], self.DefaultValue())
+		return reduce(self.__mapvisitRequiredEL, ctx[2], self.DefaultValue())
 
 	def visitRequiredINNER(self, ctx):
-		return reduce(self.__mapvisitRequiredEL, ctx['els'], self.DefaultValue())
+		return reduce(self.__mapvisitRequiredEL, ctx[1], self.DefaultValue())
 
 	def visitDepend(self, ctx):
 		return reduce(self.__mapvisitDependEL, ctx, self.DefaultValue())
 
 	def visitDependEL(self, ctx):
-		if ctx['type'] == "dsimple":
+		if ctx[0] == "dsimple":
 			return self.visitDependSIMPLE(ctx)
-		elif ctx['type'] == "dcondition":
+		elif ctx[0] == "dcondition":
 			return self.visitDependCONDITION(ctx)
-		elif ctx['type'] == "dchoice":
+		elif ctx[0] == "dchoice":
 			return self.visitDependCHOICE(ctx)
-		elif ctx['type'] == "dinner":
+		elif ctx[0] == "dinner":
 			return self.visitDependINNER(ctx)
 
 	def visitDependSIMPLE(self, ctx):
-		res = self.visitAtom(ctx['atom'])
-		if "selection" in ctx:
-			return reduce(self.__mapvisitSelection, ctx['selection'], res)
+		res = self.visitAtom(ctx[1])
+		if ctx[3] is not None:
+			return reduce(self.__mapvisitSelection, ctx[3], res)
 		else: return res
 
 
 	def visitDependCONDITION(self, ctx):
-		return reduce(self.__mapvisitDependEL, ctx['els'], self.visitCondition(ctx['condition']))
+		return reduce(self.__mapvisitDependEL, ctx[2], self.visitCondition(ctx[1]))
 
 	def visitDependCHOICE(self, ctx):
-		return reduce(self.__mapvisitDependEL, ctx['els'], self.DefaultValue())
+		return reduce(self.__mapvisitDependEL, ctx[2], self.DefaultValue())
 
 	def visitDependINNER(self, ctx):
-		return reduce(self.__mapvisitDependEL, ctx['els'], self.DefaultValue())
+		return reduce(self.__mapvisitDependEL, ctx[1], self.DefaultValue())
 
 	def visitChoice(self, ctx):
 		return self.DefaultValue()
@@ -91,12 +148,13 @@ class ASTVisitor(object):
 
 	def visitSelection(self, ctx):
 		res = self.DefaultValue()
-		if 'prefix' in ctx:
-			res = self.CombineValue(res, self.visitPrefix(ctx['prefix']))
-		if 'default' in ctx:
-			res = self.CombineValue(res, self.visitDefault(ctx['default']))
-		if 'suffix' in ctx:
-			res = self.CombineValue(res, self.visitSuffix(ctx['suffix']))
+		_, _, prefix, default, suffix = ctx
+		if prefix is not None:
+			res = self.CombineValue(res, self.visitPrefix(prefix))
+		if default is not None:
+			res = self.CombineValue(res, self.visitDefault(default))
+		if suffix is not None:
+			res = self.CombineValue(res, self.visitSuffix(suffix))
 		return res
 
 	def visitPrefix(self, ctx): return self.DefaultValue()
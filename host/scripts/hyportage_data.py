@@ -1,9 +1,12 @@
 #!/usr/bin/python
 
 
+import bisect
+
 import core_data
 
 import hyportage_db
+import hyportage_visibility
 import smt_encoding
 import hyportage_constraint_ast
 
@@ -34,21 +37,21 @@ class GETDependenciesVisitor(hyportage_constraint_ast.ASTVisitor):
 		self.dependencies = core_data.dictSet()
 		self.pattern = None
 
-	def visitRequiredSIMPLE(self, ctx): self.local.add(ctx['use'])
+	def visitRequiredSIMPLE(self, ctx): self.local.add(ctx[1])
 
-	def visitCondition(self, ctx): self.local.add(ctx['use'])
+	def visitCondition(self, ctx): self.local.add(ctx[1])
 
 	def visitDependSIMPLE(self, ctx):
-		#print("found dependency: " + ctx['atom'])
-		self.pattern = ctx['atom']
+		#print("found dependency: " + ctx[1])
+		self.pattern = ctx[1]
 		self.dependencies.add_key(self.pattern)
-		if "selection" in ctx: map(self.visitSelection, ctx['selection'])
+		if ctx[3] is not None: map(self.visitSelection, ctx[3])
 
 	def visitSelection(self, ctx):
-		use = ctx['use']
+		use = ctx[1]
 		#print("  found use flag: " + use)
 		self.dependencies.add(self.pattern, use)
-		if 'suffix' in ctx: self.local.add(use)
+		if ctx[4] is not None: self.local.add(use)
 
 
 class SPL(object):
@@ -88,6 +91,8 @@ class SPL(object):
 		##
 		self.__dependencies            = None                     # mapping from pattern dependencies to list of features they must have declared
 		self.__revert_dependencies     = core_data.dictSet()      # which patterns refer to this SPL, with which features
+		self.__required_iuses_external_count = core_data.MultiSet()  # the union of the features of the revert dependencies
+		self.__required_iuses_external = None                     # the set of these features, once computed
 		self.__required_iuses_local    = None                     # list of local features mentioned in local constraints
 		self.__required_iuses          = None                     #
 		self.__iuses_full              = None                     # full use flag list
@@ -98,6 +103,7 @@ class SPL(object):
 		#######################
 		# SMT
 		self.__smt_constraint          = None                     # translation of the full feature model into z3 constraints
+		self.__smt_use_references      = None                     # the (spl name, use flag) pairs referenced by the constraint
 		#######################
 		# visibility
 		self.keyword_set             = keyword_set                # list of architectures valid for this SPL
@@ -109,9 +115,6 @@ class SPL(object):
 		self.__installable             = None                     # if this package is installable
 		self.__is_stable               = None                     # if this package is stable
 		#######################
-		# graph traversal
-		self.visited = False
-		#######################
 		# initial setup
 		self.generate_dependencies_and_requirements()
 
@@ -123,12 +126,53 @@ class SPL(object):
 		else:
 			return False
 
+	#####################################
+	# SERIALIZATION
+
+	def __getstate__(self):
+		"""
+		The caches that are computed from the other fields and from the configuration are not stored.
+		Note that the required_iuses and iuses_core fields are stored,
+		as they are not reset when a revert dependency is removed (see reset_revert_dependencies)
+		"""
+		state = self.__dict__.copy()
+		for field in (
+				"_SPL__dependencies", "_SPL__required_iuses_local", "_SPL__iuses_full", "_SPL__iuses_visible",
+				"_SPL__use_selection_full", "_SPL__use_selection_core",
+				"_SPL__unmasked", "_SPL__unmasked_keyword", "_SPL__unmasked_license", "_SPL__installable",
+				"_SPL__is_stable", "_SPL__required_iuses_external_count", "_SPL__required_iuses_external"):
+			del state[field]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.__required_iuses_external_count = core_data.MultiSet()
+		for uses in self.__revert_dependencies.itervalues(): self.__required_iuses_external_count.add_all(uses)
+		self.__required_iuses_external = None
+		self.__dependencies = None
+		self.__required_iuses_local = None
+		self.__iuses_full = None
+		self.__iuses_visible = None
+		self.__use_selection_full = None
+		self.__use_selection_core = None
+		self.__unmasked = None
+		self.__unmasked_keyword = None
+		self.__unmasked_license = None
+		self.__installable = None
+		self.__is_stable = None
+
 	#####################################
 	# GENERATORS AND PROPERTIES
 
 	@property
 	def group_name(self): return core_data.spl_core_get_spl_group_name(self.core)
 
+	@property
+	def version_full(self): return core_data.spl_core_get_version_full(self.core)
+
+	@property
+	def version(self): return core_data.spl_core_get_version(self.core)
+
 	@property
 	def slot(self): return core_data.spl_core_get_slot(self.core)
 
@@ -143,8 +187,16 @@ class SPL(object):
 		self.__required_iuses_local = visitor.local
 
 	def generate_visibility_data(self):
-		self.__unmasked_keyword, self.__unmasked_license, self.__installable, self.__is_stable =\
-			hyportage_db.mspl_config.get_stability_status(self.core, self.unmasked, self.keyword_set, self.license)
+		visibility = hyportage_visibility.get_engine().get_group_visibility(
+			self.group_name, [(self.core, self.keyword_set, self.license)])
+		self.set_visibility_data(*visibility[0])
+
+	def set_visibility_data(self, unmasked, unmasked_keyword, unmasked_license, installable, is_stable):
+		self.__unmasked = unmasked
+		self.__unmasked_keyword = unmasked_keyword
+		self.__unmasked_license = unmasked_license
+		self.__installable = installable
+		self.__is_stable = is_stable
 
 	@property
 	def dependencies(self):
@@ -158,7 +210,9 @@ class SPL(object):
 
 	@property
 	def required_iuses_external(self):
-		return {use for use_set in self.__revert_dependencies.itervalues() for use in use_set}
+		if self.__required_iuses_external is None:
+			self.__required_iuses_external = frozenset(self.__required_iuses_external_count)
+		return self.__required_iuses_external
 
 	@property
 	def required_iuses(self):
@@ -193,7 +247,7 @@ class SPL(object):
 				self.__use_selection_full = hyportage_db.installed_packages[self.name]
 			else:
 				self.__use_selection_full = hyportage_db.mspl_config.get_use_flags(
-					self.core, self.unmasked, self.__is_stable, self.use_manipulation_default) & self.iuses_full
+					self.core, self.unmasked, self.is_stable, self.use_manipulation_default) & self.iuses_full
 		return self.__use_selection_full
 
 	@property
@@ -207,11 +261,17 @@ class SPL(object):
 	@property
 	def smt(self):
 		if self.__smt_constraint is None:
-			self.__smt_constraint = smt_encoding.convert_spl(
+			self.__smt_constraint, self.__smt_use_references = smt_encoding.convert_spl(
 				hyportage_db.pattern_repository, hyportage_db.id_repository,
 				hyportage_db.mspl, hyportage_db.spl_groups, self, hyportage_db.simplify_mode)
 		return self.__smt_constraint
 
+	@property
+	def smt_if_computed(self): return self.__smt_constraint
+
+	@property
+	def smt_use_references_if_computed(self): return self.__smt_use_references
+
 	@property
 	def smt_false(self):
 		return [smt_encoding.smt_to_string(smt_encoding.get_spl_smt_not(hyportage_db.id_repository, self.name))]
@@ -224,7 +284,7 @@ class SPL(object):
 	@property
 	def smt_use_exploration(self):
 		use_useful = self.iuses_core
-		force, mask = hyportage_db.mspl_config.get_use_force_mask(self.core, self.__is_stable)
+		force, mask = hyportage_db.mspl_config.get_use_force_mask(self.core, self.is_stable)
 		force.intersection_update(use_useful)
 		force.update(self.use_selection_core & hyportage_db.mspl_config.use_declaration_hidden_from_user)
 		mask.intersection_update(use_useful)
@@ -235,7 +295,7 @@ class SPL(object):
 	@property
 	def unmasked(self):
 		if self.__unmasked is None:
-			self.__unmasked = hyportage_db.mspl_config.get_unmasked(self.core)
+			self.generate_visibility_data()
 		return self.__unmasked
 
 	@property
@@ -282,6 +342,11 @@ class SPL(object):
 
 	def reset_smt(self):
 		self.__smt_constraint = None
+		self.__smt_use_references = None
+
+	def set_smt(self, smt_constraint, use_references):
+		self.__smt_constraint = smt_constraint
+		self.__smt_use_references = use_references
 
 	def reset_unmasked_other(self):
 		self.__unmasked_keyword = None
@@ -293,15 +358,31 @@ class SPL(object):
 		self.__unmasked = None
 		self.reset_unmasked_other()
 
+	def get_revert_dependency(self, pattern): return self.__revert_dependencies.get(pattern)
+
+	def get_revert_dependency_patterns(self, use_flags):
+		"""
+		:param use_flags: a set of use flags
+		:return: the patterns matching this spl that are used with a selection of one of these use flags
+		"""
+		return [pattern for pattern, uses in self.__revert_dependencies.iteritems() if not use_flags.isdisjoint(uses)]
+
 	def update_revert_dependencies(self, pattern, uses):
+		old_uses = self.__revert_dependencies.get(pattern)
+		if old_uses is not None: self.__required_iuses_external_count.remove_all(old_uses)
 		self.__revert_dependencies[pattern] = uses
+		self.__required_iuses_external_count.add_all(uses)
+		self.__required_iuses_external = None
 		if (self.__required_iuses is not None) and (not uses.issubset(self.__required_iuses)):
 			self.reset_required_iuses()
 			return True
 		return False
 
 	def reset_revert_dependencies(self, pattern):
-		self.__revert_dependencies.pop(pattern)
+		uses = self.__revert_dependencies.pop(pattern, None)
+		if uses is not None:
+			self.__required_iuses_external_count.remove_all(uses)
+			self.__required_iuses_external = None
 		# I don't reset the __required_iuses field, because it would cause too much computation (recomputing the list,
 		#  the constraints and the constraints of the revert dependencies) for just having a possibly smaller list
 
@@ -359,7 +440,8 @@ class SPLGroup(object):
 		:param spl: the first spl known to be part of this group
 		"""
 		self.name = name                            # name of the group
-		self.spls = []                              # the spls of this group
+		self.spls = []                              # the spls of this group, sorted by version
+		self.version_keys = []                      # the version keys of the spls, in the same order
 		self.slots_mapping = core_data.dictSet()    # mapping listings all spls stored in one slot
 		self.__smt_constraint = None                # z3 constraint encoding this group
 
@@ -372,22 +454,60 @@ class SPLGroup(object):
 
 	def __iter__(self): return iter(self.spls)
 
+	def __getstate__(self):
+		"""
+		The version_keys and slots_mapping fields are not stored, as they are computed from the spls of the group
+		"""
+		state = self.__dict__.copy()
+		del state["version_keys"]
+		del state["slots_mapping"]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.spls.sort(key=lambda spl: core_data.version_key(spl.version_full))  # the spls may come from an older database
+		self.version_keys = [core_data.version_key(spl.version_full) for spl in self.spls]
+		self.slots_mapping = core_data.dictSet()
+		for spl in self.spls: self.slots_mapping.add(spl.slot, spl)
+
 	def add_spl(self, spl):
 		"""
-		adds an spl to this group
+		adds an spl to this group, keeping the spls sorted by version
 		:param spl: the added spl
 		:return: None
 		"""
-		self.spls.append(spl)
+		key = core_data.version_key(spl.version_full)
+		index = bisect.bisect_right(self.version_keys, key)
+		self.spls.insert(index, spl)
+		self.version_keys.insert(index, key)
 		self.slots_mapping.add(spl.slot, spl)
 
 	def remove_spl(self, spl):
-		self.spls.remove(spl)
+		index = self.spls.index(spl)
+		del self.spls[index]
+		del self.version_keys[index]
 		self.slots_mapping.remove_with_key(spl.slot, spl)
 
 	def replace_spl(self, old_spl, new_spl):
-		self.add_spl(new_spl)
 		self.remove_spl(old_spl)
+		self.add_spl(new_spl)
+
+	def get_matched_spls(self, pattern):
+		"""
+		returns the spls of this group that match the version and slot of a pattern.
+		The version range of the pattern is computed by bisection on the sorted version keys of the spls
+		:param pattern: the pattern, whose package group is the one of this group
+		:return: the list of the matching spls
+		"""
+		version_range = core_data.pattern_get_version_range(pattern, self.version_keys)
+		if version_range is None:
+			res = [
+				spl for spl in self.spls
+				if core_data.match_only_package_version(pattern, spl.version_full, spl.version)]
+		else: res = self.spls[version_range[0]:version_range[1]]
+		if core_data.pattern_has_slot(pattern):
+			res = [spl for spl in res if core_data.match_only_slot(pattern, spl.slot, spl.subslot)]
+		return res
 
 	#####################################
 	# GENERATORS AND PROPERTIES
@@ -398,6 +518,9 @@ class SPLGroup(object):
 			self.__smt_constraint = smt_encoding.convert_spl_group(hyportage_db.id_repository, self, hyportage_db.simplify_mode)
 		return self.__smt_constraint
 
+	@property
+	def smt_if_computed(self): return self.__smt_constraint
+
 	#####################################
 	# DATA UPDATE METHODS
 
@@ -407,13 +530,62 @@ class SPLGroup(object):
 
 """
 Finally, the spl_groups structure lists all the spl groups in the hyportage structure,
-and is a simple mapping from spl group names to the corresponding spl group.
+and is a mapping from spl group names to the corresponding spl group.
+It also indexes the names of the spl groups by category and by package name,
+to find the spl groups matched by the patterns with a wildcard (e.g., */foo or cat/*)
 """
 
-SPL_GROUPS = dict
+
+class SPLGroups(core_data.MappingWrapper):
+	"""
+	The mapping from the names of the spl groups to the spl groups, with indexes on their categories and package names.
+	The spl groups are stored in a dictionary, or in the mapping given in parameter
+	"""
+	def __init__(self, spl_groups=None):
+		super(SPLGroups, self).__init__(spl_groups)
+		self.mapping_category = core_data.dictSet()   # mapping from categories to the names of their spl groups
+		self.mapping_package = core_data.dictSet()    # mapping from package names to the names of their spl groups
+
+	def set_spl_group(self, spl_group):
+		"""
+		adds or replaces the spl group in parameter, updating the mappings
+		:param spl_group: the spl group
+		:return: None
+		"""
+		if spl_group.name not in self:
+			category, package = spl_group.name.split("/", 1)
+			self.mapping_category.add(category, spl_group.name)
+			self.mapping_package.add(package, spl_group.name)
+		self[spl_group.name] = spl_group
+
+	def remove_spl_group(self, spl_group_name):
+		"""
+		removes the spl group whose name is in parameter, updating the mappings
+		:param spl_group_name: the name of the spl group
+		:return: the removed spl group
+		"""
+		category, package = spl_group_name.split("/", 1)
+		self.mapping_category.remove_with_key(category, spl_group_name)
+		self.mapping_package.remove_with_key(package, spl_group_name)
+		return self.pop(spl_group_name)
+
+	def get_spl_group_names(self, package_group):
+		"""
+		returns the names of the spl groups matched by the package group of a pattern
+		:param package_group: the package group of a pattern, possibly with a wildcard
+		:return: the names of the matching spl groups
+		"""
+		if package_group == "*/*": return list(self.iterkeys())
+		elif package_group[-1] == "*": return self.mapping_category.get(package_group[:-2], ())
+		elif package_group[0] == "*": return self.mapping_package.get(package_group[2:], ())
+		elif package_group in self: return package_group,
+		else: return ()
+
+
+SPL_GROUPS = SPLGroups
 
 
-def spl_groups_create(): return {}
+def spl_groups_create(): return SPLGroups()
 
 
 def spl_groups_add_spl(spl_groups, spl):
@@ -424,7 +596,7 @@ def spl_groups_add_spl(spl_groups, spl):
 	else:
 		group = SPLGroup(spl.group_name)
 		group.add_spl(spl)
-		spl_groups[spl.group_name] = group
+		spl_groups.set_spl_group(group)
 		return group
 
 
@@ -437,8 +609,8 @@ def spl_groups_remove_spl(spl_groups, spl):
 	group_name = spl.group_name
 	group = spl_groups.get(group_name)
 	if group:
-		if len(group.references) == 1:
-			return spl_groups.pop(group_name)
+		if len(group.spls) == 1:
+			return spl_groups.remove_spl_group(group_name)
 		else:
 			group.remove_spl(spl)
 			return None
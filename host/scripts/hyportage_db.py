@@ -9,6 +9,8 @@ import core_data
 import hyportage_data
 import hyportage_ids
 import hyportage_pattern
+import hyportage_db_sqlite
+import hyportage_db_journal
 import utils
 
 """
@@ -36,6 +38,15 @@ hyportage_db_save_modality_default = "pickle"
 # the path and encoding of the configuration data
 config_db_path_default = os.path.abspath(os.path.join(local_path, "../data/portage/config.pickle"))
 config_db_save_modality_default = "pickle"
+# the path of the manifest of the translated egencache files
+egencache_manifest_path_default = os.path.abspath(os.path.join(local_path, "../data/hyportage/egencache_manifest.pickle"))
+
+# the versions of the stored data: a file storing another version of the data is not loaded, and is rebuilt instead
+hyportage_db_version = 6
+egencache_manifest_version = 1
+
+# the journal of the hyportage database (pickle modality) is compacted when its size reaches this ratio of the database size
+journal_compaction_ratio = 0.5
 
 
 ###############################
@@ -43,10 +54,13 @@ config_db_save_modality_default = "pickle"
 
 # hyportage data
 hyportage_db_loaded = False
-id_repository = hyportage_ids.id_repository_create()
-pattern_repository = hyportage_pattern.pattern_repository_create()
-mspl = hyportage_data.mspl_create()
-spl_groups = hyportage_data.spl_groups_create()
+hyportage_db_token = None  # identifies the saved hyportage database, to check that its journal applies to it
+# the hyportage data is created by load_hyportage: creating it here would require hyportage_data and hyportage_pattern
+# to be fully imported, while they import this module
+id_repository = None
+pattern_repository = None
+mspl = None
+spl_groups = None
 
 # configuration data
 config_db_loaded = False
@@ -56,6 +70,9 @@ keyword_list = []
 installed_packages = core_data.dictSet()
 world = set()
 
+# digests of the egencache files translated in the hyportage data
+egencache_manifest = {}
+
 # annex info
 simplify_mode = "individual"
 
@@ -83,13 +100,22 @@ def load_config(path=config_db_path_default, save_modality=config_db_save_modali
 
 def load_hyportage(path=hyportage_db_path_default, save_modality=hyportage_db_save_modality_default):
 	utils.phase_start("Loading the hyportage database.")
-	global hyportage_db_loaded
+	global hyportage_db_loaded, hyportage_db_token
 	global pattern_repository, id_repository, mspl, spl_groups
 	if not hyportage_db_loaded:
-		if os.path.exists(path):
-			pattern_repository, id_repository, mspl, spl_groups = utils.load_data_file(path, save_modality)
+		if save_modality == "sqlite":
+			pattern_repository, id_repository, mspl, spl_groups = hyportage_db_sqlite.load(path, hyportage_db_version)
+		elif is_hyportage_loadable(path, save_modality):
+			hyportage_db_token, pattern_repository, id_repository, mspl, spl_groups =\
+				utils.load_data_file(path, save_modality)
+			records = hyportage_db_journal.read_records(path, hyportage_db_token)
+			for record in records:
+				hyportage_db_journal.replay_record(record, pattern_repository, id_repository, mspl, spl_groups)
+			if records: logging.info("replayed " + str(len(records)) + " records of the journal")
 		else:
-			logging.info("No hyportage database found: creating an empty one")
+			if os.path.exists(path):
+				logging.warning("The hyportage database was saved by another version of hyportage: creating an empty one")
+			else: logging.info("No hyportage database found: creating an empty one")
 			pattern_repository = hyportage_pattern.PatternRepository()
 			id_repository = hyportage_ids.IDRepository()
 			mspl = hyportage_data.mspl_create()
@@ -98,6 +124,26 @@ def load_hyportage(path=hyportage_db_path_default, save_modality=hyportage_db_sa
 	utils.phase_end("Loading Completed")
 
 
+def load_egencache_manifest(path=egencache_manifest_path_default, save_modality=hyportage_db_save_modality_default):
+	global egencache_manifest
+	if utils.get_data_file_version(path, save_modality) == egencache_manifest_version:
+		egencache_manifest = utils.load_data_file(path, save_modality)
+	else:
+		logging.info("No egencache manifest found: all egencache files will be loaded")
+		egencache_manifest = {}
+
+
+def is_hyportage_loadable(path=hyportage_db_path_default, save_modality=hyportage_db_save_modality_default):
+	"""
+	checks if the hyportage database exists and has been saved with the current version of hyportage
+	:param path: the path of the database
+	:param save_modality: the modality used to save the database
+	:return: True if the database can be loaded
+	"""
+	if save_modality == "sqlite": return hyportage_db_sqlite.get_version(path) == hyportage_db_version
+	else: return utils.get_data_file_version(path, save_modality) == hyportage_db_version
+
+
 def load(
 		hyportage_db_path=hyportage_db_path_default, hyportage_db_save_modality=hyportage_db_save_modality_default,
 		config_db_path=config_db_path_default, config_db_save_modality=config_db_save_modality_default):
@@ -118,16 +164,54 @@ def save_configuration(path=config_db_path_default, save_modality=config_db_save
 	mspl_config.new_keywords_config = False
 	mspl_config.new_licenses_config = False
 	mspl_config.new_use_flag_config = False
+	mspl_config.changed_visibility_patterns = set()
+	mspl_config.changed_use_declaration_eapi4 = set()
+	mspl_config.changed_use_declaration_eapi5 = set()
+	mspl_config.changed_use_flags = set()
+	mspl_config.changed_use_patterns = set()
 	utils.store_data_file(path, config, save_modality)
 	utils.phase_end("Saving Completed")
 
 
-def save_hyportage(path=config_db_path_default, save_modality=config_db_save_modality_default):
+def save_hyportage(path=config_db_path_default, save_modality=config_db_save_modality_default, changes=None):
+	"""
+	saves the hyportage database.
+	With the pickle modality, if the changes since the database was loaded are given,
+	they are appended to the journal of the database, unless it becomes too large
+	:param path: the path of the database
+	:param save_modality: the modality used to save the database
+	:param changes: the tuple of the names of the changed spls, the names of the changed spl groups
+		and the changed patterns (see hyportage_translation.get_changed_entries), or None if everything changed
+	:return: None
+	"""
 	utils.phase_start("Saving the hyportage database.")
+	global hyportage_db_token
 	global pattern_repository, id_repository, mspl, spl_groups
-	data = pattern_repository, id_repository, mspl, spl_groups
-	utils.store_data_file(path, data, save_modality)
+	if save_modality == "sqlite":
+		hyportage_db_sqlite.save(pattern_repository, id_repository, mspl, spl_groups, hyportage_db_version)
+	else:
+		if (save_modality == "pickle") and (changes is not None) and (hyportage_db_token is not None):
+			record = hyportage_db_journal.encode_record(
+				pattern_repository, id_repository, mspl, spl_groups, *changes)
+			journal_size = hyportage_db_journal.append_record(path, hyportage_db_token, record)
+			logging.info(
+				"journal record of " + str(len(record)) + " bytes added (journal size: " + str(journal_size) + " bytes)")
+			do_save = journal_size > journal_compaction_ratio * os.path.getsize(path)
+			if do_save: logging.info("compacting the journal in the hyportage database")
+		else: do_save = True
+		if do_save:
+			hyportage_db_token = hyportage_db_journal.new_token()
+			data = hyportage_db_token, pattern_repository, id_repository, mspl, spl_groups
+			utils.store_data_file(path, data, save_modality, hyportage_db_version)
+			hyportage_db_journal.remove(path)
 	utils.phase_end("Saving Completed")
 
 
 
+
+
+def save_egencache_manifest(path=egencache_manifest_path_default, save_modality=hyportage_db_save_modality_default):
+	utils.phase_start("Saving the egencache manifest.")
+	global egencache_manifest
+	utils.store_data_file(path, egencache_manifest, save_modality, egencache_manifest_version)
+	utils.phase_end("Saving Completed")
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+
+import os
+import logging
+import struct
+import zlib
+import uuid
+import cPickle
+import cStringIO
+
+import hyportage_data
+
+
+"""
+This file contains the journal of the hyportage database, used with the pickle save modality.
+Instead of saving the whole database, a translation that only changed some of its entries
+appends a record of these entries to the journal, which is stored next to the database.
+The records are replayed when the database is loaded,
+and the journal is folded back in the database (i.e., the database is saved) when it grows too large.
+The journal starts with the token of the saved database it applies to: a journal with another token is ignored.
+Every record is framed with its length and its crc32, so a record partially written (e.g., during a crash)
+is detected and discarded.
+"""
+
+
+__author__ = "Michael Lienhardt"
+__copyright__ = "Copyright 2017, Michael Lienhardt"
+__license__ = "GPL3"
+__version__ = "0.5"
+__maintainer__ = "Michael Lienhardt"
+__email__ = "michael.lienhardt@laposte.net"
+__status__ = "Prototype"
+
+
+journal_magic = "HYPORTAGE-JOURNAL"
+journal_version = 1
+__journal_header = struct.Struct("!H32s")  # version, token of the database
+__record_header = struct.Struct("!II")     # length, crc32 of the record
+
+
+def get_journal_path(path): return path + ".journal"
+
+
+def new_token(): return uuid.uuid4().hex
+
+
+######################################################################
+# RECORD SERIALIZATION
+######################################################################
+
+"""
+A record is composed of two pickles:
+ - the list of the changed spls, as pairs of a name and an spl (None if the spl is removed),
+ - the lists of the changed spl groups, pattern elements and spl ids (with the same format),
+   followed by the next id of the id repository.
+The spls referenced in the second pickle are stored by name, and are taken from the mspl on load,
+which is why the spls of the record are replayed before the second pickle is loaded
+"""
+
+
+def __dump(f, obj, roots):
+	pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+	pickler.inst_persistent_id = lambda o: o.name if isinstance(o, hyportage_data.SPL) and (id(o) not in roots) else None
+	pickler.dump(obj)
+
+
+def encode_record(pattern_repository, id_repository, mspl, spl_groups, spl_names, spl_group_names, patterns):
+	"""
+	creates the record of the changed entries of the hyportage database
+	:param pattern_repository: the pattern repository of the database
+	:param id_repository: the id repository of the database
+	:param mspl: the mspl of the database
+	:param spl_groups: the spl groups of the database
+	:param spl_names: the names of the changed spls (or spl ids)
+	:param spl_group_names: the names of the changed spl groups
+	:param patterns: the changed patterns
+	:return: the serialized record
+	"""
+	f = cStringIO.StringIO()
+	spls = [(spl_name, mspl.get(spl_name)) for spl_name in spl_names]
+	__dump(f, spls, {id(spl) for _, spl in spls})
+	entries = (
+		[(spl_group_name, spl_groups.get(spl_group_name)) for spl_group_name in spl_group_names],
+		[(pattern, pattern_repository.get(pattern)) for pattern in patterns],
+		[(spl_name, id_repository.spls.get(spl_name)) for spl_name in spl_names],
+		id_repository.id_current)
+	__dump(f, entries, ())
+	return f.getvalue()
+
+
+def replay_record(record, pattern_repository, id_repository, mspl, spl_groups):
+	"""
+	applies a record to the hyportage database
+	:param record: the serialized record
+	:param pattern_repository: the pattern repository of the database
+	:param id_repository: the id repository of the database
+	:param mspl: the mspl of the database
+	:param spl_groups: the spl groups of the database
+	:return: None
+	"""
+	unpickler = cPickle.Unpickler(cStringIO.StringIO(record))
+	unpickler.persistent_load = lambda spl_name: mspl[spl_name]
+	for spl_name, spl in unpickler.load():
+		old_spl = mspl.get(spl_name)
+		if spl is None:
+			if old_spl is not None: mspl.pop(spl_name)
+		else:
+			if old_spl is not None:  # the groups that are not in the record must reference the new spl
+				spl_group = spl_groups.get(spl.group_name)
+				if spl_group is not None: spl_group.replace_spl(old_spl, spl)
+			mspl[spl_name] = spl
+	spl_group_entries, pattern_entries, id_entries, id_repository.id_current = unpickler.load()
+	for spl_group_name, spl_group in spl_group_entries:
+		if spl_group is None:
+			if spl_group_name in spl_groups: spl_groups.remove_spl_group(spl_group_name)
+		else: spl_groups.set_spl_group(spl_group)
+	for pattern, pel in pattern_entries:
+		if pel is None:
+			if pattern in pattern_repository: pattern_repository.remove_pattern_element(pattern)
+		else: pattern_repository.set_pattern_element(pel)
+	for spl_name, spl_ids in id_entries:
+		if spl_ids is None:
+			if spl_name in id_repository.spls: id_repository.remove_spl_name(spl_name)
+		else: id_repository.set_spl_ids(spl_name, spl_ids)
+
+
+######################################################################
+# JOURNAL FILE
+######################################################################
+
+
+def __read_header(f):
+	"""
+	:param f: the opened journal
+	:return: the token of the journal, or None if the journal is not valid
+	"""
+	if f.read(len(journal_magic)) != journal_magic: return None
+	header = f.read(__journal_header.size)
+	if len(header) != __journal_header.size: return None
+	version, token = __journal_header.unpack(header)
+	if version != journal_version: return None
+	return token
+
+
+def read_records(path, token):
+	"""
+	reads the records of the journal of a database.
+	If the journal ends with a partially written record, this record is removed from the journal
+	:param path: the path of the database
+	:param token: the token of the database
+	:return: the list of the records of the journal (empty if the journal does not exist or applies to another database)
+	"""
+	path_journal = get_journal_path(path)
+	if not os.path.exists(path_journal): return []
+	res = []
+	with open(path_journal, "rb") as f:
+		if __read_header(f) != token:
+			logging.info("The journal of the hyportage database does not apply to it: ignoring it")
+			return []
+		end = f.tell()
+		while True:
+			header = f.read(__record_header.size)
+			if not header: break
+			if len(header) == __record_header.size:
+				length, crc = __record_header.unpack(header)
+				record = f.read(length)
+				if (len(record) == length) and ((zlib.crc32(record) & 0xffffffff) == crc):
+					res.append(record)
+					end = f.tell()
+					continue
+			logging.warning("The journal of the hyportage database ends with a partially written record: discarding it")
+			break
+	if end != os.path.getsize(path_journal):
+		with open(path_journal, "rb+") as f:
+			f.truncate(end)
+	return res
+
+
+def append_record(path, token, record):
+	"""
+	appends a record to the journal of a database, creating the journal if necessary
+	:param path: the path of the database
+	:param token: the token of the database
+	:param record: the serialized record
+	:return: the size of the journal
+	"""
+	path_journal = get_journal_path(path)
+	if os.path.exists(path_journal):
+		with open(path_journal, "rb") as f:
+			is_valid = __read_header(f) == token
+	else: is_valid = False
+	if not is_valid:  # the header is written atomically
+		path_tmp = path_journal + ".tmp"
+		with open(path_tmp, "wb") as f:
+			f.write(journal_magic)
+			f.write(__journal_header.pack(journal_version, token))
+			f.flush()
+			os.fsync(f.fileno())
+		os.rename(path_tmp, path_journal)
+	with open(path_journal, "ab") as f:
+		f.write(__record_header.pack(len(record), zlib.crc32(record) & 0xffffffff))
+		f.write(record)
+		f.flush()
+		os.fsync(f.fileno())
+	return os.path.getsize(path_journal)
+
+
+def remove(path):
+	"""
+	removes the journal of a database
+	:param path: the path of the database
+	:return: None
+	"""
+	path_journal = get_journal_path(path)
+	if os.path.exists(path_journal): os.remove(path_journal)
@@ -0,0 +1,346 @@
+#!/usr/bin/python
+
+import os
+import logging
+import sqlite3
+import json
+import hashlib
+import cPickle
+import cStringIO
+
+import core_data
+
+import hyportage_data
+import hyportage_ids
+import hyportage_pattern
+
+
+"""
+This file contains the sqlite storage backend of the hyportage database.
+Every spl, spl group, pattern element and id is stored in its own row, and is only loaded when it is accessed.
+Hence, a reconfiguration only loads the transitive closure of the requested packages,
+and a translation only writes back the rows that changed.
+The rows are pickled, the spls they reference being stored by name.
+Since pickling is not canonical (e.g., the iteration order of a dictionary depends on its history),
+every row also stores the digest of a canonical form of its value, which is used to detect changes
+"""
+
+
+__author__ = "Michael Lienhardt"
+__copyright__ = "Copyright 2017, Michael Lienhardt"
+__license__ = "GPL3"
+__version__ = "0.5"
+__maintainer__ = "Michael Lienhardt"
+__email__ = "michael.lienhardt@laposte.net"
+__status__ = "Prototype"
+
+
+######################################################################
+# DATABASE CONNECTION
+######################################################################
+
+
+table_mspl = "mspl"
+table_spl_groups = "spl_groups"
+table_patterns = "patterns"
+table_ids = "ids"
+table_id_spls = "id_spls"
+table_meta = "meta"
+tables = table_mspl, table_spl_groups, table_patterns, table_ids, table_id_spls, table_meta
+
+
+class SQLiteDatabase(object):
+	"""
+	This class wraps the connection to the sqlite file, and the (de)serialization of its rows
+	"""
+	def __init__(self, path):
+		basedir = os.path.dirname(path)
+		if not os.path.exists(basedir): os.makedirs(basedir)
+		self.connection = sqlite3.connect(path)
+		self.connection.text_factory = str
+		with self.connection:
+			for table in tables:
+				self.connection.execute(
+					"CREATE TABLE IF NOT EXISTS " + table + " (key TEXT PRIMARY KEY, digest BLOB NOT NULL, data BLOB NOT NULL)")
+		self.mspl = None  # used to resolve the references to spls
+
+	def dumps(self, obj):
+		f = cStringIO.StringIO()
+		pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+		# the spls referenced by the row are stored by name
+		pickler.inst_persistent_id = lambda o: o.name if (o is not obj) and isinstance(o, hyportage_data.SPL) else None
+		pickler.dump(obj)
+		return f.getvalue()
+
+	def loads(self, data):
+		unpickler = cPickle.Unpickler(cStringIO.StringIO(data))
+		unpickler.persistent_load = lambda spl_name: self.mspl[spl_name]
+		return unpickler.load()
+
+	def select(self, table, key):
+		return self.connection.execute("SELECT digest, data FROM " + table + " WHERE key = ?", (key,)).fetchone()
+
+	def select_keys(self, table):
+		return self.connection.execute("SELECT key FROM " + table)
+
+	def select_all(self, table):
+		return self.connection.execute("SELECT key, digest, data FROM " + table)
+
+	def insert(self, table, rows):
+		self.connection.executemany(
+			"INSERT OR REPLACE INTO " + table + " VALUES (?, ?, ?)",
+			[(key, sqlite3.Binary(digest), sqlite3.Binary(data)) for key, digest, data in rows])
+
+	def delete(self, table, keys):
+		self.connection.executemany("DELETE FROM " + table + " WHERE key = ?", [(key,) for key in keys])
+
+	def get_meta(self, key, default):
+		row = self.select(table_meta, key)
+		if row is None: return default
+		else: return self.loads(str(row[1]))
+
+	def set_meta(self, key, value):
+		self.insert(table_meta, [(key, row_digest(value), self.dumps(value))])
+
+	def clear(self):
+		with self.connection:
+			for table in tables: self.connection.execute("DELETE FROM " + table)
+
+
+######################################################################
+# LAZY MAPPING
+######################################################################
+
+
+def __canonical_form(obj, root):
+	"""
+	computes a canonical form of the object in parameter, i.e., a structure of tuples and atomic values
+	that does not depend on the iteration order of its dictionaries and sets
+	:param obj: the object to consider
+	:param root: the value of the row (the other spls are represented by their name)
+	:return: the canonical form of obj
+	"""
+	if isinstance(obj, unicode): return obj.encode("utf-8")
+	if (obj is None) or isinstance(obj, (str, bool, int, long, float)): return obj
+	if (obj is not root) and isinstance(obj, hyportage_data.SPL): return "spl", obj.name
+	if isinstance(obj, dict):
+		res = tuple(sorted([(__canonical_form(k, root), __canonical_form(v, root)) for k, v in obj.iteritems()]))
+	elif isinstance(obj, (set, frozenset)): res = tuple(sorted([__canonical_form(el, root) for el in obj]))
+	elif isinstance(obj, (tuple, list)): res = tuple([__canonical_form(el, root) for el in obj])
+	else: res = None
+	if hasattr(obj, "__getstate__"): res = res, __canonical_form(obj.__getstate__(), root)
+	elif hasattr(obj, "__dict__"): res = res, __canonical_form(obj.__dict__, root)
+	return type(obj).__name__, res
+
+
+def row_digest(value): return hashlib.md5(repr(__canonical_form(value, value))).digest()
+
+
+def pattern_to_key(pattern): return json.dumps(pattern)
+
+
+def pattern_from_key(key): return core_data.pattern_intern(tuple(json.loads(key)))
+
+
+class SQLiteDict(object):
+	"""
+	A mapping whose content is stored in one table of a sqlite database.
+	Its values are loaded on access, and are written back by flush only if their serialization changed
+	"""
+	def __init__(self, database, table, key_to_db=core_data.identity, key_from_db=core_data.identity):
+		self.database = database
+		self.table = table
+		self.__key_to_db = key_to_db
+		self.__key_from_db = key_from_db
+		self.__cache = {}          # the values already loaded or set
+		self.__digests = {}        # the digest of the stored row of each loaded value
+		self.__removed = set()     # the keys removed since the last flush
+		self.__keys = None         # the set of all the keys, loaded on demand
+		self.__fully_loaded = False
+
+	def __load(self, key):
+		row = self.database.select(self.table, self.__key_to_db(key))
+		if row is None: raise KeyError(key)
+		res = self.database.loads(str(row[1]))
+		self.__cache[key] = res
+		self.__digests[key] = str(row[0])
+		return res
+
+	def __load_all(self):
+		if not self.__fully_loaded:
+			for db_key, digest, data in self.database.select_all(self.table).fetchall():
+				key = self.__key_from_db(db_key)
+				if (key not in self.__cache) and (key not in self.__removed):
+					self.__cache[key] = self.database.loads(str(data))
+					self.__digests[key] = str(digest)
+			self.__fully_loaded = True
+
+	def __get_keys(self):
+		if self.__keys is None:
+			self.__keys = {self.__key_from_db(row[0]) for row in self.database.select_keys(self.table)}
+			self.__keys.difference_update(self.__removed)
+			self.__keys.update(self.__cache.iterkeys())
+		return self.__keys
+
+	#####################################
+	# DICTIONARY INTERFACE
+
+	def __getitem__(self, key):
+		res = self.__cache.get(key)
+		if res is not None: return res
+		if key in self.__removed: raise KeyError(key)
+		return self.__load(key)
+
+	def get(self, key, default=None):
+		try: return self[key]
+		except KeyError: return default
+
+	def __contains__(self, key):
+		if key in self.__cache: return True
+		if key in self.__removed: return False
+		if self.__keys is not None: return key in self.__keys
+		return self.database.select(self.table, self.__key_to_db(key)) is not None
+
+	def has_key(self, key): return key in self
+
+	def __setitem__(self, key, value):
+		self.__cache[key] = value
+		self.__removed.discard(key)
+		if self.__keys is not None: self.__keys.add(key)
+
+	def __delitem__(self, key):
+		if key not in self: raise KeyError(key)
+		self.__cache.pop(key, None)
+		self.__removed.add(key)
+		if self.__keys is not None: self.__keys.discard(key)
+
+	def pop(self, key, *default):
+		if key in self:
+			res = self[key]
+			del self[key]
+			return res
+		elif default: return default[0]
+		else: raise KeyError(key)
+
+	def setdefault(self, key, default=None):
+		if key in self: return self[key]
+		self[key] = default
+		return default
+
+	def update(self, other):
+		for key, value in other.iteritems(): self[key] = value
+
+	def __len__(self): return len(self.__get_keys())
+
+	def __iter__(self): return iter(list(self.__get_keys()))
+
+	def iterkeys(self): return iter(self)
+
+	def keys(self): return list(self.__get_keys())
+
+	def itervalues(self):
+		self.__load_all()
+		return iter(self.__cache.values())
+
+	def values(self): return list(self.itervalues())
+
+	def iteritems(self):
+		self.__load_all()
+		return iter(self.__cache.items())
+
+	def items(self): return list(self.iteritems())
+
+	#####################################
+	# WRITE BACK
+
+	def flush(self):
+		"""
+		writes back the values that changed since they were loaded, and deletes the removed ones
+		:return: the pair of the number of written rows and the number of deleted rows
+		"""
+		nb_deleted = len(self.__removed)
+		self.database.delete(self.table, [self.__key_to_db(key) for key in self.__removed])
+		self.__removed.clear()
+		rows = []
+		for key, value in self.__cache.iteritems():
+			digest = row_digest(value)
+			if self.__digests.get(key) != digest:
+				rows.append((self.__key_to_db(key), digest, self.database.dumps(value)))
+				self.__digests[key] = digest
+		self.database.insert(self.table, rows)
+		return len(rows), nb_deleted
+
+
+######################################################################
+# LOAD AND SAVE
+######################################################################
+
+
+def get_version(path):
+	"""
+	:param path: the path of the sqlite file
+	:return: the version of the data stored in the sqlite hyportage database, or None if it does not exist
+	"""
+	if not os.path.exists(path): return None
+	# the file is only read: its tables are created by load
+	connection = sqlite3.connect(path)
+	try: row = connection.execute("SELECT data FROM " + table_meta + " WHERE key = ?", ("version",)).fetchone()
+	except sqlite3.DatabaseError: row = None  # not a hyportage database (no meta table), or not a sqlite file
+	finally: connection.close()
+	if row is None: return None
+	else: return cPickle.loads(str(row[0]))
+
+
+def load(path, version):
+	"""
+	opens the sqlite hyportage database, creating it if it does not exist.
+	If the database stores another version of the data, it is emptied
+	:param path: the path of the sqlite file
+	:param version: the version of the data expected in the database
+	:return: the tuple of the pattern repository, the id repository, the mspl and the spl groups of the database
+	"""
+	database = SQLiteDatabase(path)
+	database_version = database.get_meta("version", None)
+	if database_version != version:
+		if database_version is not None:
+			logging.warning("The hyportage database was saved by another version of hyportage: emptying it")
+		database.clear()
+	mspl = SQLiteDict(database, table_mspl)
+	database.mspl = mspl
+	# the indexes of the spl groups and of the pattern repository only contain names and patterns,
+	# and are stored in the meta table
+	spl_groups = hyportage_data.SPLGroups(SQLiteDict(database, table_spl_groups))
+	spl_groups.mapping_category, spl_groups.mapping_package = database.get_meta(
+		table_spl_groups, (core_data.dictSet(), core_data.dictSet()))
+	pattern_repository = hyportage_pattern.PatternRepository(
+		SQLiteDict(database, table_patterns, pattern_to_key, pattern_from_key))
+	pattern_repository.mapping_local, pattern_repository.mapping_external = database.get_meta(
+		table_patterns, ({}, set()))
+	id_repository = hyportage_ids.IDRepository()
+	id_repository.ids = SQLiteDict(database, table_ids)
+	id_repository.spls = SQLiteDict(database, table_id_spls)
+	id_repository.id_current, id_repository.keywords = database.get_meta(
+		table_ids, (id_repository.id_current, id_repository.keywords))
+	return pattern_repository, id_repository, mspl, spl_groups
+
+
+def save(pattern_repository, id_repository, mspl, spl_groups, version):
+	"""
+	writes back the rows of the sqlite hyportage database that changed
+	:param pattern_repository: the pattern repository of the database
+	:param id_repository: the id repository of the database
+	:param mspl: the mspl of the database
+	:param spl_groups: the spl groups of the database
+	:param version: the version of the data
+	:return: None
+	"""
+	database = mspl.database
+	with database.connection:
+		database.set_meta("version", version)
+		database.set_meta(table_ids, (id_repository.id_current, id_repository.keywords))
+		database.set_meta(table_spl_groups, (spl_groups.mapping_category, spl_groups.mapping_package))
+		database.set_meta(table_patterns, (pattern_repository.mapping_local, pattern_repository.mapping_external))
+		for mapping in (mspl, spl_groups.entries, pattern_repository.entries, id_repository.ids, id_repository.spls):
+			nb_written, nb_deleted = mapping.flush()
+			logging.info(
+				"table " + mapping.table + ": " + str(nb_written) + " rows written, " + str(nb_deleted) + " rows deleted")
@@ -32,23 +32,56 @@ class IDRepository(object):
 		self.spls = {}            # mapping between spl names and spl id information
 		self.keywords = ([], {})  # list of keywords and mapping between keyword name and index in the list. not used
 
-	def remove_spl(self, spl):
-		spl_id, iuses_ids = self.spls.pop(spl.name)
+	def __getstate__(self):
+		"""
+		The ids mapping is not stored, as it is the inverse of the spls mapping
+		"""
+		return self.id_current, self.spls, self.keywords
+
+	def __setstate__(self, state):
+		self.id_current, spls, self.keywords = state
+		self.ids = {}
+		self.spls = {}
+		for spl_name, spl_ids in spls.iteritems(): self.set_spl_ids(spl_name, spl_ids)
+
+	def remove_spl(self, spl): self.remove_spl_name(spl.name)
+
+	def remove_spl_name(self, spl_name):
+		spl_id, iuses_ids = self.spls.pop(spl_name)
 
 		self.ids.pop(spl_id)
 		for id_use in iuses_ids.values(): self.ids.pop(id_use)
 
+	def set_spl_ids(self, spl_name, spl_ids):
+		"""
+		sets the ids of an spl, as stored in the spls mapping
+		:param spl_name: the name of the spl
+		:param spl_ids: the pair of the id of the spl and the mapping from its use flags to their ids
+		:return: None
+		"""
+		if spl_name in self.spls: self.remove_spl_name(spl_name)
+		spl_id, iuses_id = spl_ids
+		self.spls[spl_name] = spl_ids
+		self.ids[spl_id] = ("package", spl_name)
+		for iuse, iuse_id in iuses_id.iteritems(): self.ids[iuse_id] = ("use", iuse, spl_name)
+
 	def add_spl(self, spl):
+		"""
+		adds the ids of the spl in parameter and of its core use flags, if they do not exist yet
+		:param spl: the spl
+		:return: the set of the use flags whose id has been created
+		"""
 		spl_name = spl.name
 		iuses = spl.iuses_core
 		if spl_name in self.spls:  # update previous data
 			data = self.spls[spl_name]
-			new_iuses = {iuse for iuse in iuses if iuse not in data[3]}
+			new_iuses = {iuse for iuse in iuses if iuse not in data[1]}
 			id_list = utils.new_ids(self, len(new_iuses))
 			for idx, iuse in enumerate(new_iuses):
 				iuse_id = "u" + id_list[idx]
 				data[1][iuse] = iuse_id
 				self.ids[iuse_id] = ("use", iuse, spl_name)
+			return new_iuses
 		else:  # create new data
 			id_list = utils.new_ids(self, 1 + len(iuses))
 			spl_id = "p" + id_list[0]
@@ -60,6 +93,7 @@ class IDRepository(object):
 				self.ids[iuse_id] = ("use", iuse, spl_name)
 				iuses_id[iuse] = iuse_id
 			self.spls[spl_name] = (spl_id, iuses_id)
+			return set(iuses)
 
 
 	#####################################
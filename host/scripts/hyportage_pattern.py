@@ -1,5 +1,8 @@
 #!/usr/bin/python
 
+import sys
+import collections
+
 import core_data
 
 import hyportage_db
@@ -32,6 +35,7 @@ pattern_to_save_format = core_data.pattern_to_save_format
 pattern_from_save_format = core_data.pattern_from_save_format
 pattern_to_atom = core_data.pattern_to_atom
 pattern_get_package_group = core_data.pattern_get_package_group
+pattern_is_package_group_specific = core_data.pattern_is_package_group_specific
 
 
 def match_only_package_group(pattern, spl):
@@ -46,9 +50,6 @@ def match_spl_full(pattern, spl):
 	return core_data.match_spl_full(pattern, spl.core)
 
 
-def pattern_is_package_group_specific(pattern):
-	pattern_package_group = pattern_get_package_group(pattern)
-	return (pattern_package_group[0] != "*") and (pattern_package_group[-1] != "*")
 
 
 ######################################################################
@@ -57,25 +58,136 @@ def pattern_is_package_group_specific(pattern):
 
 
 ######################################################################
-# PATTERN ELEMENTS
+# MATCHED SPLS CACHE
+
+class MatchedSPLsCache(object):
+	"""
+	This class bounds the memory used by the pattern elements to cache the names of the spls they match.
+	The pattern elements with a cache are kept in least recently used order,
+	and the cache of the least recently used ones is dropped when the size of the cached names exceeds the budget.
+	The size of a cache is the one of its tuple plus the ones of the names it contains:
+	the names are counted even when they are shared with the spls (which they are not after loading the database)
+	"""
+	def __init__(self, budget):
+		self.budget = budget   # the maximal size in bytes of the cached tuples of spl names, with their names
+		self.size = 0
+		self.entries = collections.OrderedDict()  # mapping from the pattern elements with a cache to its size, in LRU order
+		self.statistics = {"hits": 0, "misses": 0, "evictions": 0}
+
+	def add(self, pel, spl_names):
+		"""
+		caches the names of the spls matched by a pattern element, dropping the least recently used caches if needed
+		:param pel: the pattern element
+		:param spl_names: the tuple of the names of the spls matched by the pattern element
+		:return: None
+		"""
+		self.remove(pel)
+		size = sys.getsizeof(spl_names) + sum(map(sys.getsizeof, spl_names))
+		if size > self.budget: return
+		pel.matched_spl_names = spl_names
+		self.entries[pel] = size
+		self.size = self.size + size
+		self.__shrink()
+
+	def hit(self, pel):
+		self.entries[pel] = self.entries.pop(pel)
+		self.statistics["hits"] = self.statistics["hits"] + 1
+
+	def miss(self): self.statistics["misses"] = self.statistics["misses"] + 1
+
+	def remove(self, pel):
+		size = self.entries.pop(pel, None)
+		if size is not None:
+			self.size = self.size - size
+			pel.matched_spl_names = None
+
+	def set_budget(self, budget):
+		self.budget = budget
+		self.__shrink()
+
+	def reset_statistics(self):
+		for key in self.statistics: self.statistics[key] = 0
+
+	def get_statistics(self):
+		"""
+		:return: the statistics of the cache, with its hit rate, number of entries and size
+		"""
+		res = dict(self.statistics)
+		nb_calls = res["hits"] + res["misses"]
+		res["hit_rate"] = (float(res["hits"]) / nb_calls) if nb_calls else 0.0
+		res["entries"] = len(self.entries)
+		res["size"] = self.size
+		res["budget"] = self.budget
+		return res
+
+	def __shrink(self):
+		while self.size > self.budget:
+			pel, size = self.entries.popitem(last=False)
+			self.size = self.size - size
+			pel.matched_spl_names = None
+			self.statistics["evictions"] = self.statistics["evictions"] + 1
+
+
+matched_spls_cache = MatchedSPLsCache(16 * 1024 * 1024)  # the cache used by all the pattern elements
 
-spl_list_save_limit = 10
 
+def set_matched_spls_cache_budget(budget):
+	"""
+	sets the memory budget of the matched spls cache
+	:param budget: the maximal size in bytes of the tuples of names cached in the pattern elements,
+		with the strings of the names
+	:return: None
+	"""
+	matched_spls_cache.set_budget(budget)
+
+
+def get_matched_spls_cache_statistics(): return matched_spls_cache.get_statistics()
+
+
+######################################################################
+# PATTERN ELEMENTS
 
 class PatternElement(object):
 	def __init__(self, pattern):
 		self.pattern = pattern
-		self.containing_spl = {}
-		self.__matched_spls = None
+		self.containing_spl = {}       # mapping from the names of the spls containing this pattern to their required uses
+		self.matched_spl_names = None  # the names of the spls matched by this pattern, cached with matched_spls_cache
+		self.smt_fragment = None       # the smt encoding of the matched spls, cached by smt_encoding
+		self.__required_uses_count = core_data.MultiSet()  # the union of the required uses of the containing spls
+		self.__required_uses = None    # the set of the required uses, once computed
 
 	#####################################
 	# DATA UPDATE METHODS
 
-	def add_containing_spl(self, spl, required_uses): self.containing_spl[spl] = required_uses
+	def add_containing_spl(self, spl, required_uses):
+		old_required_uses = self.containing_spl.get(spl.name)
+		if old_required_uses is not None: self.__required_uses_count.remove_all(old_required_uses)
+		self.containing_spl[spl.name] = required_uses
+		self.__required_uses_count.add_all(required_uses)
+		self.__required_uses = None
 
-	def remove_containing_spl(self, spl): self.containing_spl.pop(spl)
+	def remove_containing_spl(self, spl):
+		self.__required_uses_count.remove_all(self.containing_spl.pop(spl.name))
+		self.__required_uses = None
 
-	def reset_cache(self): self.__matched_spls = None
+	def reset_cache(self):
+		matched_spls_cache.remove(self)
+		self.smt_fragment = None
+
+	#####################################
+	# SERIALIZATION
+
+	def __getstate__(self):  # the smt fragment is not stored
+		return self.pattern, self.containing_spl, self.matched_spl_names
+
+	def __setstate__(self, state):
+		self.pattern, self.containing_spl, matched_spl_names = state
+		self.matched_spl_names = None
+		if matched_spl_names is not None: matched_spls_cache.add(self, matched_spl_names)
+		self.smt_fragment = None
+		self.__required_uses_count = core_data.MultiSet()
+		for required_uses in self.containing_spl.itervalues(): self.__required_uses_count.add_all(required_uses)
+		self.__required_uses = None
 
 	#####################################
 	# GENERATORS AND PROPERTIES
@@ -84,26 +196,34 @@ class PatternElement(object):
 		if pattern_is_package_group_specific(self.pattern):
 			spl_group_name = pattern_get_package_group(self.pattern)
 			if spl_group_name in hyportage_db.spl_groups:
-				res = set(filter(self.match_self_pattern_simple, iter(hyportage_db.spl_groups[spl_group_name])))
+				res = set(hyportage_db.spl_groups[spl_group_name].get_matched_spls(self.pattern))
 			else: res = set()
 		else:
-				res = set(filter(self.match_self_pattern_full, hyportage_db.mspl.itervalues()))
+			res = set()
+			for spl_group_name in hyportage_db.spl_groups.get_spl_group_names(pattern_get_package_group(self.pattern)):
+				res.update(hyportage_db.spl_groups[spl_group_name].get_matched_spls(self.pattern))
 		return res
 
 	@property
-	def required_uses(self): return {use for uses in self.containing_spl.itervalues() for use in uses}
+	def required_uses(self):
+		if self.__required_uses is None: self.__required_uses = frozenset(self.__required_uses_count)
+		return self.__required_uses
 
 	@property
 	def matched_spls(self):
-		if self.__matched_spls is not None: return self.__matched_spls
+		if self.matched_spl_names is not None:
+			matched_spls_cache.hit(self)
+			mspl = hyportage_db.mspl
+			return {mspl[spl_name] for spl_name in self.matched_spl_names}
 		else:
+			matched_spls_cache.miss()
 			res = self.__generate_matched_spls()
-			if len(self.containing_spl) > spl_list_save_limit:
-				self.__matched_spls = res
+			# only the pattern elements of the repository are cached, as only their cache is reset when the mspl changes
+			if self.containing_spl: matched_spls_cache.add(self, tuple([spl.name for spl in res]))
 			return res
 
 	@property
-	def is_removable(self): return len(self.required_uses) == 0
+	def is_removable(self): return len(self.containing_spl) == 0
 
 	#####################################
 	# MATCHING METHODS
@@ -113,18 +233,22 @@ class PatternElement(object):
 	def match_self_pattern_full(self, spl): return core_data.match_spl_full(self.pattern, spl.core)
 
 	def contains(self, spl):
-		if self.__matched_spls is not None: return spl in self.__matched_spls
+		if self.matched_spl_names is not None: return spl.name in self.matched_spl_names
 		else: return match_spl_full(self.pattern, spl)
 
 
 ######################################################################
 # PATTERN REPOSITORY
 
-class PatternRepository(dict):
-	def __init__(self):
-		super(PatternRepository, self).__init__()
-		self.mapping_local = {}
-		self.mapping_external = {}
+class PatternRepository(core_data.MappingWrapper):
+	"""
+	The mapping from the patterns to their pattern elements, with indexes giving the patterns that can match a spl group.
+	The pattern elements are stored in a dictionary, or in the mapping given in parameter
+	"""
+	def __init__(self, pattern_elements=None):
+		super(PatternRepository, self).__init__(pattern_elements)
+		self.mapping_local = {}         # mapping from spl group names to the set of patterns specific to that group
+		self.mapping_external = set()   # the set of patterns that are not specific to one spl group
 
 	def add_spl_dependencies(self, spl):
 		pattern_added_list = []
@@ -132,23 +256,15 @@ class PatternRepository(dict):
 		for pattern, required_uses in spl.dependencies.iteritems():
 			if pattern in self:
 				pel = self[pattern]
-				old_required_uses = pel.containing_spl.get(spl)
+				old_required_uses = pel.required_uses
 				pel.add_containing_spl(spl, required_uses)
 				if old_required_uses != pel.required_uses:
 					pattern_updated_list.append(pattern)
 			else:
 				pel = PatternElement(pattern)
-				self[pattern] = pel
 				pel.add_containing_spl(spl, required_uses)
+				self.set_pattern_element(pel)
 				pattern_added_list.append(pattern)
-				if pattern_is_package_group_specific(pattern):
-					spl_group_name = pattern_get_package_group(pattern)
-					if spl_group_name in self.mapping_local:
-						self.mapping_local[spl_group_name][pattern] = pel
-					else:
-						self.mapping_local[spl_group_name] = {pattern: pel}
-				else:
-					self.mapping_external[pattern] = pel
 		return pattern_added_list, pattern_updated_list
 
 	def remove_spl_dependencies(self, spl):
@@ -159,27 +275,70 @@ class PatternRepository(dict):
 			required_uses = pel.required_uses
 			pel.remove_containing_spl(spl)
 			if pel.is_removable:
-				pattern_removed_list.append(pel)
-				self.pop(pattern)
-				if pattern_is_package_group_specific(pattern):
-					self.mapping_local[pattern_get_package_group(pattern)].pop(pattern)
-				else:
-					self.mapping_external.pop(pattern)
+				pattern_removed_list.append(pattern)
+				self.remove_pattern_element(pattern)
 			elif required_uses != pel.required_uses:
 				pattern_updated_list.append(pattern)
 		return pattern_removed_list, pattern_updated_list
 
-	def reset_cache(self, spl_group_name):
+	def set_pattern_element(self, pel):
+		"""
+		adds or replaces the pattern element in parameter, updating the mappings
+		:param pel: the pattern element
+		:return: None
+		"""
+		pattern = pel.pattern
+		if pattern not in self:
+			if pattern_is_package_group_specific(pattern):
+				spl_group_name = pattern_get_package_group(pattern)
+				if spl_group_name in self.mapping_local:
+					self.mapping_local[spl_group_name].add(pattern)
+				else:
+					self.mapping_local[spl_group_name] = {pattern}
+			else:
+				self.mapping_external.add(pattern)
+		else:
+			old_pel = self[pattern]
+			if old_pel is not pel: matched_spls_cache.remove(old_pel)
+		self[pattern] = pel
+
+	def remove_pattern_element(self, pattern):
+		"""
+		removes the pattern element of the pattern in parameter, updating the mappings
+		:param pattern: the pattern
+		:return: None
+		"""
+		matched_spls_cache.remove(self.pop(pattern))
+		if pattern_is_package_group_specific(pattern):
+			self.mapping_local[pattern_get_package_group(pattern)].remove(pattern)
+		else:
+			self.mapping_external.remove(pattern)
+
+	def get_group_patterns(self, spl_group_name):
+		"""
+		:param spl_group_name: the name of a spl group
+		:return: the list of the patterns that can match the spls of that group
+		"""
+		res = list(self.mapping_local.get(spl_group_name, ()))
+		res.extend([pattern for pattern in self.mapping_external if core_data.match_only_package_group(pattern, spl_group_name)])
+		return res
+
+	def reset_cache(self, spl_group_name, spls=None):
+		"""
+		resets the cache of the patterns of a spl group whose version and slot ranges cover the spls in parameter
+		:param spl_group_name: the name of the spl group
+		:param spls: the spls of the group that are added or removed (None to reset the cache of all the patterns of the group)
+		:return: the list of the patterns whose cache has been reset
+		"""
 		reset_list = []
-		mapping = self.mapping_local.get(spl_group_name)
-		if mapping:
-			for pattern, pel in mapping.iteritems():
-				pel.reset_cache()
+		for pattern in self.get_group_patterns(spl_group_name):
+			if (spls is None) or any([core_data.match_spl_simple(pattern, spl.core) for spl in spls]):
+				self[pattern].reset_cache()
 				reset_list.append(pattern)
 		return reset_list
 
 	def get_with_default(self, pattern):
-		res = dict.get(self, pattern)
+		res = self.get(pattern)
 		if res is None: res = PatternElement(pattern)
 		return res
 
@@ -11,6 +11,9 @@ import utils
 import utils_egencache
 import hyportage_data
 import hyportage_pattern
+import hyportage_constraint_ast
+import hyportage_visibility
+import smt_encoding
 
 
 """
@@ -31,42 +34,72 @@ __status__ = "Prototype"
 # 1. COMPUTE WHAT TO DO
 ##########################################################################
 
-def filter_egencache_file(path_file, last_update):
-	return last_update < os.path.getmtime(path_file)
-
-
-def filter_egencache_file_full(path_file, last_update, patterns):
-	if last_update < os.path.getmtime(path_file):
-		return True
+def is_forced(patterns, path_file):
+	package_name = utils_egencache.get_package_name_from_path(path_file)[0]
 	for pattern in patterns:
-		if core_data.match_package_path(pattern, path_file):
+		if core_data.match_package_path(pattern, package_name):
 			return True
 	return False
 
 
-def compute_to_load(last_update, force, path_egencache_packages):
+def compute_to_load(manifest, force, path_egencache_packages):
 	"""
-	This function collects the names of the packages in the portage repository, and lists the ones that need to be loaded
-	:param last_update: the date of the last update of the hyportage repository
+	This function collects the names of the packages in the portage repository, and lists the ones that need to be loaded.
+	An egencache file is loaded only if its digest (see utils_egencache.get_egencache_digest) differs from the one
+	stored in the manifest of the previous translation, or if it matches one of the patterns to force.
+	The directories whose mtime did not change since the previous translation are not listed,
+	and their files are neither opened nor stat'ed (see utils_egencache.scan_egencache_directories)
+	:param manifest: the mapping from the egencache directories (relative to path_egencache_packages)
+		to their mtime, the names of their sub-directories and the mapping from their files to their digest,
+		as computed during the previous translation
 	:param force: the list of patterns to force to load
 	:param path_egencache_packages: the path to the portage repository
-	:return: a pair consisting of the list of files to load, plus the set of packages in the portage repository
-		(so we know which spl must be removed from hyportage)
+	:return: a tuple consisting of the list of files to load, the set of packages in the portage repository
+		(so we know which spl must be removed from hyportage), and the new manifest
 	"""
 	utils.phase_start("Computing what to do.")
-	egencache_files = utils_egencache.get_egencache_files(path_egencache_packages)
 	if force:
-		atom_list = force.split()
-		patterns = [hyportage_pattern.pattern_create_from_atom(atom) for atom in atom_list]
-		def filter_function(path_file): return filter_egencache_file_full(path_file, last_update, patterns)
-	else:
-		def filter_function(path_file): return filter_egencache_file(path_file, last_update)
-	egencache_files_to_load = filter(filter_function, egencache_files)
-	logging.info("number of egencache files found: " + str(len(egencache_files)))
+		patterns = [hyportage_pattern.pattern_create_from_atom(atom) for atom in force.split()]
+	else: patterns = []
+
+	new_manifest = {}
+	egencache_files_to_load = []
+	spl_name_set = set()
+	nb_files, nb_scanned_directories, nb_added, nb_changed, nb_removed = 0, 0, 0, 0, 0
+	for directory, mtime, subdirectories, filenames in utils_egencache.scan_egencache_directories(
+			path_egencache_packages, manifest):
+		path_directory = os.path.join(path_egencache_packages, directory)
+		old_digests = manifest[directory][2] if directory in manifest else {}
+		if filenames is None: digests = old_digests
+		else:
+			nb_scanned_directories = nb_scanned_directories + 1
+			digests = {}
+			for filename in filenames:
+				digest = utils_egencache.get_egencache_digest(os.path.join(path_directory, filename))
+				digests[filename] = digest
+				old_digest = old_digests.get(filename)
+				if old_digest is None: nb_added = nb_added + 1
+				elif old_digest != digest: nb_changed = nb_changed + 1
+			nb_removed = nb_removed + len([filename for filename in old_digests if filename not in digests])
+		new_manifest[directory] = mtime, subdirectories, digests
+		for filename, digest in digests.iteritems():
+			path_file = os.path.join(path_directory, filename)
+			if (old_digests.get(filename) != digest) or (patterns and is_forced(patterns, path_file)):
+				egencache_files_to_load.append(path_file)
+			spl_name_set.add(utils_egencache.get_package_name_from_path(path_file)[0])
+		nb_files = nb_files + len(digests)
+	nb_removed = nb_removed + sum([
+		len(manifest[directory][2]) for directory in manifest.iterkeys() if directory not in new_manifest])
+
+	logging.info("number of egencache files found: " + str(nb_files))
+	logging.info(
+		"number of egencache directories: " + str(len(new_manifest)) + ", listed: " + str(nb_scanned_directories))
+	logging.info(
+		"egencache files added: " + str(nb_added) + ", changed: " + str(nb_changed) + ", removed: " + str(nb_removed))
 	logging.info("number of egencache files to load: " + str(len(egencache_files_to_load)))
 
 	utils.phase_end("Computation completed")
-	return egencache_files_to_load, {utils_egencache.get_package_name_from_path(f)[0] for f in egencache_files}
+	return egencache_files_to_load, spl_name_set, new_manifest
 
 
 def load_spl_to_load(concurrent_map, egencache_files_to_load):
@@ -79,7 +112,29 @@ def load_spl_to_load(concurrent_map, egencache_files_to_load):
 	nb_egencache_files_to_load = len(egencache_files_to_load)
 	if nb_egencache_files_to_load > 0:  # load new hyportage spls  from egencache files
 		utils.phase_start("Loading the " + str(nb_egencache_files_to_load) + " egencache files.")
-		loaded_spls = concurrent_map(utils_egencache.create_spl_from_egencache_file, egencache_files_to_load)
+		utils_egencache.get_parse_cache_data()  # reset the statistics
+		core_data.pattern_pop_nb_requests()
+		loaded_data = concurrent_map(
+			utils_egencache.create_spl_from_egencache_file_with_cache_data, egencache_files_to_load)
+		loaded_spls = []
+		nb_hits, nb_misses, nb_pattern_requests = 0, 0, 0
+		for spl, (parse_cache_new, parse_cache_used, hits, misses), pattern_requests in loaded_data:
+			# merge the parse caches, ASTs and patterns of the workers
+			fm_local = hyportage_constraint_ast.ast_intern_list(spl.fm_local)
+			fm_combined = hyportage_constraint_ast.ast_intern_list(spl.fm_combined)
+			if any([el1 is not el2 for el1, el2 in zip(fm_local + fm_combined, spl.fm_local + spl.fm_combined)]):
+				spl.fm_local, spl.fm_combined = fm_local, fm_combined
+				spl.generate_dependencies_and_requirements()  # to use the interned patterns
+			loaded_spls.append(spl)
+			for key, ast in parse_cache_new.iteritems():
+				utils_egencache.parse_cache_new[key] = utils_egencache.parse_cache.setdefault(
+					key, hyportage_constraint_ast.ast_intern_list(ast))
+			utils_egencache.parse_cache_used.update(parse_cache_used)
+			nb_hits, nb_misses = nb_hits + hits, nb_misses + misses
+			nb_pattern_requests = nb_pattern_requests + pattern_requests
+		logging.info("parse cache: " + str(nb_hits) + " hits, " + str(nb_misses) + " misses")
+		logging.info(
+			"patterns: " + str(nb_pattern_requests) + " requested, " + str(core_data.pattern_get_nb_distinct()) + " distinct")
 		utils.phase_end("Loading completed")
 	else: loaded_spls = []
 	return loaded_spls
@@ -106,7 +161,7 @@ def update_mspl_and_groups(mspl, spl_groups, spl_name_set, loaded_spls):
 	for spl in loaded_spls:
 		if spl.name in mspl: spl_to_update.append((mspl[spl.name], spl))
 		else: spl_to_add.append(spl)
-	spl_to_remove = [spl for spl_name, spl in mspl.iteritems() if spl_name not in spl_name_set]
+	spl_to_remove = [mspl[spl_name] for spl_name in mspl.iterkeys() if spl_name not in spl_name_set]
 
 	spl_groups_added = set()
 	spl_groups_updated = set()
@@ -119,14 +174,16 @@ def update_mspl_and_groups(mspl, spl_groups, spl_name_set, loaded_spls):
 		if added_group is not None: spl_groups_added.add(added_group)
 
 	# update the updated spls
+	# (the spl groups are updated first, as they may be lazily loaded, with their spls taken from the mspl)
 	for old_spl, new_spl in spl_to_update:
+		hyportage_data.spl_groups_replace_spl(spl_groups, old_spl, new_spl)
 		hyportage_data.mspl_update_spl(mspl, old_spl, new_spl)
 		spl_groups_updated.add(new_spl.group_name)
 
 	# remove the removed spls
 	for old_spl in spl_to_remove:
-		hyportage_data.mspl_remove_spl(mspl, old_spl)
 		removed_group = hyportage_data.spl_groups_remove_spl(spl_groups, old_spl)
+		hyportage_data.mspl_remove_spl(mspl, old_spl)
 		if removed_group is not None: spl_groups_removed.add(removed_group)
 	utils.phase_end("Updating completed")
 	spl_added_full = loaded_spls
@@ -145,26 +202,41 @@ def __update_pattern_repository_spl_dependencies(pattern_repository, spl_added,
 	pattern_updated = set()
 	pattern_removed = set()
 
-	for new_spl in spl_added:
-		pattern_added_list, pattern_updated_list = pattern_repository.add_spl_dependencies(new_spl)
-		pattern_added.update(pattern_added_list)
-		pattern_updated.update(pattern_updated_list)
+	# the removed spls are processed first, as an updated spl is both removed (old version) and added (new version)
 	for old_spl in spl_removed:
 		pattern_removed_list, pattern_updated_list = pattern_repository.remove_spl_dependencies(old_spl)
 		pattern_removed.update(pattern_removed_list)
 		pattern_updated.update(pattern_updated_list)
+	for new_spl in spl_added:
+		pattern_added_list, pattern_updated_list = pattern_repository.add_spl_dependencies(new_spl)
+		pattern_added.update(pattern_added_list)
+		pattern_updated.update(pattern_updated_list)
+	pattern_removed.difference_update(pattern_added)
+	pattern_updated.difference_update(pattern_removed)
 
 	return pattern_added, pattern_updated, pattern_removed
 
 
 def __update_pattern_repository_reset_pel(pattern_repository, spl_added, spl_removed):
+	# only the patterns matching an added or removed spl (an updated spl being both) have their matched spls changed.
+	# The spls are stored in lists: as spls are compared by name, a set would keep only one version of an updated spl
+	changed_spls = {}
+	for spl in spl_added: changed_spls.setdefault(spl.group_name, []).append(spl)
+	for spl in spl_removed: changed_spls.setdefault(spl.group_name, []).append(spl)
 	pattern_updated = set()
-	added_spl_group_names = {spl.group_name for spl in spl_added}
-	for spl_group_name in added_spl_group_names:
-		pattern_updated.update(pattern_repository.reset_cache(spl_group_name))
-	removed_spl_group_names = {spl.group_name for spl in spl_removed}
-	for spl_group_name in removed_spl_group_names:  # no data changed in the spls
-		pattern_repository.reset_cache(spl_group_name)
+	pattern_kept = set()
+	for spl_group_name, spls in changed_spls.iteritems():
+		reset_list = pattern_repository.reset_cache(spl_group_name, spls)
+		pattern_updated.update(reset_list)
+		pattern_kept.update(pattern_repository.get_group_patterns(spl_group_name))
+	pattern_kept.difference_update(pattern_updated)
+	if pattern_kept:
+		spl_names_updated = {spl_name for pattern in pattern_updated for spl_name in pattern_repository[pattern].containing_spl}
+		spl_names_kept = {spl_name for pattern in pattern_kept for spl_name in pattern_repository[pattern].containing_spl}
+		spl_names_kept.difference_update(spl_names_updated)
+		logging.info(
+			"pattern caches reset: " + str(len(pattern_updated)) + ", kept: " + str(len(pattern_kept))
+			+ " (" + str(len(spl_names_kept)) + " spl constraints not regenerated)")
 	return pattern_updated
 
 
@@ -197,24 +269,27 @@ def update_revert_dependencies(pattern_repository, pattern_added_updated, patter
 	:param pattern_added: the patterns that were added to the repository
 	:param pattern_updated: the patterns that were changed in the repository
 	:param pattern_removed: the patterns that were removed from the repository
-	:return: the set of spls whose cache has been reset
+	:return: the pair of the list of spls whose cache has been reset, and the set of spls whose revert dependencies changed
 	"""
 	utils.phase_start("Updating the set of externally required features.")
 	updated_spl_list = []
+	modified_spl_set = set()
 	for pattern in pattern_added_updated:
 		pel = pattern_repository[pattern]
 		required_uses = pel.required_uses
 		for spl in pel.matched_spls:
+			if spl.get_revert_dependency(pattern) != required_uses: modified_spl_set.add(spl)
 			if spl.update_revert_dependencies(pattern, required_uses):
 				updated_spl_list.append(spl)
 
 	for pattern in pattern_removed:
-		pel = pattern_repository[pattern]
+		pel = pattern_repository.get_with_default(pattern)
 		for spl in pel.matched_spls:
+			if spl.get_revert_dependency(pattern) is not None: modified_spl_set.add(spl)
 			spl.reset_revert_dependencies(pattern)
 
 	utils.phase_end("Updating completed")
-	return updated_spl_list
+	return updated_spl_list, modified_spl_set
 
 
 ##########################################################################
@@ -222,24 +297,31 @@ def update_revert_dependencies(pattern_repository, pattern_added_updated, patter
 ##########################################################################
 
 
-def reset_implicit_features(mspl, is_eapi4_updated, is_eapi5_updated):
+def reset_implicit_features(mspl, is_eapi4_updated, is_eapi5_updated, changed_eapi4=None, changed_eapi5=None):
 	"""
-	This function resets the cached data of the spls if the implicit use flags changed
+	This function resets the cached data of the spls if the implicit use flags changed.
+	When the implicit use flags that changed are known, only the spls whose core use flags changed are updated
 	:param mspl: the hyportage mspl
 	:param is_eapi4_updated: if the implicit use fags for eapi4 or less changed
 	:param is_eapi5_updated: if the implicit use fags for eapi5 or more changed
+	:param changed_eapi4: the implicit use flags for eapi4 or less that changed (None if unknown)
+	:param changed_eapi5: the implicit use flags for eapi5 or more that changed (None if unknown)
 	:return: the list of updated spls
 	"""
 	utils.phase_start("Adding the implicit Features to the spls.")
 	updated_spl_list = []
 	if is_eapi4_updated or is_eapi5_updated:
 		for spl in mspl.itervalues():
-			if (spl.eapi < 5) and is_eapi4_updated:
+			if (spl.eapi < 5) and is_eapi4_updated: changed = changed_eapi4
+			elif (spl.eapi > 4) and is_eapi5_updated: changed = changed_eapi5
+			else: continue
+			if changed is None:
 				spl.reset_iuses_full()
 				updated_spl_list.append(spl)
-			elif (spl.eapi > 4) and is_eapi5_updated:
+			elif not changed.issubset(spl.iuses_default):
+				old_iuses_core = spl.iuses_core
 				spl.reset_iuses_full()
-				updated_spl_list.append(spl)
+				if spl.iuses_core != old_iuses_core: updated_spl_list.append(spl)
 	utils.phase_end("Addition completed")
 	return updated_spl_list
 
@@ -250,10 +332,21 @@ def reset_implicit_features(mspl, is_eapi4_updated, is_eapi5_updated):
 
 
 def update_id_repository(id_repository, changed_ids_spl_set, spl_removed):
+	"""
+	This function removes the ids of the removed spls, and adds the ids of the spls and core use flags that are missing
+	:param id_repository: the hyportage id repository
+	:param changed_ids_spl_set: the spls whose ids may have changed
+	:param spl_removed: the spls removed from the mspl
+	:return: the mapping from the spls to the use flags whose id has been created
+	"""
 	utils.phase_start("Updating the Id Repository")
+	use_ids_added = {}
 	for spl in spl_removed: id_repository.remove_spl(spl)
-	for spl in changed_ids_spl_set: id_repository.add_spl(spl)
+	for spl in changed_ids_spl_set:
+		use_flags = id_repository.add_spl(spl)
+		if use_flags: use_ids_added[spl] = use_flags
 	utils.phase_end("Generation completed")
+	return use_ids_added
 
 
 ##########################################################################
@@ -261,19 +354,38 @@ def update_id_repository(id_repository, changed_ids_spl_set, spl_removed):
 ##########################################################################
 
 
-def update_visibility(mspl, spl_added, new_masks, new_keywords, new_licenses):
+def update_visibility(
+		concurrent_map, pattern_repository, spl_groups, spl_added,
+		new_masks, new_keywords, new_licenses, changed_patterns):
+	"""
+	This function updates the visibility data of the spls.
+	When the mask and keyword configuration changed and the patterns it concerns are known,
+	only the spls matched by these patterns are updated (with their use flag selection)
+	:param concurrent_map: the map function used to distribute the computation when the whole mspl is considered
+	:param pattern_repository: the hyportage pattern repository
+	:param spl_groups: the hyportage spl groups
+	:param spl_added: the spls added to the mspl
+	:param new_masks: if the mask configuration changed
+	:param new_keywords: if the keyword configuration changed
+	:param new_licenses: if the license configuration changed
+	:param changed_patterns: the patterns whose mask or keyword configuration changed (None if unknown)
+	:return: None
+	"""
 	utils.phase_start("Updating the SPL Visibility")
-	if new_masks:
-		for spl in mspl.itervalues():
-			spl.reset_unmasked()
-			spl.generate_visibility_data()
-	elif new_keywords or new_licenses:
-		for spl in mspl.itervalues():
-			spl.reset_unmasked_other()
-			spl.generate_visibility_data()
+	if new_licenses or ((new_masks or new_keywords) and (changed_patterns is None)):
+		hyportage_visibility.compute_visibility(concurrent_map, spl_groups.itervalues())
+		for spl_group in spl_groups.itervalues():
+			for spl in spl_group: spl.reset_use_selection()
 	else:
-		for spl in spl_added:
+		spl_set = set(spl_added)
+		if new_masks or new_keywords:
+			for pattern in changed_patterns:
+				spl_set.update(pattern_repository.get_with_default(pattern).matched_spls)
+			logging.info(
+				"updating the visibility of " + str(len(spl_set)) + " spls (" + str(len(changed_patterns)) + " changed patterns)")
+		for spl in spl_set:
 			spl.generate_visibility_data()
+			spl.reset_use_selection()
 	utils.phase_end("Generation completed")
 
 
@@ -282,15 +394,27 @@ def update_visibility(mspl, spl_added, new_masks, new_keywords, new_licenses):
 ##########################################################################
 
 
-def update_use_flag_selection(mspl, spl_added, new_keywords, new_use_flag_config):
+def update_use_flag_selection(mspl, pattern_repository, new_use_flag_config, changed_use_flags, changed_use_patterns):
+	"""
+	This function resets the use flag selection of the spls impacted by a change of the use flag configuration.
+	The use flag selection is not stored in the database, and is recomputed only when needed
+	:param mspl: the hyportage mspl
+	:param pattern_repository: the hyportage pattern repository
+	:param new_use_flag_config: if the use flag configuration changed
+	:param changed_use_flags: the use flags whose global manipulation changed (None if unknown)
+	:param changed_use_patterns: the patterns whose use flag manipulation changed (None if unknown)
+	:return: None
+	"""
 	utils.phase_start("Updating the SPL use flag Selection")
-	if new_keywords or new_use_flag_config:
-		for spl in mspl.itervalues():
-			spl.reset_use_selection()
-			_ = spl.use_selection_core
-	else:
-		for spl in spl_added:
-			_ = spl.use_selection_core
+	if new_use_flag_config:
+		if (changed_use_flags is None) or (changed_use_patterns is None):
+			spl_iterator = mspl.itervalues()
+		else:
+			spl_set = {spl for spl in mspl.itervalues() if not changed_use_flags.isdisjoint(spl.iuses_full)}
+			for pattern in changed_use_patterns:
+				spl_set.update(pattern_repository.get_with_default(pattern).matched_spls)
+			spl_iterator = iter(spl_set)
+		for spl in spl_iterator: spl.reset_use_selection()
 	utils.phase_end("Generation completed")
 
 
@@ -299,41 +423,99 @@ def update_use_flag_selection(mspl, spl_added, new_keywords, new_use_flag_config
 ##########################################################################
 
 
+def get_smt_dependents(
+		pattern_repository, mspl, spl_groups, pattern_added_updated_content, spl_added, spl_removed, use_ids_added):
+	"""
+	This function lists the spls and spl groups whose constraints must be recomputed, following what the constraints reference:
+	 - the constraint of a spl references the patterns of its dependencies and the ids of the spls they match
+	   (whose changes are given by pattern_added_updated_content),
+	   and the use flags of these spls that are selected in the dependencies (see smt_encoding.convert_spl),
+	   whose ids can be created
+	 - the constraint of a spl group references the ids of the spls of the group
+	:param pattern_repository: the hyportage pattern repository
+	:param mspl: the hyportage mspl
+	:param spl_groups: the hyportage spl groups
+	:param pattern_added_updated_content: the patterns that are added or whose matched spls changed
+	:param spl_added: the spls added to the mspl
+	:param spl_removed: the spls removed from the mspl
+	:param use_ids_added: the mapping from the spls to the use flags whose id has been created (see update_id_repository)
+	:return: the pair of the set of spls and of the set of spl groups whose constraints must be recomputed
+	"""
+	spl_set = set(spl_added)
+	for pattern in pattern_added_updated_content:
+		spl_set.update([mspl[spl_name] for spl_name in pattern_repository[pattern].containing_spl])
+	for spl, use_flags in use_ids_added.iteritems():
+		references = [(spl.name, use_flag) for use_flag in use_flags]
+		for pattern in spl.get_revert_dependency_patterns(use_flags):
+			for spl_name in pattern_repository[pattern].containing_spl:
+				dependent = mspl[spl_name]
+				use_references = dependent.smt_use_references_if_computed
+				if (use_references is not None) and any([reference in use_references for reference in references]):
+					spl_set.add(dependent)
+	spl_group_set = {spl_groups[spl.group_name] for spl in spl_added}
+	spl_group_set.update([spl_groups[spl.group_name] for spl in spl_removed if spl.group_name in spl_groups])
+	return spl_set, spl_group_set
+
+
 def update_smt_constraints(
-		pattern_repository, mspl, spl_groups,
-		pattern_added_updated_content,
-		spl_added_list, implicit_use_flag_changed):
+		concurrent_map, pattern_repository, id_repository, spl_set, spl_group_set, simplify_mode):
+	"""
+	This function recomputes the constraints of the spls and spl groups in parameter (see get_smt_dependents).
+	The constraints of the spls are generated with concurrent_map (see smt_encoding.convert_spls)
+	:return: the pair of the list of spls and of the list of spl groups whose constraints changed
+	"""
 	utils.phase_start("Updating the core SMT Constraints")
-	# the spls for which we need to recompute the constraint are:
-	#  - all spls if the use flag changed
-	#      (it is a good enough approximation, and computing the actual set would be far to costly)
-	#  - otherwise the added spls and the ones with a reference to the modified patterns
-	# additionally, we need to update the SMT of the spl_group of these spls
-	#
-	# Note about the computation of the set of spl in case of use flag modification:
-	#  - we need to update the constraint of all these spls
-	#  - plus the ones that depend on these spls (because e.g. some use flags might not exist anymore)
-	# too costly
-	if implicit_use_flag_changed or (len(pattern_repository)/2 < len(pattern_added_updated_content)):
-		iterator_spl = mspl.itervalues()
-		iterator_spl_group = spl_groups.itervalues()
-	else:
-		spl_set = set(spl_added_list)
-		for pattern in pattern_added_updated_content:
-			spl_set.update(pattern_repository[pattern].containing_spl.keys())
-		spl_group_set = {spl_groups[spl.group_name] for spl in spl_set}
-		iterator_spl = iter(spl_set)
-		iterator_spl_group = iter(spl_group_set)
-
-	for spl in iterator_spl:
-		spl.reset_smt()
-		_ = spl.smt
-
-	for spl_group in iterator_spl_group:
+	logging.info(
+		"recomputing the constraints of " + str(len(spl_set)) + " spls and " + str(len(spl_group_set)) + " spl groups")
+	spl_list = []
+	spl_to_convert = list(spl_set)
+	smt_encoding.reset_fragment_statistics()
+	smt_list = smt_encoding.convert_spls(concurrent_map, pattern_repository, id_repository, spl_to_convert, simplify_mode)
+	nb_created, nb_reused = smt_encoding.fragment_statistics["created"], smt_encoding.fragment_statistics["reused"]
+	if nb_created + nb_reused > 0:
+		logging.info(
+			"dependency fragments: " + str(nb_created) + " created, " + str(nb_reused) + " reused (reuse ratio "
+			+ str(round(float(nb_reused) / (nb_created + nb_reused), 3)) + ")")
+	for spl, (smt, use_references) in zip(spl_to_convert, smt_list):
+		if smt != spl.smt_if_computed: spl_list.append(spl)
+		spl.set_smt(smt, use_references)
+
+	spl_group_list = []
+	for spl_group in spl_group_set:
+		old_smt = spl_group.smt_if_computed
 		spl_group.reset_smt()
-		_ = spl_group.smt
+		if spl_group.smt != old_smt: spl_group_list.append(spl_group)
 
 	utils.phase_end("Updating completed")
+	return spl_list, spl_group_list
+
+
+##########################################################################
+# 8. LIST THE CHANGES
+##########################################################################
+
+
+def get_changed_entries(spl_added, spl_removed, spl_modified, spl_group_modified, pattern_reset):
+	"""
+	This function lists the entries of the hyportage database that changed during its update
+	:param spl_added: the spls that were added to the mspl
+	:param spl_removed: the spls that were removed from the mspl
+	:param spl_modified: the spls of the mspl that were modified
+	:param spl_group_modified: the spl groups that were modified
+	:param pattern_reset: the patterns whose cache has been reset (as their stored matched spls changed)
+	:return: the tuple of the names of the changed spls (which are also the ones whose ids may have changed),
+		the names of the changed spl groups and the changed patterns
+	"""
+	spl_names = {spl.name for spl in spl_added}
+	spl_names.update([spl.name for spl in spl_removed])
+	spl_names.update([spl.name for spl in spl_modified])
+	spl_group_names = {spl.group_name for spl in spl_added}
+	spl_group_names.update([spl.group_name for spl in spl_removed])
+	spl_group_names.update([spl_group.name for spl_group in spl_group_modified])
+	patterns = {pattern for spl in spl_added for pattern in spl.dependencies}
+	patterns.update([pattern for spl in spl_removed for pattern in spl.dependencies])
+	patterns.update(pattern_reset)
+	return spl_names, spl_group_names, patterns
 
 
 
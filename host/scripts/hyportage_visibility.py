@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+import core_data
+
+import hyportage_db
+
+
+"""
+This file contains the computation of the visibility of the spls (mask, keywords and stability).
+The mask and keyword manipulations of the configuration are evaluated spl group by spl group,
+only considering the ones whose pattern can match the spls of the group.
+Keyword sets are encoded as bitmasks, the bits being given by the keyword list of the configuration
+(the keywords that are not in that list get their bit on the fly).
+A full computation of the visibility of the mspl can be split between several processes
+"""
+
+
+__author__ = "Michael Lienhardt"
+__copyright__ = "Copyright 2017, Michael Lienhardt"
+__license__ = "GPL3"
+__version__ = "0.5"
+__maintainer__ = "Michael Lienhardt"
+__email__ = "michael.lienhardt@laposte.net"
+__status__ = "Prototype"
+
+
+######################################################################
+# VISIBILITY ENGINE
+######################################################################
+
+
+class VisibilityEngine(object):
+	"""
+	This class computes the visibility of spls w.r.t. one configuration
+	"""
+	def __init__(self, mspl_config, keyword_list):
+		self.mspl_config = mspl_config
+		self.keyword_bits = {}                  # mapping from keywords to their bit
+		self.keyword_mask_unstable = 0          # the bitmask of all the unstable keywords (i.e., starting with ~)
+		self.set_manipulation_masks = {}        # mapping from set manipulations to their bitmask encoding
+		for keyword in keyword_list or (): self.get_keyword_bit(keyword)
+		self.accept_keywords_full = self.get_keyword_mask(mspl_config.accept_keywords_full or ())
+
+	def get_keyword_bit(self, keyword):
+		res = self.keyword_bits.get(keyword)
+		if res is None:
+			res = 1 << len(self.keyword_bits)
+			self.keyword_bits[keyword] = res
+			if keyword[0] == "~": self.keyword_mask_unstable = self.keyword_mask_unstable | res
+		return res
+
+	def get_keyword_mask(self, keywords):
+		res = 0
+		for keyword in keywords: res = res | self.get_keyword_bit(keyword)
+		return res
+
+	def apply_set_manipulation(self, set_manipulation, keyword_mask):
+		"""
+		applies a keyword set manipulation on a keyword bitmask, like SetManipulation.apply on a keyword set
+		:param set_manipulation: the keyword set manipulation
+		:param keyword_mask: the keyword bitmask
+		:return: the resulting keyword bitmask
+		"""
+		masks = self.set_manipulation_masks.get(id(set_manipulation))
+		if masks is None:
+			masks = (
+				set_manipulation, set_manipulation.remove_all,
+				self.get_keyword_mask(set_manipulation.positive), self.get_keyword_mask(set_manipulation.negative))
+			self.set_manipulation_masks[id(set_manipulation)] = masks
+		_, remove_all, positive, negative = masks
+		if remove_all: return positive
+		else: return (keyword_mask & ~negative) | positive
+
+	def get_group_visibility(self, package_group, spl_data_list):
+		"""
+		computes the visibility of the spls of one spl group
+		:param package_group: the name of the spl group
+		:param spl_data_list: the list of the core, keyword set and license of the spls
+		:return: the list of the tuples (unmasked, unmasked_keyword, unmasked_license, installable, is_stable) of the spls
+		"""
+		masks = list(self.mspl_config.pattern_mask.get_group_elements(package_group))
+		unmasks = list(self.mspl_config.pattern_unmask.get_group_elements(package_group)) if masks else ()
+		keywords = list(self.mspl_config.pattern_keywords.get_group_manipulations(package_group))
+		accept_keywords = list(self.mspl_config.pattern_accept_keywords.get_group_manipulations(package_group))
+		res = []
+		for spl_core, keyword_set, license in spl_data_list:
+			# 1. mask
+			masked = False
+			for add, pattern in masks:
+				if core_data.match_spl_full(pattern, spl_core): masked = add
+			unmasked = True
+			if masked:
+				unmasked = False
+				for add, pattern in unmasks:
+					if core_data.match_spl_full(pattern, spl_core): unmasked = add
+			# 2. keywords
+			keyword_mask = self.get_keyword_mask(keyword_set)
+			for pattern, set_manipulation in keywords:
+				if core_data.match_spl_full(pattern, spl_core):
+					keyword_mask = self.apply_set_manipulation(set_manipulation, keyword_mask)
+			accept_keyword_mask = self.accept_keywords_full
+			for pattern, set_manipulation in accept_keywords:
+				if core_data.match_spl_full(pattern, spl_core):
+					accept_keyword_mask = self.apply_set_manipulation(set_manipulation, accept_keyword_mask)
+			matched = keyword_mask & accept_keyword_mask
+			unmasked_keyword = matched != 0
+			# 3. installable and stable. TODO: add license management
+			if unmasked: res.append((unmasked, unmasked_keyword, True, unmasked_keyword, (matched & self.keyword_mask_unstable) == 0))
+			else: res.append((unmasked, unmasked_keyword, True, False, False))
+		return res
+
+
+__engine = None
+
+
+def get_engine():
+	"""
+	:return: the visibility engine of the current configuration of hyportage
+	"""
+	global __engine
+	if (__engine is None) or (__engine.mspl_config is not hyportage_db.mspl_config):
+		__engine = VisibilityEngine(hyportage_db.mspl_config, hyportage_db.keyword_list)
+	return __engine
+
+
+######################################################################
+# BATCH COMPUTATION
+######################################################################
+
+
+def __get_visibility_chunk(group_data_list):
+	engine = get_engine()
+	return [engine.get_group_visibility(package_group, spl_data_list) for package_group, spl_data_list in group_data_list]
+
+
+def compute_visibility(concurrent_map, spl_groups, chunk_number=16):
+	"""
+	computes the visibility of all the spls of the groups in parameter, and stores it in the spls
+	:param concurrent_map: the map function used to distribute the computation
+	:param spl_groups: the spl groups to consider
+	:param chunk_number: the number of chunks in which the spl groups are split
+	:return: None
+	"""
+	spl_groups = list(spl_groups)
+	group_data_list = [
+		(spl_group.name, [(spl.core, spl.keyword_set, spl.license) for spl in spl_group]) for spl_group in spl_groups]
+	chunk_size = max(1, (len(group_data_list) + chunk_number - 1) // chunk_number)
+	chunks = [group_data_list[i:i + chunk_size] for i in xrange(0, len(group_data_list), chunk_size)]
+	results = [visibility for chunk_result in concurrent_map(__get_visibility_chunk, chunks) for visibility in chunk_result]
+	for spl_group, visibility_list in zip(spl_groups, results):
+		for spl, visibility in zip(spl_group, visibility_list):
+			spl.set_visibility_data(*visibility)
@@ -171,6 +171,17 @@ def installed_spls_to_solver(id_repository, installed_spls, spl_names):
 	return res
 
 
+def get_id_visualization(id_repository, id):
+	"""
+	:param id_repository: the id repository of hyportage
+	:param id: the id of a spl or of a use flag
+	:return: the readable form of the id
+	"""
+	data = id_repository.ids[id]
+	if data[0] == "package": return data[1]
+	else: return data[2] + "#" + data[1]
+
+
 def get_better_constraint_visualization(id_repository, mspl, constraints):
 	"""
 	function that manipulates the constraints in a more readable form for analysing them.
@@ -188,19 +199,14 @@ def get_better_constraint_visualization(id_repository, mspl, constraints):
 		f.close()
 		formula = script.get_last_formula()
 		formula = pysmt.shortcuts.to_smtlib(formula, daggify=False)
-		# translate packages
+		# translate packages and uses in one pass, as the names of the spls can contain ids
+		# (the auxiliary variables of the at most one constraints are not translated)
 		where_declared = "user-required: "
-		spl_ids = set(re.findall('(p[0-9]+)', formula))
-		for spl_id in spl_ids:
+		for spl_id in set(re.findall(r"\b(p[0-9]+)\b", formula)):
 			name = id_repository.ids[spl_id][1]
-			formula = re.sub(spl_id, name, formula)
 			if i in mspl[name].smt:
 				where_declared = name + ": "
-
-		# translate uses
-		use_ids = set(re.findall('(u[0-9]+)', formula))
-		for use_id in use_ids:
-			formula = re.sub(use_id, id_repository.ids[use_id][2] + "#" + id_repository.ids[use_id][1], formula)
+		formula = re.sub(r"\b[pu][0-9]+\b", lambda m: get_id_visualization(id_repository, m.group(0)), formula)
 		ls.append(where_declared + formula)
 	return ls
 
@@ -217,6 +223,7 @@ def generate_to_install_spls(id_repository, mspl, feature_list):
 	res_core = core_data.dictSet()
 	use_flags = []
 	for feature in feature_list:
+		if feature not in id_repository.ids: continue  # auxiliary variable of an at most one constraint
 		el = id_repository.data_from_id(feature)
 		if el[0] == "package":  # el = ("package", spl_name)
 			res_core.add_key(el[1])
@@ -423,17 +430,14 @@ def next_spls(pattern_repository, spl):
 
 
 def get_dependency_transitive_closure(pattern_repository, mspl, spls):
-	for spl in mspl.itervalues():
-		spl.visited = False
 	nexts = spls
 	res = set()
 	while len(nexts) > 0:
 		accu = set()
 		for spl in nexts:
-			spl.visited = True
 			res.add(spl)
 			accu.update(next_spls(pattern_repository, spl))
-		nexts = filter(lambda spl: not spl.visited, accu)
+		nexts = accu - res
 
 	return res
 
@@ -3,14 +3,20 @@
 
 import logging
 import itertools
-import z3
+import multiprocessing
+try: import z3
+except ImportError: z3 = None
 
 import core_data
 import hyportage_constraint_ast
+import hyportage_ids
+import smt_formula
 
 
 """
-This file contains the functions that computes the constraints for spls, spl_groups and use flag selection
+This file contains the functions that computes the constraints for spls, spl_groups and use flag selection.
+The constraints are built with the formulas of smt_formula,
+or with z3 when it is selected as backend (see set_smt_backend), which is used for validation
 """
 
 
@@ -24,13 +30,15 @@ __status__ = "Prototype"
 
 
 def cleanup():
-	global smt_false, smt_true, smt_or, smt_and, smt_not, smt_implies
+	global smt_false, smt_true, smt_or, smt_and, smt_not, smt_implies, smt_iff
 	smt_false = None
 	smt_true  = None
 	smt_or    = None
 	smt_and   = None
 	smt_not   = None
 	smt_implies = None
+	smt_iff = None
+	smt_formula.reset()
 
 
 ######################################################################
@@ -38,28 +46,67 @@ def cleanup():
 ######################################################################
 
 
-smt_false = z3.BoolVal(False)
-smt_true  = z3.BoolVal(True)
-smt_variable = z3.Bool
+def __z3_iff(left, right): return left == right
 
-smt_or  = z3.Or
-smt_and = z3.And
-smt_not = z3.Not
-smt_implies = z3.Implies
 
+def __z3_to_string(constraint):
+	v = (z3.Ast * 0)()
+	return z3.Z3_benchmark_to_smtlib_string(
+		constraint.ctx_ref(), "benchmark", "", "unknown", "", 0, v, constraint.as_ast()).replace(
+		"\n", " ").replace("(check-sat)", "").replace("; benchmark (set-info :status unknown)", "").strip()
 
-def get_int_from_bool_list(fs): return z3.Sum([z3.If(b, 1, 0) for b in fs])
 
+def set_smt_backend(backend):
+	"""
+	sets the library used to build the constraints
+	:param backend: "formula" for smt_formula (the default), or "z3" (which must be installed)
+	:return: None
+	"""
+	global smt_false, smt_true, smt_variable, smt_or, smt_and, smt_not, smt_implies, smt_iff
+	global smt_simplify, smt_is_false, smt_to_string
+	if backend == "z3":
+		smt_false = z3.BoolVal(False)
+		smt_true  = z3.BoolVal(True)
+		smt_variable = z3.Bool
+		smt_or  = z3.Or
+		smt_and = z3.And
+		smt_not = z3.Not
+		smt_implies = z3.Implies
+		smt_iff = __z3_iff
+		smt_simplify = z3.simplify
+		smt_is_false = z3.is_false
+		smt_to_string = __z3_to_string
+	else:
+		smt_false = smt_formula.false
+		smt_true  = smt_formula.true
+		smt_variable = smt_formula.Bool
+		smt_or  = smt_formula.Or
+		smt_and = smt_formula.And
+		smt_not = smt_formula.Not
+		smt_implies = smt_formula.Implies
+		smt_iff = smt_formula.Iff
+		smt_simplify = smt_formula.simplify
+		smt_is_false = smt_formula.is_false
+		smt_to_string = smt_formula.to_smtlib
+
+
+set_smt_backend("formula")
 
-def get_no_two_true_expressions_num(fs):
-	return get_int_from_bool_list(fs) <= 1
 
+##
 
-def get_exactly_one_true_expressions_num(fs):
-	return get_int_from_bool_list(fs) == 1
+"""
+The at most one constraints can be encoded pairwise (quadratic in the number of expressions),
+or with a sequential counter (linear, with auxiliary variables [Sinz, CP 2005]).
+The auxiliary variables of an encoding are named with a prefix given by the caller,
+which must be unique among all the constraints (see ASTtoSMTVisitor.get_aux_prefix and convert_spl_group).
+These encodings are equisatisfiable with the pairwise one only where they occur positively in the constraint,
+which is the case of the choices of the feature models and of the slot conflicts
+"""
 
+amo_encoding = "auto"       # the encoding of the at most one constraints: "pairwise", "sequential" or "auto"
+amo_pairwise_limit = 5      # the maximal number of expressions encoded pairwise in "auto" mode
 
-##
 
 def get_no_two_true_expressions_bool_core(fs):
 	constraints = []
@@ -72,28 +119,39 @@ def get_no_two_true_expressions_bool(fs):
 	return smt_and(get_no_two_true_expressions_bool_core(fs))
 
 
-def get_exactly_one_true_expressions_bool(fs):
-	constraints = get_no_two_true_expressions_bool_core(fs)
-	constraints.append(smt_or(fs))
+def get_no_two_true_expressions_sequential(fs, aux_prefix):
+	"""
+	:param fs: the list of expressions (at least two)
+	:param aux_prefix: the prefix of the auxiliary variables, the i-th of which is true if one of fs[0..i] is true
+	:return: the sequential counter encoding of the constraint that at most one of the expressions is true
+	"""
+	aux = [smt_variable(aux_prefix + str(i)) for i in xrange(len(fs) - 1)]
+	constraints = [smt_implies(fs[0], aux[0])]
+	for i in xrange(1, len(fs) - 1):
+		constraints.append(smt_implies(fs[i], aux[i]))
+		constraints.append(smt_implies(aux[i - 1], aux[i]))
+		constraints.append(smt_implies(fs[i], smt_not(aux[i - 1])))
+	constraints.append(smt_implies(fs[-1], smt_not(aux[-1])))
 	return smt_and(constraints)
 
 
 ##
 
-smt_no_two_true_expressions = get_no_two_true_expressions_bool
-smt_exactly_one_true_expressions = get_exactly_one_true_expressions_bool
+def smt_no_two_true_expressions(fs, aux_prefix):
+	if (amo_encoding == "pairwise") or ((amo_encoding == "auto") and (len(fs) <= amo_pairwise_limit)):
+		return get_no_two_true_expressions_bool(fs)
+	else:
+		return get_no_two_true_expressions_sequential(fs, aux_prefix)
 
-##
 
-def smt_to_string(constraint, status="unknown", name="benchmark", logic=""):
-	v = (z3.Ast * 0)()
-	return z3.Z3_benchmark_to_smtlib_string(
-		constraint.ctx_ref(), name, logic, status, "", 0, v, constraint.as_ast()).replace(
-		"\n", " ").replace("(check-sat)", "").replace("; benchmark (set-info :status unknown)", "").strip()
+def smt_exactly_one_true_expressions(fs, aux_prefix):
+	return smt_and([smt_no_two_true_expressions(fs, aux_prefix), smt_or(fs)])
 
 
-def smt_list_to_strings(constraints, status="unknown", name="benchmark", logic=""):
-	return map(lambda c: smt_to_string(c, status, name, logic), constraints)
+##
+
+def smt_list_to_strings(constraints):
+	return map(lambda c: smt_to_string(c), constraints)
 
 
 ######################################################################
@@ -113,6 +171,12 @@ def get_spl_smt_not(id_repository, spl_name):
 def get_spl_smt_list(id_repository, spl_names):
 	return map(lambda spl_name: get_spl_smt(id_repository, spl_name), spl_names)
 
+
+def get_spl_smt_or(id_repository, spl_names):
+	"""returns the constraint stating that one of the spls in input is installed"""
+	if spl_names: return smt_or(get_spl_smt_list(id_repository, spl_names))
+	else: return smt_false
+
 ##
 
 
@@ -145,7 +209,7 @@ def get_use_hyvarrec(id_repository, spl_name, use_flag):
 ######################################################################
 
 
-def decompact_selection_list(id_repository, local_spl_name, spl_name, selection_list):
+def decompact_selection_list(id_repository, local_spl_name, spl_name, selection_list, use_references):
 	"""
 	generate the constraint corresponding to local_spl_name depending to spl_name,
 	possibly with a use flag selection specified
@@ -153,36 +217,35 @@ def decompact_selection_list(id_repository, local_spl_name, spl_name, selection_
 	:param local_spl_name is the spl containing the constraint
 	:param spl_name is the spl for which the use flag selection is specified
 	:param selection_list is the use flag selection specified for the spl_name
+	:param use_references is the set extended with the (spl_name, use flag) pairs referenced by the constraint
 	:returns the constraint corresponding to the specified dependency
 	"""
 	res = [get_spl_smt(id_repository, spl_name)]
-	for selection in selection_list:
-		use_flag = selection['use']
+	for _, use_flag, prefix, default, suffix in selection_list:
+		use_references.add((spl_name, use_flag))
 		if id_repository.exists_use_flag(spl_name, use_flag):
 			use_smt = get_use_smt(id_repository, spl_name, use_flag)
-			if "prefix" in selection:  # two cases: "-" (not selected), or "!" (compact form)
-				if selection['prefix'] == "-":
+			if prefix is not None:  # two cases: "-" (not selected), or "!" (compact form)
+				if prefix == "-":
 					res.append(smt_not(use_smt))
-				else:  # selection['prefix'] == "!"
+				else:  # prefix == "!"
 					local_use_smt = get_use_smt(id_repository, local_spl_name, use_flag)
-					if selection['suffix'] == "=":
-						res.append(local_use_smt == smt_not(use_smt))
-					else:  # selection['suffix'] == "?"
+					if suffix == "=":
+						res.append(smt_iff(local_use_smt, smt_not(use_smt)))
+					else:  # suffix == "?"
 						res.append(smt_implies(smt_not(local_use_smt), use_smt))
-			elif "suffix" in selection:
+			elif suffix is not None:
 				local_use_smt = get_use_smt(id_repository, local_spl_name, use_flag)
-				if selection['suffix'] == "=":
-					res.append(local_use_smt == use_smt)
-				else:  # selection['suffix'] == "?"
+				if suffix == "=":
+					res.append(smt_iff(local_use_smt, use_smt))
+				else:  # suffix == "?"
 					res.append(smt_implies(local_use_smt, use_smt))
 			else:
 				res.append(use_smt)
-		elif "default" in selection:
-			prefix = "prefix" in selection
-			default = selection['default']
-			if "suffix" in selection:
+		elif default is not None:
+			prefix = prefix is not None
+			if suffix is not None:
 				local_use_smt = get_use_smt(id_repository, local_spl_name, use_flag)
-				suffix = selection['suffix']
 				if (((suffix == "?") and (not prefix) and (default == "-"))
 						or ((suffix == "=") and (((not prefix) and (default == "-")) or (prefix and (default == "+"))))):
 					res.append(smt_not(local_use_smt))
@@ -190,7 +253,7 @@ def decompact_selection_list(id_repository, local_spl_name, spl_name, selection_
 						or ((suffix == "=") and (((not prefix) and (default == "+")) or (prefix and (default == "-"))))):
 					res.append(local_use_smt)
 			else:
-				if (default == "+" and "prefix" in selection) or (default == "-" and "prefix" not in selection):
+				if (default == "+" and prefix) or (default == "-" and not prefix):
 					return [smt_false]  # FALSE, this spl cannot be installed
 		else:
 			return [smt_false]  # FALSE, this spl cannot be installed
@@ -201,6 +264,22 @@ def decompact_selection_list(id_repository, local_spl_name, spl_name, selection_
 # visitor to convert the AST into SMT formulas
 ##############################################
 
+"""
+The disjunction of the spls matched by a pattern (called its fragment) is shared by all the dependencies on that pattern
+without use flag selection: it is cached in the pattern element (until its reset_cache),
+or in the chunk for the parallel generation.
+A fragment cached in a pattern element is tagged with the backend and the generation of smt_formula it was created with,
+as it cannot be combined with formulas created by another backend, or after a reset of smt_formula.
+The number of fragments created and reused is counted in fragment_statistics
+"""
+
+fragment_statistics = {"created": 0, "reused": 0}
+
+
+def reset_fragment_statistics():
+	fragment_statistics["created"], fragment_statistics["reused"] = 0, 0
+
+
 class ASTtoSMTVisitor(hyportage_constraint_ast.ASTVisitor):
 	"""
 	This class implements a translator from the fm_local and fm_combined AST to SMT constraints
@@ -221,88 +300,146 @@ class ASTtoSMTVisitor(hyportage_constraint_ast.ASTVisitor):
 		self.mspl = mspl
 		self.spl_groups = spl_groups
 		self.spl_name = spl_name
+		self.aux_number = 0
+		self.use_references = set()  # the use flags of the other spls referenced by the constraints (see convert_spl)
+
+	def get_aux_prefix(self):
+		"""
+		:return: a new prefix for the auxiliary variables of an at most one constraint of the spl
+		"""
+		res = "a" + self.id_repository.get_id_from_spl_name(self.spl_name) + "_" + str(self.aux_number) + "_"
+		self.aux_number = self.aux_number + 1
+		return res
 
 	def visitRequired(self, ctx):
 		return map(self.visitRequiredEL, ctx)
 
 	def visitRequiredSIMPLE(self, ctx):
-		use_smt = get_use_smt(self.id_repository, self.spl_name, ctx["use"])
-		if "not" in ctx: use_smt = smt_not(use_smt)
+		use_smt = get_use_smt(self.id_repository, self.spl_name, ctx[1])
+		if ctx[2] is not None: use_smt = smt_not(use_smt)
 		return use_smt
 
 	def visitRequiredCONDITION(self, ctx):
-		formulas = self.visitRequired(ctx['els'])
-		# assert (self.id_repository["flag"][self.spl_name][ctx['condition']['use']])  # flag must exists
-		use_smt = get_use_smt(self.id_repository, self.spl_name, ctx['condition']['use'])
-		if 'not' in ctx['condition']: use_smt = smt_not(use_smt)
+		_, (_, use, neg), els = ctx
+		formulas = self.visitRequired(els)
+		# assert (self.id_repository["flag"][self.spl_name][use])  # flag must exists
+		use_smt = get_use_smt(self.id_repository, self.spl_name, use)
+		if neg is not None: use_smt = smt_not(use_smt)
 		return smt_implies(use_smt, smt_and(formulas))
 
 	def visitRequiredCHOICE(self, ctx):
-		formulas = map(self.visitRequiredEL, ctx['els'])
-		if ctx["choice"] == "||":  # or
+		formulas = map(self.visitRequiredEL, ctx[2])
+		if ctx[1] == "||":  # or
 			return smt_or(formulas)
-		elif ctx["choice"] == "??":  # one-max
+		elif ctx[1] == "??":  # one-max
 			if len(formulas) > 1:
-				return smt_no_two_true_expressions(formulas)
+				return smt_no_two_true_expressions(formulas, self.get_aux_prefix())
 			else:
 				return smt_true
-		elif ctx["choice"] == "^^":  # xor
+		elif ctx[1] == "^^":  # xor
 			if len(formulas) > 1:
-				return smt_exactly_one_true_expressions(formulas)
+				return smt_exactly_one_true_expressions(formulas, self.get_aux_prefix())
 			elif len(formulas) == 1:
 				return formulas[0]
 			return smt_false  # no formula to be satisfied
 
 	def visitRequiredINNER(self, ctx):
-		return smt_and(self.visitRequired(ctx['els']))
+		return smt_and(self.visitRequired(ctx[1]))
 
 	def visitDepend(self, ctx):
 		return map(self.visitDependEL, ctx)
 
+	def get_matched_spl_names(self, pattern):
+		return [spl.name for spl in self.pattern_repository[pattern].matched_spls]
+
+	def get_fragment(self, pattern):
+		pel = self.pattern_repository[pattern]
+		tag = smt_or, smt_formula.generation
+		if (pel.smt_fragment is None) or (pel.smt_fragment[0] != tag):  # not computed, or stale
+			pel.smt_fragment = tag, get_spl_smt_or(self.id_repository, self.get_matched_spl_names(pattern))
+			fragment_statistics["created"] = fragment_statistics["created"] + 1
+		else: fragment_statistics["reused"] = fragment_statistics["reused"] + 1
+		return pel.smt_fragment[1]
+
 	def visitDependSIMPLE(self, ctx):
-		spls = self.pattern_repository[ctx['atom']].matched_spls
-		spl_name_list = [spl.name for spl in spls]
-		if spl_name_list:
-			# decompact compact forms
-			if "selection" in ctx:
+		_, pattern, neg, selection = ctx
+		if selection is not None:
+			spl_name_list = self.get_matched_spl_names(pattern)
+			if spl_name_list:
+				# decompact compact forms
 				formulas = [
-					decompact_selection_list(self.id_repository, self.spl_name, external_spl_name, ctx['selection'])
+					decompact_selection_list(
+						self.id_repository, self.spl_name, external_spl_name, selection, self.use_references)
 					for external_spl_name in spl_name_list]
 				formula = smt_or([smt_and(formula) for formula in formulas])
 			else:
-				formula = smt_or(get_spl_smt_list(self.id_repository, spl_name_list))
+				formula = smt_false
 		else:
-			formula = smt_false
+			formula = self.get_fragment(pattern)
 
-		if "not" in ctx:
+		if neg is not None:
 			return smt_not(formula)
 		return formula
 
 	def visitDependCONDITION(self, ctx):
-		formulas = self.visitDepend(ctx['els'])
-		use_smt = get_use_smt(self.id_repository, self.spl_name, ctx['condition']['use'])
-		if 'not' in ctx['condition']:
+		_, (_, use, neg), els = ctx
+		formulas = self.visitDepend(els)
+		use_smt = get_use_smt(self.id_repository, self.spl_name, use)
+		if neg is not None:
 			use_smt = smt_not(use_smt)
 		return smt_implies(use_smt, smt_and(formulas))
 
 	def visitDependCHOICE(self, ctx):
-		formulas = map(self.visitDependEL, ctx['els'])
-		if ctx["choice"] == "||":  # or
+		formulas = map(self.visitDependEL, ctx[2])
+		if ctx[1] == "||":  # or
 			return smt_or(formulas)
-		elif ctx["choice"] == "??":  # one-max
+		elif ctx[1] == "??":  # one-max
 			if len(formulas) > 1:
-				return smt_no_two_true_expressions(formulas)
+				return smt_no_two_true_expressions(formulas, self.get_aux_prefix())
 			else:
 				return smt_true
-		elif ctx["choice"] == "^^":  # xor
+		elif ctx[1] == "^^":  # xor
 			if len(formulas) > 1:
-				return smt_exactly_one_true_expressions(formulas)
+				return smt_exactly_one_true_expressions(formulas, self.get_aux_prefix())
 			elif len(formulas) == 1:
 				return formulas[0]
 			return smt_false # no formula to be satisfied
 
 	def visitDependINNER(self, ctx):
-		return smt_and(self.visitDepend(ctx['els']))
+		return smt_and(self.visitDepend(ctx[1]))
+
+
+class ASTtoSMTVisitorMatched(ASTtoSMTVisitor):
+	"""
+	This class implements the same translator as ASTtoSMTVisitor,
+	but the spls matched by the patterns are given by name, so the hyportage database is not needed
+	"""
+
+	def __init__(self, id_repository, matched_spl_names, fragments, statistics, spl_name):
+		"""
+		The constructor of this class
+		:param id_repository: an id repository containing (at least) the ids of the spls referenced in the constraints
+		:param matched_spl_names: the mapping from the patterns of the constraints to the names of the spls they match
+		:param fragments: the mapping from the patterns to their fragment, shared by the visitors of a chunk
+		:param statistics: the number of fragments created and reused, like fragment_statistics
+		:param spl_name: the name of the spl whose constraints will be translated
+		"""
+		super(ASTtoSMTVisitorMatched, self).__init__(None, id_repository, None, None, spl_name)
+		self.matched_spl_names = matched_spl_names
+		self.fragments = fragments
+		self.statistics = statistics
+
+	def get_matched_spl_names(self, pattern):
+		return self.matched_spl_names[pattern]
+
+	def get_fragment(self, pattern):
+		res = self.fragments.get(pattern)
+		if res is None:
+			res = get_spl_smt_or(self.id_repository, self.matched_spl_names[pattern])
+			self.fragments[pattern] = res
+			self.statistics["created"] = self.statistics["created"] + 1
+		else: self.statistics["reused"] = self.statistics["reused"] + 1
+		return res
 
 
 ######################################################################
@@ -320,36 +457,47 @@ def simplify_constraints(spl_name, constraints, simplify_mode):
 	:return:
 	"""
 	if simplify_mode == "default":
-		formula = z3.simplify(smt_and(constraints))
-		if z3.is_false(formula):
+		formula = smt_simplify(smt_and(constraints))
+		if smt_is_false(formula):
 			logging.warning("Dependencies in package " + spl_name + " make it uninstallable.")
 		return [formula]
 	elif simplify_mode == "individual":
 		formulas = []
 		for c in constraints:
-			formula = z3.simplify(c)
-			if z3.is_false(formula):
+			formula = smt_simplify(c)
+			if smt_is_false(formula):
 				logging.warning("Dependencies in package " + spl_name + " make it uninstallable.")
 				return [smt_false]
 			formulas.append(formula)
 		return formulas
 
 
-def convert_spl(pattern_repository, id_repository, mspl, spl_groups, spl, simplify_mode):
-	spl_name = spl.name
+def __convert_spl_feature_model(visitor, id_repository, spl_name, fm_local, fm_combined, simplify_mode):
 	spl_smt = get_spl_smt(id_repository, spl_name)
 	#logging.debug("Processing spl " + spl_name)
 	constraints = []
 	# print("processing (" + str(spl_name) + ", " + str(spl_id) + ")")
 	# 1. convert feature model
-	visitor = ASTtoSMTVisitor(pattern_repository, id_repository, mspl, spl_groups, spl_name)
-	constraints.extend(visitor.visitRequired(spl.fm_local))
-	constraints.extend(visitor.visitDepend(spl.fm_combined))
+	constraints.extend(visitor.visitRequired(fm_local))
+	constraints.extend(visitor.visitDepend(fm_combined))
 	#for constraint in visitor.visitDepend(spl.fm_combined):
 	#	constraints.append(smt_implies(spl_smt, constraint))
 
-	return smt_list_to_strings(
+	smt = smt_list_to_strings(
 		map(lambda c: smt_implies(spl_smt, c), simplify_constraints(spl_name, constraints, simplify_mode)))
+	return smt, visitor.use_references
+
+
+def convert_spl(pattern_repository, id_repository, mspl, spl_groups, spl, simplify_mode):
+	"""
+	generates the constraints of a spl.
+	Apart from the patterns of its dependencies and the ids of the spls they match,
+	these constraints depend on the existence of the use flags of these spls that are selected in the dependencies:
+	they are returned as the set of the referenced (spl name, use flag) pairs
+	:return: the pair of the constraints of the spl and of the use flags of other spls they reference
+	"""
+	visitor = ASTtoSMTVisitor(pattern_repository, id_repository, mspl, spl_groups, spl.name)
+	return __convert_spl_feature_model(visitor, id_repository, spl.name, spl.fm_local, spl.fm_combined, simplify_mode)
 
 
 def convert_spl_group(id_repository, spl_group, simplify_mode):
@@ -360,8 +508,9 @@ def convert_spl_group(id_repository, spl_group, simplify_mode):
 	# two installed spl should have different slots or subslots
 	for spls in spl_group.slots_mapping.itervalues():
 		if len(spls) > 1:
-			spl_smt_list = get_spl_smt_list(id_repository, [spl.name for spl in spls])
-			constraints.append(smt_no_two_true_expressions(spl_smt_list))
+			spl_names = sorted([spl.name for spl in spls])
+			aux_prefix = "a" + id_repository.get_id_from_spl_name(spl_names[0]) + "_s_"
+			constraints.append(smt_no_two_true_expressions(get_spl_smt_list(id_repository, spl_names), aux_prefix))
 
 	return smt_list_to_strings(simplify_constraints(spl_group_name, constraints, simplify_mode))
 
@@ -380,8 +529,8 @@ def convert_patterns(pattern_repository, id_repository, patterns):
 		new_spls = pattern_repository.get_with_default(pattern).matched_spls
 		spls.update(new_spls)
 		#print(core_data.pattern_to_atom(pattern) + " => " + str([spl.name for spl in new_spls]))
-		constraint = z3.simplify(smt_or([get_spl_smt(id_repository, spl.name) for spl in new_spls]))
-		if z3.is_false(constraint):
+		constraint = smt_simplify(smt_or([get_spl_smt(id_repository, spl.name) for spl in new_spls]))
+		if smt_is_false(constraint):
 			logging.warning("atom \"" + (core_data.pattern_to_atom(pattern)) + "\" is satisfied by no ebuild")
 			return set(), []
 		constraints.append(constraint)
@@ -392,4 +541,67 @@ def convert_installed_spls(id_repository, domain_spls, installed_spls):
 	uninstalled_spls = [spl.name for spl in domain_spls if spl.name not in installed_spls]
 	constraint = [get_spl_smt(id_repository, spl_name) for spl_name in installed_spls]
 	constraint.extend([get_spl_smt_not(id_repository, spl_name) for spl_name in uninstalled_spls])
-	return smt_list_to_strings(constraint)
\ No newline at end of file
+	return smt_list_to_strings(constraint)
+
+
+######################################################################
+# 5. PARALLEL SMT CONSTRAINT GENERATION FOR SPLs
+######################################################################
+
+"""
+The constraints of a list of spls can be generated by several processes, each with its own formulas.
+The list is split in chunks, and each chunk contains all the data needed to generate the constraints of its spls:
+the ids of the spls it references, the names of the spls matched by the patterns of the constraints,
+and the feature model of the spls.
+The fragments of the patterns are shared by the spls of a chunk.
+The generated constraints are sent back as strings (see smt_to_string)
+"""
+
+
+def __get_spl_chunk(pattern_repository, id_repository, spls, simplify_mode):
+	spl_ids, matched_spl_names, spl_data_list = {}, {}, []
+	for spl in spls:
+		spl_ids[spl.name] = id_repository.spls[spl.name]
+		for pattern in spl.dependencies:
+			if pattern not in matched_spl_names:
+				spl_name_list = [matched_spl.name for matched_spl in pattern_repository[pattern].matched_spls]
+				matched_spl_names[pattern] = spl_name_list
+				for spl_name in spl_name_list: spl_ids[spl_name] = id_repository.spls[spl_name]
+		spl_data_list.append((spl.name, spl.fm_local, spl.fm_combined))
+	return spl_ids, matched_spl_names, spl_data_list, simplify_mode
+
+
+def __convert_spl_chunk(chunk):
+	spl_ids, matched_spl_names, spl_data_list, simplify_mode = chunk
+	id_repository = hyportage_ids.IDRepository()
+	for spl_name, ids in spl_ids.iteritems(): id_repository.set_spl_ids(spl_name, ids)
+	res, fragments, statistics = [], {}, {"created": 0, "reused": 0}
+	for spl_name, fm_local, fm_combined in spl_data_list:
+		visitor = ASTtoSMTVisitorMatched(id_repository, matched_spl_names, fragments, statistics, spl_name)
+		res.append(__convert_spl_feature_model(visitor, id_repository, spl_name, fm_local, fm_combined, simplify_mode))
+	# the formulas of a worker process are not used anymore, while the ones of the main process may be
+	if multiprocessing.current_process().name != "MainProcess": smt_formula.reset()
+	return res, statistics
+
+
+def convert_spls(concurrent_map, pattern_repository, id_repository, spls, simplify_mode, chunk_number=16):
+	"""
+	generates the constraints of several spls, like convert_spl
+	:param concurrent_map: the map function used to distribute the computation
+	:param pattern_repository: the pattern_repository of hyportage
+	:param id_repository: the id_repository of hyportage
+	:param spls: the list of spls
+	:param simplify_mode: the mode of simplification of the constraints
+	:param chunk_number: the number of chunks in which the list of spls is split
+	:return: the list of the constraints of the spls with the use flags they reference (see convert_spl),
+		in the same order as the spls
+	"""
+	chunk_size = max(1, (len(spls) + chunk_number - 1) // chunk_number)
+	chunks = [
+		__get_spl_chunk(pattern_repository, id_repository, spls[i:i + chunk_size], simplify_mode)
+		for i in xrange(0, len(spls), chunk_size)]
+	res = []
+	for chunk_result, statistics in concurrent_map(__convert_spl_chunk, chunks):
+		res.extend(chunk_result)
+		for key, value in statistics.iteritems(): fragment_statistics[key] = fragment_statistics[key] + value
+	return res
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+
+try: import z3
+except ImportError: z3 = None
+
+
+"""
+This file contains a lightweight representation of the propositional formulas used in the SMT constraints.
+The formulas are hash-consed (two formulas with the same structure are the same object),
+and are simplified when they are created:
+ - the constants are folded,
+ - the nested conjunctions and disjunctions are flattened,
+ - the duplicated operands of conjunctions and disjunctions are removed,
+ - a conjunction (resp. disjunction) containing an operand and its negation is false (resp. true).
+The formulas are printed in the SMT-LIB format (their subformulas occurring several times being shared with let),
+and can be translated into z3 formulas (if z3 is installed), which is used for validation.
+The functions creating the formulas are named after the ones of z3
+"""
+
+
+__author__ = "Michael Lienhardt"
+__copyright__ = "Copyright 2017, Michael Lienhardt"
+__license__ = "GPL3"
+__version__ = "0.5"
+__maintainer__ = "Michael Lienhardt"
+__email__ = "michael.lienhardt@laposte.net"
+__status__ = "Prototype"
+
+
+######################################################################
+# FORMULA NODES
+######################################################################
+
+
+class Formula(object):
+	"""
+	This class represents the nodes of the formulas.
+	Its instances must only be created with the functions of this file, which ensure that the nodes are hash-consed
+	"""
+	__slots__ = ("op", "args", "negation", "text")
+
+	def __init__(self, op, args):
+		self.op = op                # the SMT-LIB operator of the node, or the name of the variable
+		self.args = args            # the tuple of the operands of the node, None for variables
+		self.negation = None        # the negation of this node, if it has been created
+		self.text = op if not args else None  # the SMT-LIB expression of the node without let, once computed
+
+
+__nodes = {}  # mapping from the operator and operands of the nodes to the nodes
+generation = 0  # the number of resets of the hash-consing table: the formulas of different generations must not be mixed
+
+
+def __get_node(op, args):
+	key = op, args
+	res = __nodes.get(key)
+	if res is None:
+		res = Formula(op, args)
+		__nodes[key] = res
+	return res
+
+
+def reset():
+	"""
+	empties the hash-consing table, to free the memory used by the formulas that are not referenced anymore,
+	and starts a new generation.
+	The formulas created before a reset must not be combined with the ones created after it:
+	their variables and subformulas would not be shared (breaking the simplifications and the printing),
+	hence the formulas kept over a reset must be tagged with their generation, and discarded if it is not the current one
+	:return: None
+	"""
+	global generation
+	__nodes.clear()
+	generation = generation + 1
+
+
+true = Formula("true", ())
+false = Formula("false", ())
+true.negation, false.negation = false, true
+
+
+######################################################################
+# FORMULA CREATION
+######################################################################
+
+
+def BoolVal(value): return true if value else false
+
+
+def Bool(name): return __get_node(name, None)
+
+
+def Not(formula):
+	res = formula.negation
+	if res is None:
+		res = __get_node("not", (formula,))
+		formula.negation, res.negation = res, formula
+	return res
+
+
+def __get_operands(args):
+	"""
+	:param args: the arguments of And or Or: either the operands themselves, or a list containing them
+	:return: the operands
+	"""
+	if (len(args) == 1) and isinstance(args[0], (list, tuple)): return args[0]
+	else: return args
+
+
+def __get_junction(op, neutral, operands):
+	if not operands: return neutral
+	elif len(operands) == 1: return operands[0]
+	else: return __get_node(op, tuple(operands))
+
+
+def And(*args):
+	operands, seen = [], set()
+	for arg in __get_operands(args):
+		for formula in (arg.args if arg.op == "and" else (arg,)):
+			if (formula is true) or (formula in seen): continue
+			if (formula is false) or (formula.negation in seen): return false
+			seen.add(formula)
+			operands.append(formula)
+	return __get_junction("and", true, operands)
+
+
+def Or(*args):
+	operands, seen = [], set()
+	for arg in __get_operands(args):
+		for formula in (arg.args if arg.op == "or" else (arg,)):
+			if (formula is false) or (formula in seen): continue
+			if (formula is true) or (formula.negation in seen): return true
+			seen.add(formula)
+			operands.append(formula)
+	return __get_junction("or", false, operands)
+
+
+def Implies(left, right):
+	if left is true: return right
+	elif (left is false) or (right is true) or (left is right): return true
+	elif right is false: return Not(left)
+	elif left.negation is right: return right
+	else: return __get_node("=>", (left, right))
+
+
+def Iff(left, right):
+	if left is right: return true
+	elif left.negation is right: return false
+	elif left is true: return right
+	elif right is true: return left
+	elif left is false: return Not(right)
+	elif right is false: return Not(left)
+	else: return __get_node("=", (left, right))
+
+
+def simplify(formula):
+	"""
+	:param formula: a formula
+	:return: the formula, which is already simplified
+	"""
+	return formula
+
+
+def is_true(formula): return formula is true
+
+
+def is_false(formula): return formula is false
+
+
+######################################################################
+# FORMULA OUTPUT
+######################################################################
+
+
+def __get_text(formula):
+	"""
+	:param formula: a formula
+	:return: the SMT-LIB expression of the formula without let, which is cached in the nodes
+	"""
+	res = formula.text
+	if res is None:
+		res = "(" + formula.op + " " + " ".join([__get_text(arg) for arg in formula.args]) + ")"
+		formula.text = res
+	return res
+
+
+def __collect_nodes(formula, variables, counts, nodes):
+	"""
+	:param formula: a formula
+	:param variables: the list of the variables of the formula, in order of first occurrence
+	:param counts: the mapping from the nodes of the formula to their number of occurrences in the formula
+	:param nodes: the list of the nodes of the formula that have operands, in postfix order
+	:return: None
+	"""
+	if formula in counts:
+		counts[formula] = counts[formula] + 1
+		return
+	counts[formula] = 1
+	if formula.args is None: variables.append(formula.op)
+	elif formula.args:
+		for arg in formula.args: __collect_nodes(arg, variables, counts, nodes)
+		nodes.append(formula)
+
+
+def __is_worth_sharing(formula, count, name):
+	"""
+	:return: True if the formula occurring count times is printed shorter when bound to name with a let
+	"""
+	length = len(__get_text(formula))
+	return count * length > length + 3 + (count + 1) * len(name)
+
+
+def __to_smtlib_expression(formula, names, levels):
+	"""
+	:param formula: a formula
+	:param names: the mapping from the shared nodes to the name they are bound to
+	:param levels: the mapping from the nodes to the maximal let level of the shared nodes they contain
+	:return: the SMT-LIB expression of the formula
+	"""
+	res = names.get(formula)
+	if res is None: res = __to_smtlib_definition(formula, names, levels)
+	return res
+
+
+def __to_smtlib_definition(formula, names, levels):
+	if (not formula.args) or (not any([levels.get(arg, 0) for arg in formula.args])): return __get_text(formula)
+	return "(" + formula.op + " " + " ".join([
+		__to_smtlib_expression(arg, names, levels) for arg in formula.args]) + ")"
+
+
+def to_smtlib(formula):
+	"""
+	:param formula: a formula
+	:return: the SMT-LIB script declaring the variables of the formula and asserting it
+	"""
+	variables, counts, nodes = [], {}, []
+	__collect_nodes(formula, variables, counts, nodes)
+	# 1. the shared nodes are bound in nested lets: a shared node is bound in the let following the ones of its subformulas
+	names, levels, bindings = {}, {}, []
+	for node in nodes:
+		level = max([levels.get(arg, 0) for arg in node.args])
+		count = counts[node]
+		if count > 1:
+			name = "l!" + str(len(names))
+			if __is_worth_sharing(node, count, name):
+				names[node] = name
+				level = level + 1
+				if level > len(bindings): bindings.append([])
+				bindings[level - 1].append(node)
+		levels[node] = level
+	# 2. printing
+	expression = __to_smtlib_expression(formula, names, levels)
+	for level_bindings in reversed(bindings):
+		expression = "(let (" + " ".join([
+			"(" + names[node] + " " + __to_smtlib_definition(node, names, levels) + ")"
+			for node in level_bindings]) + ") " + expression + ")"
+	declarations = ["(declare-fun " + variable + " () Bool)" for variable in variables]
+	declarations.append("(assert " + expression + ")")
+	return " ".join(declarations)
+
+
+def to_z3(formula, nodes=None):
+	"""
+	translates a formula into z3 (which must be installed)
+	:param formula: a formula
+	:param nodes: the mapping from the nodes already translated to their translation
+	:return: the corresponding z3 formula
+	"""
+	if nodes is None: nodes = {}
+	res = nodes.get(formula)
+	if res is None:
+		if formula.args is None: res = z3.Bool(formula.op)
+		elif formula is true: res = z3.BoolVal(True)
+		elif formula is false: res = z3.BoolVal(False)
+		else:
+			args = [to_z3(arg, nodes) for arg in formula.args]
+			if formula.op == "not": res = z3.Not(args[0])
+			elif formula.op == "and": res = z3.And(args)
+			elif formula.op == "or": res = z3.Or(args)
+			elif formula.op == "=>": res = z3.Implies(args[0], args[1])
+			else: res = args[0] == args[1]
+		nodes[formula] = res
+	return res
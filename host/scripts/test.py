@@ -1,12 +1,27 @@
 #!/usr/bin/python
 
 import os.path
+import re
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+import core_data
 
 import utils
 import hyportage
+import hyportage_db
 import hyportage_ids
 import hyportage_data
 import hyportage_pattern
+import hyportage_visibility
+import hyportage_translation
+import reconfigure
+import smt_encoding
+import smt_formula
 import utils_egencache
 
 
@@ -37,6 +52,12 @@ constraint_list_depend = [
 constraint_list_depend2 = [ ">=sys-apps/util-linux-2.27.1[abi_x86_32(-)?,abi_x86_64(-)?,abi_x86_x32(-)?,abi_mips_n32(-)?,abi_mips_n64(-)?,abi_mips_o32(-)?,abi_ppc_32(-)?,abi_ppc_64(-)?,abi_s390_32(-)?,abi_s390_64(-)?] sys-libs/libcap[abi_x86_32(-)?,abi_x86_64(-)?,abi_x86_x32(-)?,abi_mips_n32(-)?,abi_mips_n64(-)?,abi_mips_o32(-)?,abi_ppc_32(-)?,abi_ppc_64(-)?,abi_s390_32(-)?,abi_s390_64(-)?] acl? ( sys-apps/acl ) kmod? ( >=sys-apps/kmod-16 ) selinux? ( >=sys-libs/libselinux-2.1.9 ) !<sys-libs/glibc-2.11 !sys-apps/gentoo-systemd-integration !sys-apps/systemd abi_x86_32? ( !<=app-emulation/emul-linux-x86-baselibs-20130224-r7 !app-emulation/emul-linux-x86-baselibs[-abi_x86_32(-)] ) dev-util/gperf >=dev-util/intltool-0.50 >=sys-apps/coreutils-8.16 virtual/os-headers virtual/pkgconfig >=sys-devel/make-3.82-r4 >=sys-kernel/linux-headers-3.9 app-text/docbook-xml-dtd:4.2 app-text/docbook-xml-dtd:4.5 app-text/docbook-xsl-stylesheets dev-libs/libxslt !<sys-devel/gettext-0.18.1.1-r3 || ( >=sys-devel/automake-1.15:1.15 ) >=sys-devel/autoconf-2.69 >=sys-devel/libtool-2.4 virtual/pkgconfig" ]
 constraint_list_require = [ "!compute-only? ( || ( mysql postgres sqlite ) ) compute-only? ( compute !rabbitmq !memcached !mysql !postgres !sqlite ) || ( python_targets_python2_7 )" ]
 
+# versions sorted as portage's vercmp orders them (see the Package Manager Specification, section 3.3)
+version_list_ordered = [
+	"0.9", "1.0_alpha", "1.0_alpha1", "1.0_beta2", "1.0_pre1", "1.0_rc1", "1.0_rc1_p1", "1.0_rc2", "1.0", "1.0-r1",
+	"1.0-r2", "1.0_p1", "1.0_p1-r1", "1.0a", "1.0a_p1", "1.0.0", "1.001", "1.01", "1.1_rc1", "1.1_rc2", "1.1", "1.1_p1",
+	"1.2", "1.10", "2", "9999"]
+
 
 # check data loading
 
@@ -58,6 +79,661 @@ def test_parse_depend(constraint_list):
 		print(str(ast))
 
 
+def get_egencache_constraints(path_egencache_packages):
+	"""
+	collects all the REQUIRED_USE and dependency strings of the egencache files in parameter
+	:param path_egencache_packages: the path to the egencache files
+	:return: the pair of the list of the REQUIRED_USE strings and the list of the DEPEND, RDEPEND and PDEPEND strings
+	"""
+	constraints_require, constraints_depend = [], []
+	for directory, _, _, filenames in utils_egencache.scan_egencache_directories(path_egencache_packages, {}):
+		for filename in filenames:
+			with open(os.path.join(path_egencache_packages, directory, filename), 'r') as f:
+				for line in f:
+					array = line[:-1].split("=", 1)
+					if array[0] == "REQUIRED_USE": constraints_require.append(array[1])
+					elif array[0] in ("DEPEND", "RDEPEND", "PDEPEND"): constraints_depend.append(array[1])
+	return constraints_require, constraints_depend
+
+
+def test_parser_differential(path_egencache_packages=path_to_data_portage_packages):
+	"""
+	checks that the hand-written parser gives the same AST as the lrparsing reference implementation
+	on every constraint of the egencache files
+	"""
+	constraints_require, constraints_depend = get_egencache_constraints(path_egencache_packages)
+	constraints_require.extend(constraint_list_require)
+	constraints_depend.extend(constraint_list_depend + constraint_list_depend2)
+	nb_errors = 0
+	for translate, translate_reference, constraint_list in (
+			(utils_egencache.translate_require, utils_egencache.translate_require_reference, constraints_require),
+			(utils_egencache.translate_depend, utils_egencache.translate_depend_reference, constraints_depend)):
+		for constraint in constraint_list:
+			if translate(constraint) != translate_reference(constraint):
+				nb_errors = nb_errors + 1
+				print("different ASTs for \"" + constraint + "\"")
+	print(str(len(constraints_require) + len(constraints_depend)) + " constraints checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def benchmark_parser(path_egencache_packages=path_to_data_portage_packages, repeat=3):
+	"""
+	compares the time taken by the hand-written parser and by the lrparsing reference implementation
+	to translate all the constraints of the egencache files
+	"""
+	constraints_require, constraints_depend = get_egencache_constraints(path_egencache_packages)
+	for name, translate_require, translate_depend in (
+			("lrparsing", utils_egencache.translate_require_reference, utils_egencache.translate_depend_reference),
+			("hand-written", utils_egencache.translate_require, utils_egencache.translate_depend)):
+		times = []
+		for _ in range(repeat):
+			start = time.time()
+			for constraint in constraints_require: translate_require(constraint)
+			for constraint in constraints_depend: translate_depend(constraint)
+			times.append(time.time() - start)
+		print(name + " parser: " + str(min(times)) + "s for " + str(len(constraints_require) + len(constraints_depend)) + " constraints")
+
+
+def get_egencache_versions(path_egencache_packages):
+	"""
+	collects the versions of all the spls of the egencache files in parameter
+	:param path_egencache_packages: the path to the egencache files
+	:return: the mapping from the spl group names to the list of the pairs (version_full, version) of their spls
+	"""
+	res = {}
+	for directory, _, _, filenames in utils_egencache.scan_egencache_directories(path_egencache_packages, {}):
+		for filename in filenames:
+			package_group, version_full, version = core_data.parse_package_name(filename)
+			if version_full is not None:
+				res.setdefault(directory + "/" + package_group, []).append((version_full, version))
+	return res
+
+
+def test_version_index(path_egencache_packages=path_to_data_portage_packages):
+	"""
+	checks that the version ranges computed by bisection on the sorted versions of the spl groups
+	match the same versions as the linear matching, for the atoms of the egencache files
+	and for every version operator applied to every version of every spl group
+	"""
+	versions = get_egencache_versions(path_egencache_packages)
+	_, constraints_depend = get_egencache_constraints(path_egencache_packages)
+	patterns = set()
+	for constraint in constraints_depend:
+		for token in constraint.split():
+			atom = token.split("[", 1)[0].lstrip("!")
+			if (atom[:1] in "<>=~") and ("/" in atom): patterns.add(core_data.pattern_create_from_atom(atom))
+	for package_group, group_versions in versions.iteritems():
+		for version_full, _ in group_versions:
+			for vop in (">=", ">", "=", "<=", "<", "~"):
+				patterns.add(core_data.pattern_create_from_atom(vop + package_group + "-" + version_full))
+			patterns.add(core_data.pattern_create_from_atom("=" + package_group + "-" + version_full + "*"))
+	nb_checked, nb_errors = 0, 0
+	for pattern in patterns:
+		group_versions = versions.get(core_data.pattern_get_package_group(pattern))
+		if group_versions is None: continue
+		group_versions = sorted(group_versions, key=lambda v: core_data.version_key(v[0]))
+		version_range = core_data.pattern_get_version_range(pattern, [core_data.version_key(v[0]) for v in group_versions])
+		if version_range is None: continue
+		matched = group_versions[version_range[0]:version_range[1]]
+		expected = [v for v in group_versions if core_data.match_only_package_version(pattern, v[0], v[1])]
+		nb_checked = nb_checked + 1
+		if matched != expected:
+			nb_errors = nb_errors + 1
+			print("different versions matched by \"" + core_data.pattern_to_atom(pattern) + "\"")
+	# the versions matched by the patterns on the versions of version_list_ordered follow the order of that list
+	group_versions = [core_data.parse_package_name("p0-" + version)[1:] for version in version_list_ordered]
+	group_versions = sorted(group_versions, key=lambda v: core_data.version_key(v[0]))
+	version_keys = [core_data.version_key(v[0]) for v in group_versions]
+	for i, version in enumerate(version_list_ordered):
+		for vop, expected in (
+				(">=", version_list_ordered[i:]), (">", version_list_ordered[i + 1:]), ("=", [version]),
+				("<=", version_list_ordered[:i + 1]), ("<", version_list_ordered[:i])):
+			pattern = core_data.pattern_create_from_atom(vop + "sys-devel/p0-" + version)
+			version_range = core_data.pattern_get_version_range(pattern, version_keys)
+			nb_checked = nb_checked + 1
+			if [v[0] for v in group_versions[version_range[0]:version_range[1]]] != expected:
+				nb_errors = nb_errors + 1
+				print("wrong versions matched by \"" + core_data.pattern_to_atom(pattern) + "\"")
+	print(str(nb_checked) + " patterns checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def get_version_pairs(versions):
+	"""
+	:param versions: the mapping from the spl group names to the versions of their spls (see get_egencache_versions)
+	:return: the list of all the pairs of versions of the same spl group
+	"""
+	return [(v1[0], v2[0]) for group_versions in versions.itervalues() for v1 in group_versions for v2 in group_versions]
+
+
+def test_version_key(path_egencache_packages=path_to_data_portage_packages):
+	"""
+	checks that comparing the keys of the versions follows the order of version_list_ordered,
+	and gives the same result as portage's vercmp on every pair of versions of every spl group of the egencache files,
+	if portage is installed
+	"""
+	sign = lambda x: (x > 0) - (x < 0)
+	nb_checked, nb_errors = 0, 0
+	for i1, v1 in enumerate(version_list_ordered):
+		for i2, v2 in enumerate(version_list_ordered):
+			nb_checked = nb_checked + 1
+			if sign(cmp(core_data.version_key(v1), core_data.version_key(v2))) != sign(i1 - i2):
+				nb_errors = nb_errors + 1
+				print("wrong comparison of \"" + v1 + "\" and \"" + v2 + "\"")
+	for v1, v2 in (("1.0", "1.0-r0"), ("1.0_p", "1.0_p0"), ("1.0.0", "1.0.00")):
+		nb_checked = nb_checked + 1
+		if core_data.version_key(v1) != core_data.version_key(v2):
+			nb_errors = nb_errors + 1
+			print("different keys for \"" + v1 + "\" and \"" + v2 + "\"")
+	try: from portage.versions import vercmp
+	except ImportError: vercmp = None
+	if vercmp is not None:
+		for v1, v2 in get_version_pairs(get_egencache_versions(path_egencache_packages)):
+			nb_checked = nb_checked + 1
+			if sign(cmp(core_data.version_key(v1), core_data.version_key(v2))) != sign(vercmp(v1, v2)):
+				nb_errors = nb_errors + 1
+				print("different comparison of \"" + v1 + "\" and \"" + v2 + "\" with vercmp")
+	print(str(nb_checked) + " pairs of versions checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def benchmark_version_comparison(path_egencache_packages=path_to_data_portage_packages, repeat=3):
+	"""
+	compares the time taken by portage's vercmp (which must be installed) and by the version keys
+	to compare all the pairs of versions of the same spl group in the egencache files
+	"""
+	from portage.versions import vercmp
+	pairs = get_version_pairs(get_egencache_versions(path_egencache_packages))
+	for name, compare in (("vercmp", vercmp), ("version keys", core_data.compare_version)):
+		times = []
+		for _ in range(repeat):
+			start = time.time()
+			for v1, v2 in pairs: compare(v1, v2)
+			times.append(time.time() - start)
+		print(name + ": " + str(min(times)) + "s for " + str(len(pairs)) + " comparisons")
+
+
+def test_visibility_engine(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	checks that the visibility engine computes the same visibility as the set based functions of the configuration
+	for all the spls of a hyportage database
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	mspl_config = hyportage_db.mspl_config
+	hyportage_visibility.compute_visibility(map, hyportage_db.spl_groups.itervalues())
+	nb_errors = 0
+	for spl in hyportage_db.mspl.itervalues():
+		unmasked = mspl_config.get_unmasked(spl.core)
+		expected = (unmasked,) + mspl_config.get_stability_status(spl.core, unmasked, spl.keyword_set, spl.license)
+		if expected != (spl.unmasked, spl.unmasked_keyword, spl.unmasked_license, spl.installable, spl.is_stable):
+			nb_errors = nb_errors + 1
+			print("different visibility for " + spl.name)
+	print(str(len(hyportage_db.mspl)) + " spls checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def test_visibility_update(path_configuration, path_new_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	checks that updating the visibility of the spls matched by the patterns that changed between two configurations
+	gives the same visibility as the set based functions of the new configuration, for all the spls of a hyportage database.
+	The new configuration must have been compared with the old one (see MSPLConfig.set_old_config)
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	hyportage_visibility.compute_visibility(map, hyportage_db.spl_groups.itervalues())
+	hyportage_db.config_db_loaded = False
+	hyportage_db.load_config(path_new_configuration, "pickle")
+	mspl_config = hyportage_db.mspl_config
+	hyportage_translation.update_visibility(
+		map, hyportage_db.pattern_repository, hyportage_db.spl_groups, [],
+		mspl_config.new_masks, mspl_config.new_keywords_config, False, mspl_config.changed_visibility_patterns)
+	nb_errors = 0
+	for spl in hyportage_db.mspl.itervalues():
+		unmasked = mspl_config.get_unmasked(spl.core)
+		expected = (unmasked,) + mspl_config.get_stability_status(spl.core, unmasked, spl.keyword_set, spl.license)
+		if expected != (spl.unmasked, spl.unmasked_keyword, spl.unmasked_license, spl.installable, spl.is_stable):
+			nb_errors = nb_errors + 1
+			print("different visibility for " + spl.name)
+	print(str(len(hyportage_db.mspl)) + " spls checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def benchmark_use_config_update(path_configuration, path_db_hyportage, use_flag, save_modality="pickle", repeat=3):
+	"""
+	compares the time taken to update a hyportage database after a use flag is added to the USE variable of make.conf
+	and to the implicit use flag declarations (like the use.force and use.mask files of the profiles do),
+	when all the spls are updated and when only the spls impacted by the changed use flag are updated
+	"""
+	for name, is_diff_driven in (("full", False), ("diff-driven", True)):
+		times = []
+		for _ in range(repeat):
+			old_config = utils.load_data_file(path_configuration)
+			hyportage_db.config_db_loaded, hyportage_db.hyportage_db_loaded = False, False
+			hyportage_db.load_config(path_configuration, "pickle")
+			hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+			mspl_config = hyportage_db.mspl_config
+			mspl_config.use_selection_config_init.use.add(use_flag)
+			mspl_config.use_declaration_eapi4.add(use_flag)
+			mspl_config.use_declaration_eapi5.add(use_flag)
+			mspl_config.set_old_config(old_config.mspl_config)
+			if not is_diff_driven:
+				mspl_config.changed_use_declaration_eapi4, mspl_config.changed_use_declaration_eapi5 = None, None
+				mspl_config.changed_use_flags, mspl_config.changed_use_patterns = None, None
+
+			start = time.time()
+			spl_implicit_updated_list = hyportage_translation.reset_implicit_features(
+				hyportage_db.mspl, mspl_config.new_use_declaration_eapi4, mspl_config.new_use_declaration_eapi5,
+				mspl_config.changed_use_declaration_eapi4, mspl_config.changed_use_declaration_eapi5)
+			use_ids_added = hyportage_translation.update_id_repository(
+				hyportage_db.id_repository, spl_implicit_updated_list, [])
+			hyportage_translation.update_use_flag_selection(
+				hyportage_db.mspl, hyportage_db.pattern_repository, mspl_config.new_use_flag_config,
+				mspl_config.changed_use_flags, mspl_config.changed_use_patterns)
+			if is_diff_driven:
+				spl_set, spl_group_set = hyportage_translation.get_smt_dependents(
+					hyportage_db.pattern_repository, hyportage_db.mspl, hyportage_db.spl_groups, set(), [], [], use_ids_added)
+			else: spl_set, spl_group_set = set(hyportage_db.mspl.itervalues()), set(hyportage_db.spl_groups.itervalues())
+			hyportage_translation.update_smt_constraints(
+				map, hyportage_db.pattern_repository, hyportage_db.id_repository, spl_set, spl_group_set,
+				hyportage_db.simplify_mode)
+			times.append(time.time() - start)
+		print(name + ": " + str(min(times)) + "s, " + str(len(spl_set)) + " spl constraints recomputed")
+
+
+def test_required_uses(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	checks that the incrementally maintained required uses of the patterns and required external features of the spls
+	of a hyportage database are the unions they stand for
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	nb_errors = 0
+	required_iuses_external = {spl: set() for spl in hyportage_db.mspl.itervalues()}
+	for pattern, pel in hyportage_db.pattern_repository.iteritems():
+		if pel.required_uses != {use for uses in pel.containing_spl.itervalues() for use in uses}:
+			nb_errors = nb_errors + 1
+			print("wrong required uses for " + str(pattern))
+		for spl in required_iuses_external:
+			uses = spl.get_revert_dependency(pattern)
+			if uses is not None: required_iuses_external[spl].update(uses)
+	for spl, uses in required_iuses_external.iteritems():
+		if spl.required_iuses_external != uses:
+			nb_errors = nb_errors + 1
+			print("wrong required external features for " + spl.name)
+	print(str(len(hyportage_db.pattern_repository)) + " patterns and " + str(len(required_iuses_external)) + " spls checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def get_set_manipulation_patterns(mspl_config):
+	"""
+	:param mspl_config: the mspl configuration
+	:return: the list of the names of the pattern-guarded set manipulations of the configuration, with their value
+	"""
+	res = [("pattern_keywords", mspl_config.pattern_keywords), ("pattern_accept_keywords", mspl_config.pattern_accept_keywords)]
+	for prefix, use_selection_config in (
+			("", mspl_config.use_selection_config), ("init.", mspl_config.use_selection_config_init)):
+		if use_selection_config is not None:
+			res.extend([
+				(prefix + name, getattr(use_selection_config, name)) for name in (
+					"pattern_use", "pattern_use_force", "pattern_use_mask", "pattern_use_stable_force",
+					"pattern_use_stable_mask")])
+	return res
+
+
+def test_set_manipulation_index(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	checks that applying the pattern-guarded set manipulations of the configuration with their package group index
+	gives the same result as applying all of them in order, for all the spls of a hyportage database
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	nb_checks, nb_errors = 0, 0
+	for name, set_manipulation_pattern in get_set_manipulation_patterns(hyportage_db.mspl_config):
+		elements = {
+			element.lstrip("-") for _, set_manipulation in set_manipulation_pattern.list
+			for element in set_manipulation.get_elements()}
+		for spl in hyportage_db.mspl.itervalues():
+			res, reference = set(elements), set(elements)
+			set_manipulation_pattern.apply(spl.core, res)
+			for pattern, set_manipulation in set_manipulation_pattern.list:
+				if core_data.match_spl_full(pattern, spl.core): set_manipulation.apply(reference)
+			nb_checks = nb_checks + 1
+			if res != reference:
+				nb_errors = nb_errors + 1
+				print("wrong " + name + " for " + spl.name + ": " + str(sorted(res)) + " instead of " + str(sorted(reference)))
+	print(str(nb_checks) + " applications checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def test_pattern_use_mask(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	prints the use flags masked by package.use.mask for the spls of a hyportage database
+	(i.e., the difference with the masks computed without package.use.mask),
+	and checks that the masks computed by get_use_force_mask are the ones of use.mask, package.use.mask
+	and (for stable spls) of their stable variants
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	use_selection_config = hyportage_db.mspl_config.use_selection_config
+	nb_checks, nb_changes, nb_errors = 0, 0, 0
+	for spl in hyportage_db.mspl.itervalues():
+		for is_stable in (False, True):
+			_, mask = use_selection_config.get_use_force_mask(spl.core, is_stable)
+			without_pattern_mask = use_selection_config.use_mask.init()
+			reference = use_selection_config.use_mask.init()
+			for pattern, set_manipulation in use_selection_config.pattern_use_mask.list:
+				if core_data.match_spl_full(pattern, spl.core): set_manipulation.apply(reference)
+			if is_stable:
+				stable_mask = use_selection_config.use_stable_mask.init()
+				use_selection_config.pattern_use_stable_mask.apply(spl.core, stable_mask)
+				without_pattern_mask.update(stable_mask)
+				reference.update(stable_mask)
+			nb_checks = nb_checks + 1
+			if mask != reference:
+				nb_errors = nb_errors + 1
+				print("wrong mask for " + spl.name + ": " + str(sorted(mask)) + " instead of " + str(sorted(reference)))
+			if mask != without_pattern_mask:
+				nb_changes = nb_changes + 1
+				print(
+					"mask of " + spl.name + (" (stable)" if is_stable else "") + ": "
+					+ str(sorted(mask - without_pattern_mask)) + " masked, "
+					+ str(sorted(without_pattern_mask - mask)) + " unmasked by package.use.mask")
+	print(
+		str(nb_checks) + " masks checked, " + str(nb_changes) + " changed by package.use.mask, "
+		+ str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def test_matched_spls_cache(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	checks that the matched spls cached in the pattern elements of a hyportage database are the ones they match
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	nb_checked, nb_errors = 0, 0
+	for pattern, pel in hyportage_db.pattern_repository.iteritems():
+		if pel.matched_spl_names is None: continue
+		nb_checked = nb_checked + 1
+		cached = pel.matched_spls
+		hyportage_pattern.matched_spls_cache.remove(pel)
+		if cached != pel.matched_spls:
+			nb_errors = nb_errors + 1
+			print("wrong matched spls for " + str(pattern))
+	print(str(nb_checked) + " cached patterns checked, " + str(nb_errors) + " errors")
+	print(hyportage_pattern.get_matched_spls_cache_statistics())
+	return nb_errors == 0
+
+
+def benchmark_matched_spls_cache(path_configuration, path_db_hyportage, save_modality="pickle", budgets=(0, 4096, None)):
+	"""
+	computes the transitive closure of the dependencies of all the spls of a hyportage database
+	with different memory budgets for the matched spls cache (None being the default budget)
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	default_budget = hyportage_pattern.matched_spls_cache.budget
+	for budget in budgets:
+		for pel in hyportage_db.pattern_repository.itervalues(): hyportage_pattern.matched_spls_cache.remove(pel)
+		hyportage_pattern.set_matched_spls_cache_budget(default_budget if budget is None else budget)
+		hyportage_pattern.matched_spls_cache.reset_statistics()
+		start = time.time()
+		reconfigure.get_dependency_transitive_closure(
+			hyportage_db.pattern_repository, hyportage_db.mspl, hyportage_db.mspl.values())
+		statistics = hyportage_pattern.get_matched_spls_cache_statistics()
+		print(
+			"budget " + str(default_budget if budget is None else budget) + ": " + str(time.time() - start) + "s, hit rate "
+			+ str(round(statistics["hit_rate"], 3)) + ", " + str(statistics["evictions"]) + " evictions")
+	hyportage_pattern.set_matched_spls_cache_budget(default_budget)
+
+
+def change_egencache_file(path_file, new_path_file, new_slot=None):
+	"""
+	rewrites an egencache file, possibly with a new slot, updating its digest so the change is detected
+	:param path_file: the path of the egencache file
+	:param new_path_file: the new path of the file (to change the version of the spl)
+	:param new_slot: the new slot of the spl, None to keep it
+	:return: None
+	"""
+	with open(path_file, 'r') as f:
+		lines = [line for line in f.read().splitlines() if not line.startswith("_md5_=")]
+	if new_slot is not None: lines = [("SLOT=" + new_slot) if line.startswith("SLOT=") else line for line in lines]
+	content = "\n".join(lines) + "\n"
+	os.remove(path_file)
+	with open(new_path_file, 'w') as f:
+		f.write(content + "_md5_=" + hashlib.md5(content).hexdigest() + "\n")
+
+
+def get_named_smt_constraints(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	loads a hyportage database and returns its constraints, where the ids are replaced by names
+	that only depend on the spls and use flags they identify, so constraints of different databases can be compared
+	:return: the mapping from the names of the spls and spl groups of the database to their constraints
+	"""
+	hyportage_db.config_db_loaded, hyportage_db.hyportage_db_loaded = False, False
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	ids = hyportage_db.id_repository.ids
+
+	def get_name(match):
+		data = ids.get(match.group(0))
+		if data is None: return match.group(0) + "_missing"
+		return "n" + hashlib.md5(repr(data)).hexdigest()[:16]
+
+	def rename(constraints): return [re.sub(r"(?<=\ba)p[0-9]+|\b[pu][0-9]+\b", get_name, c) for c in constraints]
+
+	res = {spl.name: rename(spl.smt) for spl in hyportage_db.mspl.itervalues()}
+	res.update([(spl_group.name, rename(spl_group.smt)) for spl_group in hyportage_db.spl_groups.itervalues()])
+	return res
+
+
+def test_incremental_spl_update(path_portage, save_modality="pickle", change_period=5):
+	"""
+	checks that updating a hyportage database after existing spls changed their slot or their version gives
+	the same constraints as translating the changed portage tree from scratch (z3 must be installed).
+	The portage directory (containing the config.pickle file and the packages directory) is changed in a copy
+	:param path_portage: the portage directory
+	:param save_modality: the modality used to save the hyportage databases
+	:param change_period: one egencache file out of change_period is changed
+	"""
+	import z3
+	path_tmp = tempfile.mkdtemp()
+	try:
+		path_copy = os.path.join(path_tmp, "portage")
+		shutil.copytree(path_portage, path_copy)
+
+		def translate(dir_hyportage):
+			subprocess.check_call([
+				sys.executable, os.path.join(os.path.dirname(os.path.realpath(__file__)), "hyportage.py"),
+				path_copy, os.path.join(path_tmp, dir_hyportage), os.path.join(path_tmp, "install"),
+				"--mode=update", "--save-modality=" + save_modality])
+
+		translate("incremental")
+		# change the slot of half of the changed files, and the revision of the other half
+		path_files = sorted([
+			os.path.join(directory, filename)
+			for directory, _, filenames in os.walk(os.path.join(path_copy, "packages")) for filename in filenames])
+		for i, path_file in enumerate(path_files[::change_period]):
+			if i % 2 == 0:
+				with open(path_file, 'r') as f:
+					slot = [line[5:] for line in f.read().splitlines() if line.startswith("SLOT=")]
+				if slot: change_egencache_file(path_file, path_file, slot[0].split("/")[0] + "9")
+			else:
+				revision = re.search(r"-r([0-9]+)$", path_file)
+				if revision: new_path_file = path_file[:revision.start()] + "-r" + str(int(revision.group(1)) + 10)
+				else: new_path_file = path_file + "-r10"
+				if not os.path.exists(new_path_file): change_egencache_file(path_file, new_path_file)
+		translate("incremental")
+		translate("fresh")
+
+		path_configuration = os.path.join(path_copy, "config.pickle")
+		constraints = get_named_smt_constraints(
+			path_configuration, os.path.join(path_tmp, "incremental", "hyportage.pickle"), save_modality)
+		references = get_named_smt_constraints(
+			path_configuration, os.path.join(path_tmp, "fresh", "hyportage.pickle"), save_modality)
+	finally: shutil.rmtree(path_tmp)
+	nb_errors = 0
+	if set(constraints) != set(references):
+		nb_errors = nb_errors + 1
+		print("different spls and spl groups")
+	for name in set(constraints) & set(references):
+		formula = z3.And([f for constraint in constraints[name] for f in z3.parse_smt2_string(constraint)])
+		reference = z3.And([f for constraint in references[name] for f in z3.parse_smt2_string(constraint)])
+		solver = z3.Solver()
+		solver.add(z3.Xor(formula, reference))
+		if solver.check() != z3.unsat:
+			nb_errors = nb_errors + 1
+			print("different constraints for " + name)
+	print(str(len(references)) + " constraints checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def get_smt_constraints(backend):
+	"""
+	:param backend: the backend used to build the constraints (see smt_encoding.set_smt_backend)
+	:return: the list of the names of the spls and spl groups of the loaded hyportage database, with their constraints
+	"""
+	smt_encoding.set_smt_backend(backend)
+	res = [
+		(spl.name, smt_encoding.convert_spl(
+			hyportage_db.pattern_repository, hyportage_db.id_repository, hyportage_db.mspl, hyportage_db.spl_groups,
+			spl, hyportage_db.simplify_mode)[0])
+		for spl in hyportage_db.mspl.itervalues()]
+	res.extend([
+		(spl_group.name, smt_encoding.convert_spl_group(hyportage_db.id_repository, spl_group, hyportage_db.simplify_mode))
+		for spl_group in hyportage_db.spl_groups.itervalues()])
+	smt_encoding.set_smt_backend("formula")
+	return res
+
+
+def test_smt_formula_differential(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	checks that the constraints built with smt_formula are equivalent to the ones built with z3,
+	for all the spls and spl groups of a hyportage database (z3 must be installed)
+	"""
+	import z3
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	formulas = get_smt_constraints("formula")
+	references = get_smt_constraints("z3")
+	nb_errors = 0
+	for (name, formula), (_, reference) in zip(formulas, references):
+		formula = z3.And([f for constraint in formula for f in z3.parse_smt2_string(constraint)])
+		reference = z3.And([f for constraint in reference for f in z3.parse_smt2_string(constraint)])
+		solver = z3.Solver()
+		solver.add(z3.Xor(formula, reference))
+		if solver.check() != z3.unsat:
+			nb_errors = nb_errors + 1
+			print("different constraints for " + name)
+	print(str(len(formulas)) + " constraints checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def test_smt_fragment_reset(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	checks that the fragments of the patterns cached before a reset of smt_formula are not reused after it:
+	the constraints built after the reset must be the ones built before it, and each of them must declare its variables once
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	references = get_smt_constraints("formula")
+	smt_formula.reset()
+	constraints = get_smt_constraints("formula")
+	nb_errors = 0
+	for (name, constraint), (_, reference) in zip(constraints, references):
+		declarations = [re.findall(r"\(declare-fun [^ ]+ ", text) for text in constraint]
+		if (constraint != reference) or any([len(names) != len(set(names)) for names in declarations]):
+			nb_errors = nb_errors + 1
+			print("wrong constraints after a reset for " + name)
+	print(str(len(constraints)) + " constraints checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def benchmark_smt_formula(path_configuration, path_db_hyportage, save_modality="pickle", repeat=3):
+	"""
+	compares the time taken to build the constraints of all the spls and spl groups of a hyportage database
+	with z3 and with smt_formula
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	for backend in ("z3", "formula"):
+		times = []
+		for _ in range(repeat):
+			start = time.time()
+			get_smt_constraints(backend)
+			times.append(time.time() - start)
+		print(backend + ": " + str(min(times)) + "s")
+
+
+def benchmark_smt_printer(path_configuration, path_db_hyportage, save_modality="pickle"):
+	"""
+	compares the time taken to print the constraints of all the spls of a hyportage database
+	with z3 and with smt_formula, and the size of the printed constraints (z3 must be installed)
+	"""
+	hyportage_db.load_config(path_configuration, "pickle")
+	hyportage_db.load_hyportage(path_db_hyportage, save_modality)
+	formulas = []
+	for spl in hyportage_db.mspl.itervalues():
+		visitor = smt_encoding.ASTtoSMTVisitor(
+			hyportage_db.pattern_repository, hyportage_db.id_repository, hyportage_db.mspl, hyportage_db.spl_groups, spl.name)
+		formulas.append(smt_formula.And(visitor.visitRequired(spl.fm_local) + visitor.visitDepend(spl.fm_combined)))
+	z3_formulas = [smt_formula.to_z3(formula) for formula in formulas]
+	smt_encoding.set_smt_backend("z3")
+	z3_to_string = smt_encoding.smt_to_string
+	smt_encoding.set_smt_backend("formula")
+	for name, to_string, constraints in (("z3", z3_to_string, z3_formulas), ("formula", smt_formula.to_smtlib, formulas)):
+		start = time.time()
+		texts = map(to_string, constraints)
+		print(name + ": " + str(time.time() - start) + "s, " + str(sum(map(len, texts))) + " characters")
+
+
+def test_amo_encodings(max_size=12):
+	"""
+	checks that the at most one constraints encoded with a sequential counter (with their auxiliary variables
+	existentially quantified) are equivalent to the pairwise ones, for up to max_size expressions (z3 must be installed)
+	"""
+	import z3
+	nb_errors = 0
+	for size in range(2, max_size + 1):
+		fs = [smt_formula.Bool("p" + str(i)) for i in range(size)]
+		pairwise = smt_formula.to_z3(smt_encoding.get_no_two_true_expressions_bool(fs))
+		sequential = smt_formula.to_z3(smt_encoding.get_no_two_true_expressions_sequential(fs, "a_"))
+		solver = z3.Solver()
+		solver.add(pairwise != z3.Exists([z3.Bool("a_" + str(i)) for i in range(size - 1)], sequential))
+		if solver.check() != z3.unsat:
+			nb_errors = nb_errors + 1
+			print("wrong sequential encoding for " + str(size) + " expressions")
+	print(str(max_size - 1) + " sizes checked, " + str(nb_errors) + " errors")
+	return nb_errors == 0
+
+
+def benchmark_amo_encodings(sizes=(10, 50, 100, 200, 400)):
+	"""
+	compares the size of the at most one constraints encoded pairwise and with a sequential counter,
+	and the time taken by z3 to enumerate the solutions of one at most one constraint per size (z3 must be installed).
+	The sizes are those of large slot conflicts (like the ones of kernel sources) or of large choices
+	"""
+	import z3
+	for size in sizes:
+		fs = [smt_formula.Bool("p" + str(i)) for i in range(size)]
+		for name, constraint in (
+				("pairwise", smt_encoding.get_no_two_true_expressions_bool(fs)),
+				("sequential", smt_encoding.get_no_two_true_expressions_sequential(fs, "a_"))):
+			text = smt_formula.to_smtlib(constraint)
+			start = time.time()
+			solver = z3.Solver()
+			solver.add(z3.parse_smt2_string(text))
+			variables = [z3.Bool("p" + str(i)) for i in range(size)]
+			nb_solutions = 0
+			while solver.check() == z3.sat:
+				model = solver.model()
+				nb_solutions = nb_solutions + 1
+				solver.add(z3.Or([v != model.eval(v, model_completion=True) for v in variables]))
+			print(
+				name + " " + str(size) + ": " + str(len(constraint.args)) + " clauses, " + str(len(text)) + " characters, "
+				+ str(nb_solutions) + " solutions in " + str(time.time() - start) + "s")
+
+
 def test_load_packages(concurrent_map, paths):
 	print("Translated MSPL:")
 	raw_mspl = concurrent_map(utils_egencache.create_spl_from_egencache_file, paths)
@@ -209,11 +885,11 @@ def get_pattern_element(atom):
 def quick_get(atom):
 	load_hyportage_db()
 	el = get_pattern_element(atom)
-	return [spl.name for spl in el.containing_spl]
+	return list(el.containing_spl)
 
 def local_mapping_to_mapping(local_mapping):
 	return {
-		hyportage_pattern.pattern_to_atom(pattern): [ spl.name for spl in el.containing_spl ]
+		hyportage_pattern.pattern_to_atom(pattern): list(el.containing_spl)
 		for pattern, el in local_mapping.iteritems()
 	}
 
@@ -14,6 +14,14 @@ import json
 import marshal
 import gzip
 import cPickle
+import struct
+import zlib
+import bz2
+
+try: import lzma
+except ImportError:
+	try: from backports import lzma  # backport for python 2.7
+	except ImportError: lzma = None
 
 
 """
@@ -61,13 +69,80 @@ def clean_temp_files():
 
 ##
 
+"""
+The pickle files are binary: they start with a header composed of the data_file_magic string,
+the version of the file format, the compression used for the rest of the file,
+and the version of the data stored in the file (given by the caller).
+The rest of the file is the data pickled with the highest protocol, possibly compressed.
+The files without this header are legacy files, pickled by a previous version of hyportage or by the guest,
+and are considered to store data with version 0.
+"""
+
+data_file_magic = "HYPORTAGE"
+data_file_format_version = 1
+__data_file_header = struct.Struct("!BBH")  # format version, compression, data version
+
+data_file_compressions = ["none", "zlib", "bz2"] + (["lzma"] if lzma else [])
+data_file_compression = "none"  # the compression used when storing pickle files
+
+__compress_functions = {
+	"none": (lambda data: data, lambda data: data),
+	"zlib": (zlib.compress, zlib.decompress),
+	"bz2": (bz2.compress, bz2.decompress),
+}
+if lzma: __compress_functions["lzma"] = lzma.compress, lzma.decompress
+
+
+def __load_data_file_header(f, file_name):
+	"""
+	reads the header of a pickle file
+	:param f: the opened file, which is left positioned after the header (or at its start for legacy files)
+	:param file_name: the name of the file
+	:return: the pair of the compression and the version of the data stored in the file,
+		or None if the file is in an unsupported format
+	"""
+	if f.read(len(data_file_magic)) != data_file_magic:
+		f.seek(0)
+		return "none", 0
+	format_version, compression, version = __data_file_header.unpack(f.read(__data_file_header.size))
+	if format_version > data_file_format_version:
+		logging.error(
+			"Cannot load data from file \"" + file_name + "\", because its format version ("
+			+ str(format_version) + ") is more recent than the supported one (" + str(data_file_format_version) + ")")
+		return None
+	if compression >= len(data_file_compressions):
+		logging.error(
+			"Cannot load data from file \"" + file_name + "\", because its compression is not supported")
+		return None
+	return data_file_compressions[compression], version
+
+
+def get_data_file_version(file_name, save_modality="pickle"):
+	"""
+	returns the version of the data stored in the file, without loading it
+	:param file_name: the name of the file
+	:param save_modality: the modality used to store the file
+	:return: the version given when the file was stored (0 for legacy and non pickle files),
+		or None if the file does not exist or cannot be loaded
+	"""
+	if not os.path.exists(file_name): return None
+	if save_modality != "pickle": return 0
+	with open(file_name, "rb") as f:
+		header = __load_data_file_header(f, file_name)
+	if header is None: return None
+	return header[1]
+
+
 def load_data_file(file_name, save_modality="pickle"):
 	if save_modality == "marshal":
-		with open(file_name, "r") as f:
+		with open(file_name, "rb") as f:
 			data = marshal.load(f)
-	if save_modality == "pickle":
-		with open(file_name, "r") as f:
-			data = cPickle.load(f)
+	elif save_modality == "pickle":
+		with open(file_name, "rb") as f:
+			header = __load_data_file_header(f, file_name)
+			if header is None: data = None
+			elif header[0] == "none": data = cPickle.load(f)
+			else: data = cPickle.loads(__compress_functions[header[0]][1](f.read()))
 	elif save_modality == "gzjson":
 		with gzip.open(file_name, "r") as f:
 			data = json.load(f)
@@ -82,29 +157,47 @@ def load_data_file(file_name, save_modality="pickle"):
 	return data
 
 
-def store_data_file(file_name, data, save_modality="pickle"):
-	# 1. create file if does not exist
+def store_data_file(file_name, data, save_modality="pickle", version=0):
+	"""
+	stores the data in a file.
+	The data is first written in a temporary file that then replaces the file,
+	so the file is never left partially written
+	:param file_name: the name of the file
+	:param data: the data to store
+	:param save_modality: the modality used to store the data
+	:param version: the version of the data, stored in the header of pickle files (see get_data_file_version)
+	:return: None
+	"""
+	# 1. create the directory if does not exist
 	basedir = os.path.dirname(file_name)
 	if not os.path.exists(basedir): os.makedirs(basedir)
-	with open(file_name, 'a'):
-		pass
 	# 2. write the data
-	if save_modality == "marshal": # marshal can not use gzip file directly (possible work around marshal.dumps)
-		with open(file_name, 'w') as f:
-			marshal.dump(data,f)
-	if save_modality == "pickle": # marshal can not use gzip file directly (possible work around marshal.dumps)
-		with open(file_name, 'w') as f:
-			cPickle.dump(data,f)
+	tmp_file_name = file_name + ".tmp"
+	if save_modality == "marshal":  # marshal can not use gzip file directly (possible work around marshal.dumps)
+		with open(tmp_file_name, "wb") as f:
+			marshal.dump(data, f)
+	elif save_modality == "pickle":
+		content = __compress_functions[data_file_compression][0](cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL))
+		with open(tmp_file_name, "wb") as f:
+			f.write(data_file_magic)
+			f.write(__data_file_header.pack(
+				data_file_format_version, data_file_compressions.index(data_file_compression), version))
+			f.write(content)
 	elif save_modality == "gzjson":
-		with gzip.GzipFile(file_name, 'wb') as f:
-			json.dump(data,f)
+		with gzip.GzipFile(tmp_file_name, "wb") as f:
+			json.dump(data, f)
 	elif save_modality == "json":
-		with open(file_name, 'w') as f:
-			json.dump(data,f)
+		with open(tmp_file_name, "w") as f:
+			json.dump(data, f)
 	else:
 		logging.error(
 			"Cannot save data on file \"" + file_name + "\", because the format \""
 			+ save_modality + "\" is unknown")
+		return
+	# 3. replace the file, once the data is on the disk
+	with open(tmp_file_name, "rb") as f:
+		os.fsync(f.fileno())
+	os.rename(tmp_file_name, file_name)
 
 
 ######################################################################
@@ -112,11 +205,15 @@ def store_data_file(file_name, data, save_modality="pickle"):
 ######################################################################
 
 def compact_list(l):
-	l = sorted(l)
-	res = [] if len(l) == 0 else [l[0]]
-	for v1, v2 in zip(l, l[1:]):
-		if v1 != v2:
-			res.append(v2)
+	"""
+	removes the duplicates of a list of hashable elements, keeping the order of their first occurrence
+	"""
+	seen = set()
+	res = []
+	for v in l:
+		if v not in seen:
+			seen.add(v)
+			res.append(v)
 	return res
 
 ######################################################################
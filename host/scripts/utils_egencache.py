@@ -3,9 +3,19 @@
 
 import string
 import os
+import re
+import hashlib
+import time
+import logging
 import lrparsing
 
+try: from os import scandir
+except ImportError:
+	try: from scandir import scandir  # backport for python 2.7
+	except ImportError: scandir = None
+
 import hyportage_data
+import hyportage_constraint_ast
 import core_data
 import utils
 
@@ -30,16 +40,74 @@ __status__ = "Prototype"
 ######################################################################
 
 
-def get_egencache_files(path):
+def __scandir(path):
+	"""
+	lists the content of a directory
+	:param path: the path of the directory
+	:return: the pair of the list of the names of its sub-directories (following symbolic links) and the list of
+		the names of its other entries
+	"""
+	subdirectories, filenames = [], []
+	if scandir is None:
+		for name in os.listdir(path):
+			if os.path.isdir(os.path.join(path, name)): subdirectories.append(name)
+			else: filenames.append(name)
+	else:  # the type of the entries is given by the directory listing itself, we only stat the symbolic links
+		for entry in scandir(path):
+			if entry.is_dir(): subdirectories.append(entry.name)
+			else: filenames.append(entry.name)
+	return subdirectories, filenames
+
+
+def scan_egencache_directories(path, manifest):
+	"""
+	scans the egencache directory tree in one pass, listing only the directories whose mtime changed since the last scan.
+	Since egencache (like any tool using atomic writes) replaces the files it regenerates,
+	any change in the files of a directory modifies the mtime of that directory.
+	:param path: the path of the egencache directory
+	:param manifest: the mapping from the directories of the previous scan (relative to path)
+		to a tuple starting with the mtime of the directory and the names of its sub-directories
+	:return: the list of the scanned directories, given as tuples (path relative to path, mtime, names of the sub-directories,
+		names of the files) where the names of the files is None when the directory did not change.
+		The mtime is None when the directory changed during the scan, so it is listed again at the next scan
+	"""
+	res = []
+	mtime_limit = time.time() - 1  # mtimes more recent than this can be changed again without us noticing it
+	to_scan = [""]
+	while to_scan:
+		directory = to_scan.pop()
+		path_directory = os.path.join(path, directory)
+		mtime = os.stat(path_directory).st_mtime
+		previous = manifest.get(directory)
+		if (previous is not None) and (previous[0] == mtime):
+			subdirectories, filenames = previous[1], None
+		else:
+			subdirectories, filenames = __scandir(path_directory)
+			if mtime >= mtime_limit: mtime = None
+		res.append((directory, mtime, subdirectories, filenames))
+		to_scan.extend([os.path.join(directory, subdirectory) for subdirectory in subdirectories])
+	return res
+
+
+def get_egencache_digest(path_file):
 	"""
-	returns the set of portage files to load
+	returns the digest identifying the content of an egencache file.
+	When available, it is the pair of the _md5_ and _eclasses_ entries of the file
+	(i.e., the digest of the ebuild and of the eclasses it inherits, as computed by egencache).
+	Otherwise (e.g., for the files generated for the deprecated packages), it is the md5 of the full file
+	:param path_file: the path of the egencache file
+	:return: the digest of the file
 	"""
-	files = []
-	for root, dirnames, filenames in os.walk(path, followlinks=True):
-		for filename in filenames:
-			path_file = os.path.join(root, filename)
-			files.append(path_file)
-	return files
+	with open(path_file, 'r') as f:
+		content = f.read()
+	md5, eclasses = None, None
+	for line in reversed(content.splitlines()):  # these entries are at the end of the file
+		if line.startswith("_md5_="): md5 = line[6:]
+		elif line.startswith("_eclasses_="): eclasses = line[11:]
+		else: continue
+		if (md5 is not None) and (eclasses is not None): break
+	if md5 is None: return hashlib.md5(content).hexdigest(), None
+	return md5, eclasses
 
 
 def get_package_name_from_path(package_path):
@@ -98,8 +166,8 @@ lrparsing.compile_grammar(depend)
 
 
 def visit_node_condition(parse_tree):
-	if parse_tree[1][1] == "!": return { 'type': "condition", 'not': "!", 'use': parse_tree[2][1] }
-	else: return { 'type': "condition", 'use': parse_tree[1][1] }
+	if parse_tree[1][1] == "!": return "condition", parse_tree[2][1], "!"
+	else: return "condition", parse_tree[1][1], None
 
 
 def visit_node_choice(parse_tree):
@@ -123,36 +191,31 @@ def visit_node_selection(parse_tree):
 		suffix = "="
 		use = use[:-1]
 
-	res = { 'type': "selection", 'use': use }
-	if prefix: res['prefix'] = prefix
+	default = None
 	if (len(parse_tree) > i + 2) and (parse_tree[i][1] == "("):
-		res['default'] = parse_tree[i+1][1]
+		default = parse_tree[i+1][1]
 		i = i+3
 	if len(parse_tree) > i: suffix = parse_tree[i][1]
-	if suffix: res['suffix'] = suffix
-	return res
+	return "selection", use, prefix, default, suffix
 
 ##
 
 
 def visit_node_require_element(parse_tree):
 	if parse_tree[1][0].name == "choice":
-		return {
-			'type': "rchoice",
-			'choice': visit_node_choice(parse_tree[1]),
-			'els': [ visit_node_require_element(el) for el in filter(lambda x: x[0].name == "require_element", parse_tree[3:])]
-			}
+		return (
+			"rchoice",
+			visit_node_choice(parse_tree[1]),
+			tuple([ visit_node_require_element(el) for el in filter(lambda x: x[0].name == "require_element", parse_tree[3:])]))
 	if parse_tree[1][0].name == "condition":
-		return {
-			'type': "rcondition",
-			'condition': visit_node_condition(parse_tree[1]),
-			'els': [ visit_node_require_element(el) for el in filter(lambda x: x[0].name == "require_element", parse_tree[3:])]
-			}
+		return (
+			"rcondition",
+			visit_node_condition(parse_tree[1]),
+			tuple([ visit_node_require_element(el) for el in filter(lambda x: x[0].name == "require_element", parse_tree[3:])]))
 	if parse_tree[1][1] == "(": # inner
-		return {
-			'type': "rinner",
-			'els': [ visit_node_require_element(el) for el in filter(lambda x: x[0].name == "require_element", parse_tree[1:])]
-			}
+		return (
+			"rinner",
+			tuple([ visit_node_require_element(el) for el in filter(lambda x: x[0].name == "require_element", parse_tree[1:])]))
 	neg = None
 	if parse_tree[1][1] == "!": # not use
 		neg = "!"
@@ -161,9 +224,7 @@ def visit_node_require_element(parse_tree):
 	else:
 		use = parse_tree[1][1]
 		i = 2
-	res = { 'type': "rsimple", 'use': use }
-	if neg: res['not'] = neg
-	return res
+	return "rsimple", use, neg
 
 
 def visit_node_require(parse_tree):
@@ -174,22 +235,19 @@ def visit_node_require(parse_tree):
 
 def visit_node_depend_element(parse_tree):
 	if parse_tree[1][0].name == "choice":
-		return {
-			'type': "dchoice",
-			'choice': visit_node_choice(parse_tree[1]),
-			'els': [ visit_node_depend_element(el) for el in filter(lambda x: x[0].name == "depend_element", parse_tree[3:])]
-			}
+		return (
+			"dchoice",
+			visit_node_choice(parse_tree[1]),
+			tuple([ visit_node_depend_element(el) for el in filter(lambda x: x[0].name == "depend_element", parse_tree[3:])]))
 	if parse_tree[1][0].name == "condition":
-		return {
-			'type': "dcondition",
-			'condition': visit_node_condition(parse_tree[1]),
-			'els': [ visit_node_depend_element(el) for el in filter(lambda x: x[0].name == "depend_element", parse_tree[3:])]
-			}
+		return (
+			"dcondition",
+			visit_node_condition(parse_tree[1]),
+			tuple([ visit_node_depend_element(el) for el in filter(lambda x: x[0].name == "depend_element", parse_tree[3:])]))
 	if parse_tree[1][1] == "(": # inner
-		return {
-			'type': "dinner",
-			'els': [ visit_node_depend_element(el) for el in filter(lambda x: x[0].name == "depend_element", parse_tree[1:])]
-			}
+		return (
+			"dinner",
+			tuple([ visit_node_depend_element(el) for el in filter(lambda x: x[0].name == "depend_element", parse_tree[1:])]))
 	neg = None
 	if parse_tree[1][1] == "!": # not atom
 		if parse_tree[2][1] == "!":
@@ -203,28 +261,270 @@ def visit_node_depend_element(parse_tree):
 	else:
 		atom = parse_tree[1][1]
 		i = 2
-	res = { 'type': "dsimple", 'atom': core_data.pattern_create_from_atom(atom) }
-	if neg: res['not'] = neg
+	selection = None
 	if len(parse_tree) > i:
-		res['selection'] = [ visit_node_selection(el) for el in filter(lambda x: x[0].name == "selection", parse_tree[i:])]
-	return res
+		selection = tuple([ visit_node_selection(el) for el in filter(lambda x: x[0].name == "selection", parse_tree[i:])])
+	return "dsimple", core_data.pattern_create_from_atom(atom), neg, selection
 
 
 def visit_node_depend(parse_tree):
 	return [ visit_node_depend_element(el) for el in parse_tree[1:] ]
 
 
+############################
+# hand-written parser
+# it directly constructs the same AST as the visit_node functions above on the lrparsing parse trees,
+# in one pass over the list of tokens (given by the same tokenization as T)
+
+
+__token_regexp = re.compile(r"\|\||\^\^|\?\?|[!?()[\],]|[^\s[\]()^|?!,]+")
+__operators = {"||", "^^", "??", "!", "?", "(", ")", "[", "]", ","}
+__choices = {"||", "^^", "??"}
+
+
+class ParseError(Exception):
+	pass
+
+
+def __tokenize(constraint_string):
+	tokens = __token_regexp.findall(constraint_string)
+	if sum([len(token) for token in tokens]) != len("".join(constraint_string.split())):
+		raise ParseError("unexpected character in \"" + constraint_string + "\"")
+	return tokens
+
+
+def __parse_id(tokens, i):
+	token = tokens[i]
+	if token in __operators: raise ParseError("unexpected token \"" + token + "\"")
+	return token
+
+
+def __parse_expected(tokens, i, expected):
+	if tokens[i] != expected: raise ParseError("expected \"" + expected + "\", got \"" + tokens[i] + "\"")
+	return i + 1
+
+
+def __parse_condition(tokens, i):
+	if tokens[i] == "!": return ("condition", __parse_id(tokens, i + 1), "!"), i + 3
+	else: return ("condition", __parse_id(tokens, i), None), i + 2
+
+
+def __parse_selection(tokens, i):
+	prefix = None
+	suffix = None
+	if tokens[i] == "!":
+		prefix = "!"
+		i = i + 1
+	use = __parse_id(tokens, i)
+	i = i + 1
+	if use[0] == "-":
+		prefix = "-"
+		use = use[1:]
+	if use[-1] == "=":
+		suffix = "="
+		use = use[:-1]
+
+	default = None
+	if tokens[i] == "(":
+		default = __parse_id(tokens, i + 1)
+		i = __parse_expected(tokens, i + 2, ")")
+	if (tokens[i] == "?") or (tokens[i] not in __operators):
+		suffix = tokens[i]
+		i = i + 1
+	return ("selection", use, prefix, default, suffix), i
+
+
+def __parse_require_elements(tokens, i):
+	res = []
+	while (i < len(tokens)) and (tokens[i] != ")"):
+		token = tokens[i]
+		if token in __choices:
+			els, i = __parse_require_elements(tokens, __parse_expected(tokens, i + 1, "("))
+			res.append(("rchoice", token, tuple(els)))
+		elif token == "(":
+			els, i = __parse_require_elements(tokens, i + 1)
+			res.append(("rinner", tuple(els)))
+		else:
+			j = i + 1 if token == "!" else i
+			use = __parse_id(tokens, j)
+			if (j + 1 < len(tokens)) and (tokens[j + 1] == "?"):
+				condition, i = __parse_condition(tokens, i)
+				els, i = __parse_require_elements(tokens, __parse_expected(tokens, i, "("))
+				res.append(("rcondition", condition, tuple(els)))
+			else:
+				res.append(("rsimple", use, "!" if token == "!" else None))
+				i = j + 1
+				continue
+		i = __parse_expected(tokens, i, ")")
+	return res, i
+
+
+def __parse_depend_elements(tokens, i):
+	res = []
+	while (i < len(tokens)) and (tokens[i] != ")"):
+		token = tokens[i]
+		if token in __choices:
+			els, i = __parse_depend_elements(tokens, __parse_expected(tokens, i + 1, "("))
+			res.append(("dchoice", token, tuple(els)))
+		elif token == "(":
+			els, i = __parse_depend_elements(tokens, i + 1)
+			res.append(("dinner", tuple(els)))
+		else:
+			j = i
+			while tokens[j] == "!": j = j + 1
+			atom = __parse_id(tokens, j)
+			if (j + 1 < len(tokens)) and (tokens[j + 1] == "?"):
+				if j - i > 1: raise ParseError("unexpected token \"!\"")
+				condition, i = __parse_condition(tokens, i)
+				els, i = __parse_depend_elements(tokens, __parse_expected(tokens, i, "("))
+				res.append(("dcondition", condition, tuple(els)))
+			else:
+				if j - i > 2: raise ParseError("unexpected token \"!\"")
+				neg = "!" * (j - i) if j > i else None
+				selections = None
+				i = j + 1
+				if (i < len(tokens)) and (tokens[i] == "["):
+					selections = []
+					if tokens[i + 1] != "]":
+						selection, i = __parse_selection(tokens, i + 1)
+						selections.append(selection)
+						while tokens[i] == ",":
+							selection, i = __parse_selection(tokens, i + 1)
+							selections.append(selection)
+					else: i = i + 1
+					i = __parse_expected(tokens, i, "]")
+					selections = tuple(selections)
+				res.append(("dsimple", core_data.pattern_create_from_atom(atom), neg, selections))
+				continue
+		i = __parse_expected(tokens, i, ")")
+	return res, i
+
+
+def __parse(parse_elements, constraint_string):
+	tokens = __tokenize(constraint_string)
+	try:
+		res, i = parse_elements(tokens, 0)
+	except IndexError:
+		raise ParseError("unexpected end of \"" + constraint_string + "\"")
+	if i != len(tokens): raise ParseError("unexpected token \"" + tokens[i] + "\"")
+	return res
+
+
 ############################
 # main functions
 
-def translate_require(require_string):
+def translate_require_reference(require_string):
 	return visit_node_require(require.parse(require_string)[1])
 
 
-def translate_depend(depend_string):
+def translate_depend_reference(depend_string):
 	return visit_node_depend(depend.parse(depend_string)[1])
 
 
+############################
+# parse cache
+# many egencache files share the same constraints (e.g., the different versions of a package).
+# The parse cache maps each constraint already translated to its AST, which is shared between all the spls using it
+
+parse_cache_version = 3  # to increment each time the structure of the AST (or of the cache) changes
+parse_cache = {}         # mapping from (kind, constraint string) to the AST of the constraint
+parse_cache_last_use = {}  # mapping from the keys of parse_cache to the last run that used them
+parse_cache_run = 0      # the number of the runs that translated egencache files with the parse cache
+parse_cache_max_age = 32  # the entries not used during that number of runs are removed from the parse cache
+parse_cache_new = {}     # the entries added to parse_cache since the last call to get_parse_cache_data
+parse_cache_used = set() # the keys of the entries of parse_cache hit since the last call to get_parse_cache_data
+parse_cache_hits = 0
+parse_cache_misses = 0
+
+
+def __translate_cached(kind, constraint_string, translate):
+	global parse_cache_hits, parse_cache_misses
+	key = kind, constraint_string
+	res = parse_cache.get(key)
+	if res is None:
+		parse_cache_misses = parse_cache_misses + 1
+		res = translate(constraint_string)
+		parse_cache[key] = res
+		parse_cache_new[key] = res
+	else:
+		parse_cache_hits = parse_cache_hits + 1
+		parse_cache_used.add(key)
+	return res
+
+
+def load_parse_cache(path, save_modality):
+	global parse_cache, parse_cache_last_use, parse_cache_run
+	if utils.get_data_file_version(path, save_modality) == parse_cache_version:
+		parse_cache_run, parse_cache, parse_cache_last_use = utils.load_data_file(path, save_modality)
+	else:
+		if os.path.exists(path): logging.info("The parse cache \"" + path + "\" has an old format: it is discarded")
+		parse_cache_run, parse_cache, parse_cache_last_use = 0, {}, {}
+
+
+def prune_parse_cache():
+	"""
+	ends the run of the parse cache: the entries added or hit during the translation of the egencache files
+	(i.e., since the statistics of the parse cache were reset) are marked as used in this run,
+	and the entries that were not used during the last parse_cache_max_age runs are removed.
+	Hence, an incremental translation does not remove the entries of the egencache files that it does not load
+	:return: the number of removed entries
+	"""
+	global parse_cache, parse_cache_last_use, parse_cache_run
+	parse_cache_run = parse_cache_run + 1
+	for key in parse_cache_used: parse_cache_last_use[key] = parse_cache_run
+	for key in parse_cache_new: parse_cache_last_use[key] = parse_cache_run
+	oldest_run = parse_cache_run - parse_cache_max_age
+	nb_entries = len(parse_cache)
+	parse_cache = {key: ast for key, ast in parse_cache.iteritems() if parse_cache_last_use.get(key, 0) > oldest_run}
+	parse_cache_last_use = {key: parse_cache_last_use[key] for key in parse_cache}
+	return nb_entries - len(parse_cache)
+
+
+def save_parse_cache(path, save_modality):
+	utils.phase_start("Saving the parse cache.")
+	utils.store_data_file(
+		path, (parse_cache_run, parse_cache, parse_cache_last_use), save_modality, parse_cache_version)
+	utils.phase_end("Saving Completed")
+
+
+def get_parse_cache_data():
+	"""
+	returns the new entries of the parse cache, the keys of the entries hit, and the number of hits and misses,
+	and resets them.
+	This function is used to collect the data of the parse caches of the worker processes
+	:return: the tuple of the entries added to the parse cache, the keys of the entries hit,
+		the number of hits and the number of misses
+	"""
+	global parse_cache_new, parse_cache_used, parse_cache_hits, parse_cache_misses
+	res = parse_cache_new, parse_cache_used, parse_cache_hits, parse_cache_misses
+	parse_cache_new, parse_cache_used, parse_cache_hits, parse_cache_misses = {}, set(), 0, 0
+	return res
+
+
+def translate_require(require_string):
+	"""
+	translates a REQUIRED_USE string into its hyportage AST.
+	The string is parsed with the hand-written parser, the lrparsing grammar being only used to report syntax errors
+	:param require_string: the REQUIRED_USE constraint
+	:return: the list of the AST of the elements of the constraint
+	"""
+	try: res = __parse(__parse_require_elements, require_string)
+	except ParseError: res = translate_require_reference(require_string)
+	return hyportage_constraint_ast.ast_intern_list(res)
+
+
+def translate_depend(depend_string):
+	"""
+	translates a DEPEND string (or RDEPEND, PDEPEND) into its hyportage AST.
+	The string is parsed with the hand-written parser, the lrparsing grammar being only used to report syntax errors
+	:param depend_string: the DEPEND constraint
+	:return: the list of the AST of the elements of the constraint
+	"""
+	try: res = __parse(__parse_depend_elements, depend_string)
+	except ParseError: res = translate_depend_reference(depend_string)
+	return hyportage_constraint_ast.ast_intern_list(res)
+
+
 ######################################################################
 # TRANSLATE A EGENCACHE FILE INTO A HYPORTAGE SPL
 ######################################################################
@@ -279,10 +579,10 @@ def create_spl_from_egencache_file(file_path):
 
 	iuses, use_manipulation = extract_iuse(iuses_string.split() if iuses_string else [])
 
-	fm_local = utils.compact_list(translate_require(fm_local)) if fm_local else []
-	fm_external = translate_depend(fm_external) if fm_external else []
-	fm_runtime = translate_depend(fm_runtime) if fm_runtime else []
-	fm_unloop = translate_depend(fm_unloop) if fm_unloop else []
+	fm_local = utils.compact_list(__translate_cached("require", fm_local, translate_require)) if fm_local else []
+	fm_external = __translate_cached("depend", fm_external, translate_depend) if fm_external else []
+	fm_runtime = __translate_cached("depend", fm_runtime, translate_depend) if fm_runtime else []
+	fm_unloop = __translate_cached("depend", fm_unloop, translate_depend) if fm_unloop else []
 	fm_combined = utils.compact_list(fm_external + fm_runtime + fm_unloop)
 	# 5. return the raw spl
 	return hyportage_data.SPL(
@@ -291,3 +591,10 @@ def create_spl_from_egencache_file(file_path):
 			keywords, license)
 
 
+def create_spl_from_egencache_file_with_cache_data(file_path):
+	"""
+	create the spl structure of a portage md5-cache file, together with the data of the parse cache
+	(see get_parse_cache_data) and the number of patterns created, so they can be merged in the main process
+	"""
+	spl = create_spl_from_egencache_file(file_path)
+	return spl, get_parse_cache_data(), core_data.pattern_pop_nb_requests()
@@ -167,15 +167,16 @@ class GETGuardedDependenciesVisitor(hyportage_constraint_ast.ASTVisitor):
 
 	def visitDependCONDITION(self, ctx):
 		self.guards = self.guards + 1
-		map(self.visitDependEL, ctx['els'])
+		map(self.visitDependEL, ctx[2])
 		self.guards = self.guards - 1
 
 	def visitDependSIMPLE(self, ctx):
-		pattern = ctx['atom']
+		pattern = ctx[1]
+		selects = ctx[3] is not None
 		if pattern in self.res:
 			if self.guards == 0: self.res[pattern]['guarded'] = False
-			if "selection" in ctx: self.res[pattern]['selects'] = True
-		else: self.res[pattern] = {'guarded': self.guards > 0, 'selects': "selection" in ctx}
+			if selects: self.res[pattern]['selects'] = True
+		else: self.res[pattern] = {'guarded': self.guards > 0, 'selects': selects}
 
 	def visitSPL(self, spl):
 		self.visitDepend(spl.fm_combined)